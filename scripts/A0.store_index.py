@@ -0,0 +1,39 @@
+# ------------------------------------------------------------------------------
+# Program Name: A0.store_index.py
+# Date Last Modified: October 2026
+# Program Purpose: Builds a metadata-only index of every candidate Pangeo zarr
+# store used by the A-scripts. Only the consolidated metadata (and the first and
+# last time value) of each store is read, so planning, sizing and validation can
+# happen before any data is downloaded. Stores already in the index are skipped.
+# Outputs: ./inputs/store_index.csv with the units, calendar, time range, shape,
+# chunking, dtype, size, branch time and parent experiment of each store.
+# TODO:
+# ------------------------------------------------------------------------------
+
+# Import packages
+import pandas as pd
+
+from hector_cmip6.catalog import fetch_pangeo_table
+from hector_cmip6.metadata import update_index
+from hector_cmip6.products import MIPS, PRODUCTS
+
+# Get pangeo table - model, variable info + zstore address
+dat = fetch_pangeo_table()
+
+# The variables, tables and experiments processed by the A-scripts, from the product registry
+# (tos adds ssp534-over, see A5a.tos_global.py), plus the co2 runs of A3.co2.py
+wanted = [(spec['variable'], spec['table'], exp) for spec in PRODUCTS.values() for exp in spec['experiments']]
+wanted += [('co2', 'Amon', exp) for exp in ['historical', 'ssp585']]
+wanted = pd.DataFrame(wanted, columns=['variable_id', 'table_id', 'experiment_id']).drop_duplicates()
+fx_vars = ['areacella', 'sftlf', 'areacello']
+
+keep = pd.MultiIndex.from_frame(dat[wanted.columns]).isin(pd.MultiIndex.from_frame(wanted))
+keep = keep & dat['activity_id'].isin(MIPS)
+
+# The fx fields of the models of those stores only, from any activity as find_fx takes them
+models = dat.loc[keep, 'source_id'].unique()
+keep = keep | (dat['variable_id'].isin(fx_vars) & dat['source_id'].isin(models))
+
+# Scan the metadata of the stores and save the index
+index = update_index(dat[keep].zstore)
+print(index.groupby('variable_id')['nbytes'].agg(['count', 'sum']))
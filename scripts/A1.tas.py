@@ -2,149 +2,128 @@
 # Program Name: A1.tas.py
 # Authors: Leeya Pressburger
 # Date Last Modified: March 2022
-# Program Purpose: Downloads CMIP6 `tas` data using Pangeo, coarsens monthly data
-# to an annual mean
-# Outputs: One csv file with annual, global tas data for every specified CMIP6
-# model, experiment, and ensemble rus saved as "model_experiment_ensemble.csv"
+# Program Purpose: Downloads CMIP6 `tas` data using Pangeo, calculates the area
+# weighted global, land and ocean (and optionally hemispheric) means in a single
+# pass over the data and coarsens monthly data to an annual mean (and any other
+# temporal means in FREQUENCIES)
+# Outputs: One csv file per region with annual tas data for every specified CMIP6
+# model, experiment, and ensemble run saved as "model_experiment_ensemble.csv"
+# in the directories of OUTDIRS (global in ./tas/csv1, land in ./tas_land,
+# ocean in ./tas_ocean)
 # TODO:
 # ------------------------------------------------------------------------------
 
 # Import packages
-import fsspec
-import intake
-import numpy as np
+import os
 import pandas as pd
-import xarray as xr
-import session_info
-import cftime
+
+from hector_cmip6.areas import cell_area
+from hector_cmip6.catalog import MissingFxError, fetch_pangeo_table, fx_zstores, parse_zstore, select_versions
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.frequency import compact, frequency_file, temporal_means
+from hector_cmip6.helpers import combine_df, get_ds_meta, get_lat_name, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.reduce import cos_lat_area, on_grid, region_weights
+from hector_cmip6.remote import open_store, open_fx
+from hector_cmip6.stream import stream_means
 
 # Setting to display all columns in dataframe
 pd.set_option('display.max_columns', None)
 
-# Helper functions from stitches project - data processing
-# https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_data.py#L29
-
-def get_lat_name(ds):
-    """ Get the name for the latitude values (could be either lat or latitude).
-    :param ds:    xarray dataset of CMIP data.
-    :return:    the string name for the latitude variable.
-    """
-    for lat_name in ['lat', 'latitude']:
-        if lat_name in ds.coords:
-            return lat_name
-    raise RuntimeError("Couldn't find a latitude coordinate")
-
-def global_mean(ds):
-    """ Get the weighted global mean for a variable.
-    :param ds:  xarray dataset of CMIP data.
-    :return:    xarray dataset of the weighted global mean.
-    """
-    lat = ds[get_lat_name(ds)]
-    weight = np.cos(np.deg2rad(lat))
-    weight /= weight.mean()
-    other_dims = set(ds.dims) - {'time'}
-    return (ds * weight).mean(other_dims)
-
-def get_ds_meta(ds):
-    """ Get the meta data information from the xarray data set.
-    :param ds:  xarray dataset of CMIP data.
-    :return:    pandas dataset of MIP information.
-    """
-    v = ds.variable_id
-
-    data = [{'variable':v,
-             'experiment':ds.experiment_id,
-             'units':ds[v].attrs['units'],
-            'frequency': ds.attrs["frequency"],
-             'ensemble':ds.attrs["variant_label"],
-             'model': ds.source_id}]
-    df = pd.DataFrame(data)
-
-    return df
-
 # https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_pangeo.py
 # Define the functions that are useful for working with the pangeo data base
 # see https://pangeo.io/index.html for more details.
 
-def fetch_pangeo_table():
-    """ Get a copy of the pangeo archive contents
-    :return: a pd data frame containing information about the model, source, experiment, ensemble and
-    so on that is available for download on pangeo.
-    """
-
-    # The url path that contains to the pangeo archive table of contents.
-    url = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
-    out = intake.open_esm_datastore(url)
-
-    return out.df
-
 def fetch_nc(zstore):
     """Extract data for a single file.
     :param zstore:                str of the location of the cmip6 data file on pangeo.
     :return:                      an xarray containing cmip6 data downloaded from the pangeo.
     """
-    ds = xr.open_zarr(fsspec.get_mapper(zstore))
+    ds = open_store(zstore)
     ds.sortby('time')
     return ds
 
-def combine_df(df1, df2):
-    """ Join the data frames together.
-    :param df1:   pandas data frame 1.
-    :param df2:   pandas data frame 2.
-    :return:    a single pandas data frame.
-    """
-
-    # Combine the two data frames with one another.
-    df1["j"] = 1
-    df2["j"] = 1
-    out = df1.merge(df2)
-    out = out.drop(columns="j")
-
-    return out
-
-def selstr(a, start, stop):
-    """ Select elements of a string from an array.
-    :param a:   array containing a string.
-    :param start: int referring to the first character index to select.
-    :param stop: int referring to the last character index to select.
-    :return:    array of strings
-    """
-    if type(a) not in [str]:
-        raise TypeError(f"a: must be a single string")
-
-    out = []
-    for i in range(start, stop):
-        out.append(a[i])
-    out = "".join(out)
-    return out
-
 # End of helper functions
 
 def get_tas(path):
-    """
+    """ For a pangeo file, calculate the area weighted global, land and ocean tas means from a
+    single read of the data. The cell areas come from the grid bounds (areacella is only read for
+    curvilinear grids, cos(lat) is used when it is missing), without sftlf only the global (and
+    hemispheric) means are calculated.
     :param path: str of the location of the cmip6 data file on pangeo
-    :return: csv file of outputs
+    :return: pd data frame of outputs, with an area column
     """
     # Get from cloud
     x = fetch_nc(path)
-    # Get global mean - monthly data - coarsen to annual
-    globalmean = global_mean(x)
-    annual_mean = globalmean.coarsen(time=12).mean()
     # Get data information
     meta = get_ds_meta(x)
-    # Get date information
-    t = annual_mean["time"].dt.strftime("%Y%m%d").values
+
+    # Weights of every region, stacked so that all regions come from one pass over the data
+    try:
+        area = cell_area(x, 'tas')
+    except MissingFxError:
+        area = cos_lat_area(x.tas, get_lat_name(x))
+    land_frac = None
+    landper_path = fx_zstores(meta.model[0], ['sftlf'])
+    if len(landper_path) > 0:
+        land_frac = on_grid(open_fx(landper_path[0])['sftlf'], area)
+    weights = region_weights(area, land_frac, hemispheres=HEMISPHERES, lat_name=get_lat_name(x))
+
+    # Regional means of the monthly data, reading the chunks of the store one at a time
+    monthly = stream_means(x.tas, weights)
+    # Get date information, the monthly values are cached and the annual and seasonal means are
+    # calculated from them in process
+    t = monthly["time"].dt.strftime("%Y%m%d").values
     year = list(map(lambda x: selstr(x, start=0, stop=4), t))
-    # Access values
-    val = annual_mean["tas"].values
-    # New dictionary with year and corresponding values
-    d = {'year': year, 'value': val}
-    # Create dataframe, combine with metadata
-    df = pd.DataFrame(data=d)
-    out = combine_df(meta, df)
+    month = list(map(lambda x: selstr(x, start=4, stop=6), t))
+
+    # One block of rows per region
+    out = []
+    for region in monthly['region'].values:
+        d = {'year': year, 'month': month, 'value': monthly.sel(region=region).values}
+        df = combine_df(meta.copy(), pd.DataFrame(data=d))
+        df["area"] = region
+        out.append(df)
+    return compact(pd.concat(out, ignore_index=True))
+
+def process(path):
+    """ Get the monthly regional tas for a pangeo file, from the cache if the inputs and the
+    spec of the reduction have not changed, and save its temporal means (FREQUENCIES) as one csv
+    file per region.
+    :param path:  str of the location of the cmip6 data file on pangeo
+    """
+    weights = fx_zstores(parse_zstore(path)['source_id'], ['areacella', 'sftlf'])
+    out = cache.fetch(get_tas, path, weights=weights, region='global, land, ocean',
+                      hemispheres=HEMISPHERES, mask='areacella * 0.01 * sftlf',
+                      aggregation='monthly mean')
     name = out["model"][0] + "_" + out["experiment"][0] + "_" + out["ensemble"][0]
-    # Save as csv
-    out.to_csv(name + ".csv", header=True, index=True)
+    for freq, means in temporal_means(out, FREQUENCIES).items():
+        for region, df in means.groupby("area", sort=False):
+            # Models quarantined for their land means only get the other regions
+            if region == 'land' and path not in land_ok:
+                continue
+            df = df.drop(columns="area").reset_index(drop=True)
+            if freq == FREQUENCIES[0]:
+                stats[region].update(df, path)
+            # Save as csv
+            df.to_csv(frequency_file(OUTDIRS[region], name + ".csv", freq, FREQUENCIES), header=True, index=True)
+
+# Also calculate the northern and southern hemisphere means
+HEMISPHERES = False
+
+# Temporal means to write, the first is the main product written to OUTDIRS and the others go to
+# a subdirectory of it named after the frequency, see hector_cmip6/frequency.py
+FREQUENCIES = ['annual']
+
+# Output directory of every region
+BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+OUTDIRS = {'global': os.path.join(BASEDIR, "tas", "csv1"),
+           'land': os.path.join(BASEDIR, "tas_land"),
+           'ocean': os.path.join(BASEDIR, "tas_ocean"),
+           'NH': os.path.join(BASEDIR, "tas_NH"),
+           'SH': os.path.join(BASEDIR, "tas_SH")}
 
 # Get pangeo table - model, variable info + zstore address
 dat = fetch_pangeo_table()
@@ -156,11 +135,35 @@ exps = ['1pctCO2', 'abrupt-4xCO2', 'abrupt-2xCO2', 'esm-hist', 'esm-ssp585', 'ss
         'ssp126', 'ssp245', 'ssp370', 'ssp434', 'ssp460', 'ssp585', 'historical']
 
 # Get zstore addresses for desired files
-address_all = dat[(dat['variable']=='tas') & (dat['domain'] == 'Amon') &
-                  (dat['activity_id'].isin(mips)) & & (dat['experiment_id'].isin(exps)].zstore
+address_all = dat[(dat['variable_id']=='tas') & (dat['table_id'] == 'Amon') &
+                  (dat['activity_id'].isin(mips)) & (dat['experiment_id'].isin(exps))]
+
+# Keep only the latest version of each dataset
+address_all = select_versions(address_all, policy='latest').zstore
+
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(address_all, 'tas', manifest)
 
-address_all = address_all.reset_index(drop=True)
+# Skip datasets that failed on a previous run
+quarantine = Quarantine()
+address_all = quarantine.exclude(address_all, 'tas')
+# The land means are not written for the datasets quarantined for tas_land, i.e. the models whose
+# land means used to be dropped by A2.tas_land.py
+land_ok = set(quarantine.exclude(address_all, 'tas_land'))
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics of every region are updated as each run finishes
+stats = {'global': EnsembleStats('tas'), 'land': EnsembleStats('tas_land'),
+         'ocean': EnsembleStats('tas_ocean'), 'NH': EnsembleStats('tas_NH'),
+         'SH': EnsembleStats('tas_SH')}
 
 # Process data
 for items in address_all:
-    get_tas(items)
+    run_safely(process, items, 'tas', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+for region_stats in stats.values():
+    region_stats.save()
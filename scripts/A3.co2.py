@@ -2,131 +2,53 @@
 # Program Name: A3.co2.py
 # Authors: Leeya Pressburger
 # Date Last Modified: March 2022
-# Program Purpose: Downloads CMIP6 `co2` data using Pangeo, coarsens monthly data
-# to an annual mean
+# Program Purpose: Downloads CMIP6 `co2` data using Pangeo, keeps only the
+# pressure level(s) set by LEVEL, coarsens monthly data to an annual mean
 # Outputs: One csv file with annual co2 data for every specified CMIP6
 # model, experiment, and ensemble run saved as "model_experiment_ensemble.csv"
 # TODO:
 # ------------------------------------------------------------------------------
 
 # Import packages
-import fsspec
-import intake
-import numpy as np
 import pandas as pd
-import xarray as xr
 import session_info
-import cftime
+
+from hector_cmip6.catalog import fetch_pangeo_table, select_versions
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.helpers import combine_df, get_ds_meta, global_mean, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.remote import open_store
+from hector_cmip6.subset import select_level
 
 # Display all columns in dataframe
 pd.set_option('display.max_columns', None)
 
-# Helper functions from stitches project - data processing
-# https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_data.py#L29
-
-def get_lat_name(ds):
-    """ Get the name for the latitude values (could be either lat or latitude).
-    :param ds:    xarray dataset of CMIP data.
-    :return:    the string name for the latitude variable.
-    """
-    for lat_name in ['lat', 'latitude']:
-        if lat_name in ds.coords:
-            return lat_name
-    raise RuntimeError("Couldn't find a latitude coordinate")
-
-def global_mean(ds):
-    """ Get the weighted global mean for a variable.
-    :param ds:  xarray dataset of CMIP data.
-    :return:    xarray dataset of the weighted global mean.
-    """
-    lat = ds[get_lat_name(ds)]
-    weight = np.cos(np.deg2rad(lat))
-    weight /= weight.mean()
-    other_dims = set(ds.dims) - {'time'}
-    return (ds * weight).mean(other_dims)
-
-def get_ds_meta(ds):
-    """ Get the meta data information from the xarray data set.
-    :param ds:  xarray dataset of CMIP data.
-    :return:    pandas dataset of MIP information.
-    """
-    v = ds.variable_id
-
-    data = [{'variable':v,
-             'experiment':ds.experiment_id,
-             'units':ds[v].attrs['units'],
-            'frequency': ds.attrs["frequency"],
-             'ensemble':ds.attrs["variant_label"],
-             'model': ds.source_id}]
-    df = pd.DataFrame(data)
-
-    return df
-
 # https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_pangeo.py
 # Define the functions that are useful for working with the pangeo data base
 # see https://pangeo.io/index.html for more details.
 
-def fetch_pangeo_table():
-    """ Get a copy of the pangeo archive contents
-    :return: a pd data frame containing information about the model, source, experiment, ensemble and
-    so on that is available for download on pangeo.
-    """
-
-    # The url path that contains to the pangeo archive table of contents.
-    url = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
-    out = intake.open_esm_datastore(url)
-
-    return out.df
-
 def fetch_nc(zstore):
     """Extract data for a single file.
     :param zstore:                str of the location of the cmip6 data file on pangeo.
     :return:                      an xarray containing cmip6 data downloaded from the pangeo.
     """
-    ds = xr.open_zarr(fsspec.get_mapper(zstore))
+    ds = open_store(zstore)
     ds.sortby('time')
     return ds
 
-def combine_df(df1, df2):
-    """ Join the data frames together.
-    :param df1:   pandas data frame 1.
-    :param df2:   pandas data frame 2.
-    :return:    a single pandas data frame.
-    """
-
-    # Combine the two data frames with one another.
-    df1["j"] = 1
-    df2["j"] = 1
-    out = df1.merge(df2)
-    out = out.drop(columns="j")
-
-    return out
-
-def selstr(a, start, stop):
-    """ Select elements of a string from an array.
-    :param a:   array containing a string.
-    :param start: int referring to the first character index to select.
-    :param stop: int referring to the last character index to select.
-    :return:    array of strings
-    """
-    if type(a) not in [str]:
-        raise TypeError(f"a: must be a single string")
-
-    out = []
-    for i in range(start, stop):
-        out.append(a[i])
-    out = "".join(out)
-    return out
-
 # End of helper functions
 
 def get_co2(path):
     """ For a pangeo file, access CO2 data.
     :param path:  str of the location of the cmip6 data file on pangeo
-    :return:      csv file of output data
+    :return:      pd data frame of output data
     """
     # Get from cloud
     x = fetch_nc(path)
+    # Keep only the requested level(s), before anything is read
+    x = select_level(x, LEVEL)
     # Get global mean - monthly data - coarsen to annual
     globalmean = global_mean(x)
     annual_mean = globalmean.coarsen(time=12, boundary="trim").mean()
@@ -142,10 +64,26 @@ def get_co2(path):
     # Create dataframe, combine with metadata
     df = pd.DataFrame(data=d)
     out = combine_df(meta, df)
-    name = out["model"][0] + "_"  + out["experiment"][0] + "_" + out["ensemble"][0]
+    return out
+
+def process(path):
+    """ Get the annual global co2 for a pangeo file, from the cache if the inputs and the
+    spec of the reduction have not changed, and save it as a csv file.
+    :param path:  str of the location of the cmip6 data file on pangeo
+    """
+    out = cache.fetch(get_co2, path, region='global', mask='cos(lat)', aggregation='annual mean, trim',
+                      level=LEVEL)
+    stats.update(out, path)
+    name = out["model"][0] + "_" + out["experiment"][0] + "_" + out["ensemble"][0]
     # Save as csv
     out.to_csv(name + ".csv", header=True, index=True)
 
+# Pressure level of the Amon co2 (plev19) to use: 'surface' (the lowest level with data of every
+# column, 1000 hPa except over high terrain), a pressure in Pa (i.e. 50000) or 'column' for the
+# pressure weighted column mean. The levels are selected before the data is read, so only the
+# levels used are downloaded.
+LEVEL = 'surface'
+
 # Get pangeo table - model, variable info + zstore address
 dat = fetch_pangeo_table()
 
@@ -156,11 +94,30 @@ exps = ['historical', 'ssp585']
 mips = ['CMIP', 'ScenarioMIP']
 
 address_all = dat[(dat['variable_id'] == 'co2') & (dat['experiment_id'].isin(exps))
-                   & (dat['activity_id'].isin(mips))].zstore
-address_all = address_all.reset_index(drop = True)
+                   & (dat['activity_id'].isin(mips))]
+
+# Keep only the latest version of each dataset
+address_all = select_versions(address_all, policy='latest').zstore
+
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(address_all, 'co2', manifest)
+
+# Skip datasets that failed on a previous run
+quarantine = Quarantine()
+address_all = quarantine.exclude(address_all, 'co2')
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics are updated as each run finishes
+stats = EnsembleStats('co2')
 
 # Process data
 for items in address_all:
-    get_co2(items)
+    run_safely(process, items, 'co2', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+stats.save()
 
 session_info.show()
@@ -4,26 +4,19 @@
 # Date Last Modified: March 2022
 # Program Purpose: Accessing netCDF file locations for all heatflux variables:
 # hfls, hfss, rlds, rlus, rsds, rsus
-# Additional processing is required in R: ./scripts/B4a.heatflux_preprocessing.R
+# Only runs that have all six variables, and models that have the sftlf field the
+# A4a-A4f scripts need, are kept, see hector_cmip6.catalog. The cell areas come
+# from the grid (hector_cmip6.areas), so areacella is not required.
+# Outputs: ./inputs/heatflux_addresses.csv and one ./inputs/<variable>_addresses.csv
+# file per heat flux variable, read by A4a-A4f.
 # TODO:
 # ------------------------------------------------------------------------------
 
 # Import packages
-import intake
 import pandas as pd
 
-
-def fetch_pangeo_table():
-    """ Get a copy of the pangeo archive contents
-    :return: a pd data frame containing information about the model, source, experiment, ensemble and
-    so on that is available for download on pangeo.
-    """
-
-    # The url path that contains to the pangeo archive table of contents.
-    url = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
-    out = intake.open_esm_datastore(url)
-
-    return out.df
+from hector_cmip6.catalog import fetch_pangeo_table, select_complete, select_versions
+from hector_cmip6.quarantine import Quarantine
 
 # Get Pangeo table
 dat = fetch_pangeo_table()
@@ -36,17 +29,27 @@ exps = ['1pctCO2', 'abrupt-4xCO2', 'abrupt-2xCO2', 'esm-hist', 'esm-ssp585', 'ss
         
 mips = ['CMIP', 'ScenarioMIP']
 
-fails = ['BCC-CSM2-MR', 'AWI-CM-1-1-MR', 'NUIST/NESM3', 'NorESM2-LM', 
-'FGOALS-g3', 'FGOALS-f3-L', 'KACE-1-0-G', 'GISS-E2-2-G', 'CCCR-IITM', 
-'THU/CIESM', 'CAS-ESM2-0', 'FIO-ESM-2-0']
+# Pull info for experiments of interest, keep the fx fields so their availability can be checked
+dat = dat[(dat['experiment_id'].isin(exps) | dat['table_id'].isin(['fx'])) &
+          (dat['activity_id'].isin(mips))]
 
-# Pull info for variables and experiments of interest
-data = dat[(dat['variable_id'].isin(vars)) & (dat['experiment_id'].isin(exps)) &
-           (dat['table_id'] == 'Amon') & (dat['activity_id'].isin(mips)) &
-           (~dat['source_id'].isin(fails))]
+# Drop models and datasets that failed in A4a-A4f before, see ./inputs/quarantine.csv.
+# A run with one quarantined variable is then incomplete and dropped entirely.
+quarantine = Quarantine()
+dat = dat[dat['zstore'].isin(quarantine.exclude(dat['zstore'], 'heatflux'))]
 
-data = data.reset_index(drop = True)
+# Keep only the latest version of each dataset
+dat = select_versions(dat, policy='latest')
+
+# Keep only runs that have all six variables plus sftlf for the model
+data = select_complete(dat, vars, fx_vars=['sftlf'], table_id='Amon')
 
 # Create name identifier
 data['name'] = data['source_id'] + "/" + data['experiment_id'] + "/" + data['member_id']
 data.to_csv("./inputs/heatflux_addresses.csv", header=True, index=True)
+
+# Write out the zstore addresses for each variable, to be used by A4a-A4f
+for v in vars:
+    address = data.loc[data['variable_id'] == v, 'zstore'].reset_index(drop=True)
+    address = pd.DataFrame({'x': address.values}, index=range(1, len(address) + 1))
+    address.to_csv("./inputs/" + v + "_addresses.csv", header=True, index=True)
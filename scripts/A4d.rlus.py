@@ -10,135 +10,106 @@
 # ------------------------------------------------------------------------------
 
 # Import packages
-import fsspec
-import intake
-import numpy as np
 import pandas as pd
-import xarray as xr
 import session_info
-import cftime
+
+from hector_cmip6.areas import cell_area
+from hector_cmip6.catalog import find_fx, fx_zstores, parse_zstore
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.frequency import compact, frequency_file, temporal_means
+from hector_cmip6.helpers import combine_df, get_ds_meta, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.reduce import on_grid
+from hector_cmip6.stream import stream_means
+from hector_cmip6.remote import open_store, open_fx
 
 # Display all columns in dataframe
 pd.set_option('display.max_columns', None)
 
-# Helper functions from stitches project - data processing
-# https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_data.py#L29
-def get_ds_meta(ds):
-    """ Get the meta data information from the xarray data set.
-    :param ds:  xarray dataset of CMIP data.
-    :return:    pandas dataset of MIP information.
-    """
-    v = ds.variable_id
-
-    data = [{'variable':v,
-             'experiment':ds.experiment_id,
-             'units':ds[v].attrs['units'],
-            'frequency': ds.attrs["frequency"],
-             'ensemble':ds.attrs["variant_label"],
-             'model': ds.source_id}]
-    df = pd.DataFrame(data)
-
-    return df
-
-# https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_pangeo.py
-# Define the functions that are useful for working with the pangeo data base
-# see https://pangeo.io/index.html for more details.
-def combine_df(df1, df2):
-    """ Join the data frames together.
-    :param df1:   pandas data frame 1.
-    :param df2:   pandas data frame 2.
-    :return:    a single pandas data frame.
-    """
-
-    # Combine the two data frames with one another.
-    df1["j"] = 1
-    df2["j"] = 1
-    out = df1.merge(df2)
-    out = out.drop(columns="j")
-
-    return out
-
-def selstr(a, start, stop):
-    """ Select elements of a string from an array.
-    :param a:   array containing a string.
-    :param start: int referring to the first character index to select.
-    :param stop: int referring to the last character index to select.
-    :return:    array of strings
-    """
-    if type(a) not in [str]:
-        raise TypeError(f"a: must be a single string")
-
-    out = []
-    for i in range(start, stop):
-        out.append(a[i])
-    out = "".join(out)
-    return out
-
-# End of helper functions
-
 def get_rlus(path):
     """ For a pangeo file, calculate the area weighted ocean mean. To be used with heat flux variables.
     :param path:  str zstore path corresponding to a pangeo netcdf
-    :return:      csv file of output data
+    :return:      pd data frame of output data
     """
-    ds = xr.open_zarr(fsspec.get_mapper(path), consolidated=True)
+    ds = open_store(path)
 
     # Extract the meta data
     meta_data = get_ds_meta(ds)
 
-    # Based on the meta data find the correct areacella file
-    df = pd.read_csv('https://storage.googleapis.com/cmip6/cmip6-zarr-consolidated-stores.csv')
-    query1 = "variable_id == 'areacella' & source_id == '" + meta_data.model[0] + "'"
-    query2 = "variable_id == 'sftlf' & source_id == '" + meta_data.model[0] + "'"
-    df_area = df.query(query1)
-    if df_area.shape[0] < 1:
-        raise RuntimeError("Could not find areacella for " + path)
-    df_landper = df.query(query2)
-    if df_landper.shape[0] < 1:
-        raise RuntimeError("Could not find sftlf for " + path)
-
-    # Read in the area cella file
-    ds_area = xr.open_zarr(fsspec.get_mapper(df_area.zstore.values[0]), consolidated=True)
-    ds_landper = xr.open_zarr(fsspec.get_mapper(df_landper.zstore.values[0]), consolidated=True)
-
-    # Select only the ocean cell area values in the HL regions, use this mask as the area weights.
-    ### CHANGE THIS
-    # (1 * mask) replaces T/F with 0 and 1
-    mask = 1 * (ds_area['areacella'] * (1 - (0.01 * ds_landper['sftlf'])))
-    # Replace 0 and 1 with NA
-    mask = xr.where(mask == 0, np.nan, mask)
-    masked_area = ds_area * mask
-
-    # Using the ocean cell area and total area calculate the weighted mean over the ocean.
-    total_area = masked_area.areacella.sum(set(masked_area.areacella.dims), skipna=True)
-    other_dims = set(ds.rlus.dims) - {'time'}
-
-    # Weighted average calculation
-    wa = (ds.rlus * masked_area.areacella).sum(dim=other_dims) / total_area
-    wa = wa.coarsen(time=12, boundary="trim").mean()
-
-    # Extract time information.
+    # Based on the meta data find the correct sftlf file,
+    # raises a MissingFxError if the model does not have it
+    landper_path = find_fx('sftlf', meta_data.model[0])
+
+    # Cell areas from the grid bounds, areacella is only read for curvilinear grids
+    ds_area = cell_area(ds, 'rlus').to_dataset(name='areacella')
+    ds_landper = on_grid(open_fx(landper_path)['sftlf'], ds_area['areacella']).to_dataset(name='sftlf')
+
+    # The ocean area of every cell is the weight of the ocean mean, cells without a land
+    # fraction count as ocean. These are the weights of python -m hector_cmip6 extract.
+    masked_area = (ds_area['areacella'] * (1 - 0.01 * ds_landper['sftlf'].fillna(0))).to_dataset(name='areacella')
+
+    # Weighted mean over the ocean, the chunks of the store are read one at a time in their native order
+    wa = stream_means(ds.rlus, masked_area.areacella, skipna=False)
+
+    # Extract time information, the monthly values are cached and the annual and seasonal
+    # means are calculated from them in process.
     t = wa["time"].dt.strftime("%Y%m%d").values
     year = list(map(lambda x: selstr(x, start=0, stop=4), t))
+    month = list(map(lambda x: selstr(x, start=4, stop=6), t))
 
     # Format into a data frame.
     val = wa.values
-    d = {'year': year, 'value': val}
+    d = {'year': year, 'month': month, 'value': val}
     df = pd.DataFrame(data=d)
     out = combine_df(meta_data, df)
 
+    return compact(out)
+
+def process(path):
+    """ Get the monthly ocean rlus for a pangeo file, from the cache if the inputs and the
+    spec of the reduction have not changed, and save its temporal means (FREQUENCIES) as csv files.
+    :param path:  str of the location of the cmip6 data file on pangeo
+    """
+    source = parse_zstore(path)['source_id']
+    weights = fx_zstores(source, ['areacella', 'sftlf'])
+    out = cache.fetch(get_rlus, path, weights=weights,
+                      region='ocean', mask='areacella * (1 - 0.01 * sftlf.fillna(0))', aggregation='monthly mean')
     name = out["model"][0] + "_" + out["experiment"][0] + "_" + out["ensemble"][0]
-    # Save as csv file
-    out.to_csv("./rlus/" + name + ".csv", header=True, index=True)
+    for freq, df in temporal_means(out, FREQUENCIES).items():
+        if freq == FREQUENCIES[0]:
+            stats.update(df, path)
+        # Save as csv
+        df.to_csv(frequency_file("./rlus", name + ".csv", freq, FREQUENCIES), header=True, index=True)
+
+# Temporal means to write, the first is the main product written to ./rlus and the others go to
+# ./rlus/<frequency>, see hector_cmip6/frequency.py
+FREQUENCIES = ['annual']
 
 # Read in addresses
 address_rlus = pd.read_csv("./inputs/rlus_addresses.csv")
 address_all = address_rlus["x"]
 
-address_all= address_all.reset_index(drop=True)
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(address_all, 'heatflux', manifest, name='rlus')
+
+# Skip datasets that failed on a previous run, see ./inputs/quarantine.csv
+quarantine = Quarantine()
+address_all = quarantine.exclude(address_all, 'heatflux')
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics are updated as each run finishes
+stats = EnsembleStats('rlus')
 
 # Process data
 for items in address_all:
-    get_rlus(items)
+    run_safely(process, items, 'heatflux', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+stats.save()
 
 session_info.show()
@@ -9,17 +9,29 @@
 # TODO:
 # ------------------------------------------------------------------------------
 # 0. Load packages, define functions, & set up script.
-import fsspec
 import intake  # must be v 0.6.2
-import xarray as xr
 import pandas as pd
 import os as os
 
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.frequency import compact, frequency_file, temporal_means
+from hector_cmip6.catalog import find_fx, parse_zstore, select_versions
+from hector_cmip6.helpers import combine_df, get_ds_meta, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.remote import open_store, open_fx
+from hector_cmip6.stream import stream_means
+
 # Set up the base directory
 BASEDIR = os.getcwd()
 
 if not BASEDIR.endswith("hector_cmip6data"):
-    raise TypeError(f'BASEDIR should be the root hector_cmip6data repository')
+    raise TypeError('BASEDIR should be the root hector_cmip6data repository')
+
+# Temporal means to write, the first is the main product written to ./tos/global and the others go
+# to ./tos/global/<frequency>, see hector_cmip6/frequency.py
+FREQUENCIES = ['monthly']
 
 # An example of how to get the weighted area
 #https://nordicesmhub.github.io/NEGI-Abisko-2019/training/Example_model_global_arctic_average.html
@@ -41,75 +53,8 @@ query = dict(
 catalog = catalog.search(require_all_on=["source_id"], **query)
 catalog = catalog.df.copy().reset_index(drop=True)
 catalog = catalog.loc[catalog['member_id'].str.contains('p1')].copy().reset_index(drop=True)
-
-
-def get_ds_meta(ds):
-    """ Get the meta data information from the xarray data set.
-
-    :param ds:  xarray dataset of CMIP data.
-
-    :return:    pandas dataset of MIP information.
-    """
-    v = ds.variable_id
-
-    data = [{'variable': v,
-             'experiment': ds.experiment_id,
-             'units': ds[v].attrs['units'],
-             'ensemble': ds.attrs["variant_label"],
-             'model': ds.source_id}]
-    df = pd.DataFrame(data)
-
-    return df
-
-
-def get_lat_name(ds):
-    """ Get the name for the latitude values (could be either lat or latitude).
-
-    :param ds:    xarray dataset of CMIP data.
-
-    :return:    the string name for the latitude variable.
-    """
-    for lat_name in ['lat', 'latitude']:
-        if lat_name in ds.coords:
-            return lat_name
-    raise RuntimeError("Couldn't find a latitude coordinate")
-
-
-def selstr(a, start, stop):
-    """ Select elements of a string from an array.
-
-    :param a:   array containing a string.
-    :param start: int referring to the first character index to select.
-    :param stop: int referring to the last character index to select.
-
-    :return:    array of strings
-    """
-    if type(a) not in [str]:
-        raise TypeError(f"a: must be a single string")
-
-    out = []
-    for i in range(start, stop):
-        out.append(a[i])
-    out = "".join(out)
-    return out
-
-
-def combine_df(df1, df2):
-    """ Join the data frames together.
-
-    :param df1:   pandas data frame 1.
-    :param df2:   pandas data frame 2.
-
-    :return:    a single pandas data frame.
-    """
-
-    # Combine the two data frames with one another.
-    df1["j"] = 1
-    df2["j"] = 1
-    out = df1.merge(df2)
-    out = out.drop(columns="j")
-
-    return out
+# Keep only the latest version of each dataset, older versions would be duplicates
+catalog = select_versions(catalog, policy='latest').reset_index(drop=True)
 
 
 def global_mean(path):
@@ -120,27 +65,20 @@ def global_mean(path):
     :return:    xarray dataset of the weighted global mean.
     """
     # Import the data file
-    ds = xr.open_zarr(fsspec.get_mapper(path), consolidated=True)
+    ds = open_store(path)
 
     # Extract the meta data
-    meta_data = get_ds_meta(ds)
+    meta_data = get_ds_meta(ds, frequency=False)
 
     # Get the weighted mean global temperature based on the latitude.
     # Based on the meta data find the correct areacello file
-    df = pd.read_csv('https://storage.googleapis.com/cmip6/cmip6-zarr-consolidated-stores.csv')
-    query = "variable_id == 'areacello' & source_id == '" + meta_data.model[0] + "'" + \
-            " & grid_label == 'gn'"
-    df_area = df.query(query)
-    if df_area.shape[0] < 1:
-        raise RuntimeError("Could not find areacello for " + path)
+    area_path = find_fx('areacello', meta_data.model[0], grid_label='gn')
 
     # Read in the area cello file
-    ds_area = xr.open_zarr(fsspec.get_mapper(df_area.zstore.values[0]), consolidated=True)
+    ds_area = open_fx(area_path)
 
-    # Using the ocean cell area and total area calculate the weighted mean over the ocean.
-    total_area = ds_area.areacello.sum(set(ds_area.areacello.dims), skipna=True)
-    other_dims = set(ds.tos.dims) - {'time'}
-    tos_ts = (ds.tos * ds_area.areacello).sum(dim=other_dims) / total_area
+    # Area weighted mean over the ocean, the chunks of the store are read one at a time in their native order.
+    tos_ts = stream_means(ds.tos, ds_area.areacello, skipna=False)
 
     # Extract time information.
     t = tos_ts["time"].dt.strftime("%Y%m%d").values
@@ -154,7 +92,7 @@ def global_mean(path):
     out = combine_df(meta_data, df)
     out["area"] = "global"
 
-    return (out)
+    return compact(out)
 
 # ------------------------------------------------------------------------------
 # 1. Run code!
@@ -165,13 +103,33 @@ if not os.path.exists(outdir):
     os.mkdir(outdir)
 
 catalog.to_csv(BASEDIR + "/tos/tos_historical_catalog.csv")
-# Process the files
-for file in catalog["zstore"]:
-    try:
-        print(file)
-        ofile = outdir + file.replace("/", "_") + '.csv'
-        ofile = ofile.replace("gs:__cmip6_", "")
-        out = global_mean(file)
-        out.to_csv(ofile, index=False)
-    except:
-        print("problem with " + file)
+# Process the files, skipping the ones that failed on a previous run
+def process(file):
+    print(file)
+    ofile = outdir + file.replace("/", "_") + '.csv'
+    ofile = ofile.replace("gs:__cmip6_", "")
+    weights = [find_fx('areacello', parse_zstore(file)['source_id'], grid_label='gn')]
+    out = cache.fetch(global_mean, file, weights=weights, region='global', mask='areacello',
+                      aggregation='monthly mean')
+    name = os.path.basename(ofile)
+    for freq, df in temporal_means(out, FREQUENCIES).items():
+        if freq == FREQUENCIES[0]:
+            stats.update(df, file)
+        df.to_csv(frequency_file(outdir, name, freq, FREQUENCIES), index=False)
+
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(catalog["zstore"], 'tos_global', manifest)
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics are updated as each run finishes
+stats = EnsembleStats('tos_global')
+
+quarantine = Quarantine()
+for file in quarantine.exclude(address_all, 'tos_global'):
+    run_safely(process, file, 'tos_global', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+stats.save()
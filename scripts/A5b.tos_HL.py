@@ -6,94 +6,45 @@
 # HL is defined as latitude > 55.
 # Outputs: One csv per model/experiment/ensemble/version is writen out
 # to the ./tos/HL directory. Note that further processing occurs in at
-# the B5 script level.
+# the B5 script level. Only the years in YEAR_WINDOWS are downloaded.
 # TODO:
 # ------------------------------------------------------------------------------
 # 0. Load packages
-import fsspec
 import intake  # must be v 0.6.2
 import xarray as xr
 import pandas as pd
 import os as os
 import numpy as np
 
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.frequency import compact, frequency_file, temporal_means
+from hector_cmip6.catalog import find_fx, parse_zstore, select_versions
+from hector_cmip6.helpers import combine_df, get_ds_meta, get_lat_name, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.remote import open_store, open_fx
+from hector_cmip6.stream import stream_means
+from hector_cmip6.subset import select_years, year_window
+
 # Set up the base directory
 BASEDIR = os.getcwd()
 
 if not BASEDIR.endswith("hector_cmip6data"):
-    raise TypeError(f'BASEDIR should be the root hector_cmip6data repository')
-
-
-# 1. Define functions ----------------------------------------------------------------------------------
-def get_ds_meta(ds):
-    """ Get the meta data information from the xarray data set.
-
-    :param ds:  xarray dataset of CMIP data.
-
-    :return:    pandas dataset of MIP information.
-    """
-    v = ds.variable_id
-
-    data = [{'variable': v,
-             'experiment': ds.experiment_id,
-             'units': ds[v].attrs['units'],
-             'ensemble': ds.attrs["variant_label"],
-             'model': ds.source_id}]
-    df = pd.DataFrame(data)
-
-    return df
-
-
-def get_lat_name(ds):
-    """ Get the name for the latitude values (could be either lat or latitude).
-
-    :param ds:    xarray dataset of CMIP data.
-
-    :return:    the string name for the latitude variable.
-    """
-    for lat_name in ['lat', 'latitude']:
-        if lat_name in ds.coords:
-            return lat_name
-    raise RuntimeError("Couldn't find a latitude coordinate")
-
-
-def selstr(a, start, stop):
-    """ Select elements of a string from an array.
-
-    :param a:   array containing a string.
-    :param start: int referring to the first character index to select.
-    :param stop: int referring to the last character index to select.
-
-    :return:    array of strings
-    """
-    if type(a) not in [str]:
-        raise TypeError(f"a: must be a single string")
-
-    out = []
-    for i in range(start, stop):
-        out.append(a[i])
-    out = "".join(out)
-    return out
+    raise TypeError('BASEDIR should be the root hector_cmip6data repository')
 
+# Only these years of the historical run are used downstream (B5b & C5b), selecting
+# them before the reduction means only the overlapping chunks are downloaded.
+YEAR_WINDOWS = {('tos', 'historical'): (1850, 1900)}
 
-def combine_df(df1, df2):
-    """ Join the data frames together.
-
-    :param df1:   pandas data frame 1.
-    :param df2:   pandas data frame 2.
-
-    :return:    a single pandas data frame.
-    """
-
-    # Combine the two data frames with one another.
-    df1["j"] = 1
-    df2["j"] = 1
-    out = df1.merge(df2)
-    out = out.drop(columns="j")
-
-    return out
+# The HL region is poleward of this latitude.
+HL_LAT = 55
 
+# Temporal means to write, the first is the main product written to ./tos/HL and the others go to
+# ./tos/HL/<frequency>, see hector_cmip6/frequency.py
+FREQUENCIES = ['annual']
 
+# 1. Define functions ----------------------------------------------------------------------------------
 def mean_HL_tos(path):
     """ For a pangeo tos file calculate the area weighted mean tos for the HL region.
 
@@ -101,46 +52,42 @@ def mean_HL_tos(path):
 
     :return:      pandas.core.frame.DataFrame of area-weighted HL tos from a single netcdf file
     """
-    ds = xr.open_zarr(fsspec.get_mapper(path), consolidated=True)
+    ds = open_store(path)
 
     # Extract the meta data & the latitude name.
-    meta_data = get_ds_meta(ds)
+    meta_data = get_ds_meta(ds, frequency=False)
     lat_name = get_lat_name(ds)
+    ds = select_years(ds, year_window(YEAR_WINDOWS, 'tos', meta_data.experiment[0]))
 
     # Based on the meta data find the correct areacello file
-    df = pd.read_csv('https://storage.googleapis.com/cmip6/cmip6-zarr-consolidated-stores.csv')
-    query = "variable_id == 'areacello' & source_id == '" + meta_data.model[0] + "'" + \
-            " & grid_label == 'gn'"
-    df_area = df.query(query)
-    if df_area.shape[0] < 1:
-        raise RuntimeError("Could not find areacello for " + path)
+    area_path = find_fx('areacello', meta_data.model[0], grid_label='gn')
 
     # Read in the area cello file
-    ds_area = xr.open_zarr(fsspec.get_mapper(df_area.zstore.values[0]), consolidated=True)
+    ds_area = open_fx(area_path)
 
     # Select only the ocean cell area values in the HL regions, use this mask as the area weights.
-    mask = 1 * (ds_area[lat_name] >= 55) | (ds_area[lat_name] <= -55)
+    mask = 1 * (ds_area[lat_name] >= HL_LAT) | (ds_area[lat_name] <= -HL_LAT)
     mask = xr.where(mask == 0, np.nan, mask)
     masked_area = ds_area * mask
 
-    # Using the ocean cell area and total area calculate the weighted mean over the ocean.
-    total_area = masked_area.areacello.sum(set(masked_area.areacello.dims), skipna=True)
-    other_dims = set(ds.tos.dims) - {'time'}
-    tos_ts = (ds.tos * masked_area.areacello).sum(dim=other_dims) / total_area
-    tos_ts = tos_ts.coarsen(time=12).mean()
+    # Area weighted mean over the region, the chunks of the store are read one at a time and only the
+    # cells of the region are gathered.
+    tos_ts = stream_means(ds.tos, masked_area.areacello, skipna=False)
 
-    # Extract time information.
+    # Extract time information, the monthly values are cached and the annual and seasonal
+    # means are calculated from them in process.
     t = tos_ts["time"].dt.strftime("%Y%m%d").values
     year = list(map(lambda x: selstr(x, start=0, stop=4), t))
+    month = list(map(lambda x: selstr(x, start=4, stop=6), t))
 
     # Format into a data frame.
     val = tos_ts.values
-    d = {'year': year, 'value': val}
+    d = {'year': year, 'month': month, 'value': val}
     df = pd.DataFrame(data=d)
     out = combine_df(meta_data, df)
     out["area"] = "HL"
 
-    return (out)
+    return compact(out)
 
 
 # 2. Process area-weighted tos for the HL region. ----------------------------------------------------------------------------------
@@ -162,6 +109,8 @@ query = dict(
 catalog = catalog.search(require_all_on=["source_id"], **query)
 catalog = catalog.df.copy().reset_index(drop=True)
 catalog = catalog.loc[catalog['member_id'].str.contains('p1')].copy().reset_index(drop=True)
+# Keep only the latest version of each dataset, older versions would be duplicates
+catalog = select_versions(catalog, policy='latest').reset_index(drop=True)
 catalog.to_csv(BASEDIR + "/tos/tos_HL_catalog.csv")
 
 # Set up the output directory and process the files.
@@ -169,13 +118,35 @@ outdir = BASEDIR + '/tos/HL/'
 if not os.path.exists(outdir):
     os.mkdir(outdir)
 
-# Process the files
-for file in catalog["zstore"]:
+# Process the files, skipping the ones that failed on a previous run
+def process(file):
     print(file)
-    try:
-        ofile = outdir + file.replace("/", "_") + '.csv'
-        ofile = ofile.replace("gs:__cmip6_", "")
-        out = mean_HL_tos(file)
-        out.to_csv(ofile, index=False)
-    except:
-        print("problem with " + file)
+    ofile = outdir + file.replace("/", "_") + '.csv'
+    ofile = ofile.replace("gs:__cmip6_", "")
+    info = parse_zstore(file)
+    weights = [find_fx('areacello', info['source_id'], grid_label='gn')]
+    out = cache.fetch(mean_HL_tos, file, weights=weights, region='HL',
+                      mask='lat >= ' + str(HL_LAT) + ' | lat <= -' + str(HL_LAT), aggregation='monthly mean',
+                      years=year_window(YEAR_WINDOWS, 'tos', info['experiment_id']))
+    name = os.path.basename(ofile)
+    for freq, df in temporal_means(out, FREQUENCIES).items():
+        if freq == FREQUENCIES[0]:
+            stats.update(df, file)
+        df.to_csv(frequency_file(outdir, name, freq, FREQUENCIES), index=False)
+
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(catalog["zstore"], 'tos_HL', manifest)
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics are updated as each run finishes
+stats = EnsembleStats('tos_HL')
+
+quarantine = Quarantine()
+for file in quarantine.exclude(address_all, 'tos_HL'):
+    run_safely(process, file, 'tos_HL', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+stats.save()
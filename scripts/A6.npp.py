@@ -12,84 +12,24 @@
 # ------------------------------------------------------------------------------
 
 # Import packages
-import fsspec
-import intake
 import pandas as pd
-import xarray as xr
 import session_info
 
+from hector_cmip6.areas import cell_area
+from hector_cmip6.catalog import fetch_pangeo_table, find_fx, fx_zstores, parse_zstore, select_versions
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.frequency import compact, frequency_file, temporal_means
+from hector_cmip6.helpers import combine_df, get_ds_meta, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.reduce import on_grid
+from hector_cmip6.stream import stream_means
+from hector_cmip6.remote import open_store, open_fx
+
 # Display all columns in dataframe
 pd.set_option('display.max_columns', None)
 
-# Helper functions from stitches project - data processing
-# https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_data.py#L29
-
-def get_ds_meta(ds):
-    """ Get the meta data information from the xarray data set.
-    :param ds:  xarray dataset of CMIP data.
-    :return:    pandas dataset of MIP information.
-    """
-    v = ds.variable_id
-
-    data = [{'variable':v,
-             'experiment':ds.experiment_id,
-             'units':ds[v].attrs['units'],
-            'frequency': ds.attrs["frequency"],
-             'ensemble':ds.attrs["variant_label"],
-             'model': ds.source_id}]
-    df = pd.DataFrame(data)
-
-    return df
-
-# https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_pangeo.py
-# Define the functions that are useful for working with the pangeo data base
-# see https://pangeo.io/index.html for more details.
-
-def fetch_pangeo_table():
-    """ Get a copy of the pangeo archive contents
-    :return: a pd data frame containing information about the model, source, experiment, ensemble and
-    so on that is available for download on pangeo.
-    """
-
-    # The url path that contains to the pangeo archive table of contents.
-    url = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
-    out = intake.open_esm_datastore(url)
-
-    return out.df
-
-def combine_df(df1, df2):
-    """ Join the data frames together.
-    :param df1:   pandas data frame 1.
-    :param df2:   pandas data frame 2.
-    :return:    a single pandas data frame.
-    """
-
-    # Combine the two data frames with one another.
-    df1["j"] = 1
-    df2["j"] = 1
-    out = df1.merge(df2)
-    out = out.drop(columns="j")
-
-    return out
-
-def selstr(a, start, stop):
-    """ Select elements of a string from an array.
-    :param a:   array containing a string.
-    :param start: int referring to the first character index to select.
-    :param stop: int referring to the last character index to select.
-    :return:    array of strings
-    """
-    if type(a) not in [str]:
-        raise TypeError(f"a: must be a single string")
-
-    out = []
-    for i in range(start, stop):
-        out.append(a[i])
-    out = "".join(out)
-    return out
-
-# End of helper functions
-
 def get_land_npp(path):
     """ For a pangeo file, calculate the area weighted net primary production flux over land.
 
@@ -97,49 +37,63 @@ def get_land_npp(path):
 
     :return:      pandas.core.frame.DataFrame of area-weighted land npp from a single netcdf file
     """
-    ds = xr.open_zarr(fsspec.get_mapper(path), consolidated=True)
-    df = pd.read_csv('https://storage.googleapis.com/cmip6/cmip6-zarr-consolidated-stores.csv')
+    ds = open_store(path)
 
     # Extract the meta data
     meta_data = get_ds_meta(ds)
 
-    # Based on the meta data find the correct areacella file
-    query1 = "variable_id == 'areacella' & source_id == '" + meta_data.model[0] + "'"
-    query2 = "variable_id == 'sftlf' & source_id == '" + meta_data.model[0] + "'"
-
-    df_area = df.query(query1)
-    df_landper = df.query(query2)
+    # Based on the meta data find the correct sftlf file,
+    # raises a MissingFxError if the model does not have it
+    landper_path = find_fx('sftlf', meta_data.model[0])
 
-    # Read in the area cella file
-    ds_area = xr.open_zarr(fsspec.get_mapper(df_area.zstore.values[0]), consolidated=True)
-    ds_landper = xr.open_zarr(fsspec.get_mapper(df_landper.zstore.values[0]), consolidated=True)
+    # Cell areas from the grid bounds, areacella is only read for curvilinear grids
+    ds_area = cell_area(ds, 'npp').to_dataset(name='areacella')
+    ds_landper = on_grid(open_fx(landper_path)['sftlf'], ds_area['areacella']).to_dataset(name='sftlf')
 
     # Select only the land cell area values, use this mask as the area weights.
     mask = 1 * (ds_area['areacella'] * (0.01 * ds_landper['sftlf']))
 
     # Using the land cell area calculate the weighted mean over the land.
     land_area = mask.values.sum()
-    other_dims = set(ds.npp.dims) - {'time'}
 
-    # Weighted average calculation
-    wa = (ds.npp * mask).sum(dim=other_dims) / land_area
-    # Annual average
-    wa = wa.coarsen(time=12, boundary="trim").mean()
+    # Weighted average calculation, the chunks of the store are read one at a time and only the
+    # land cells are gathered from each chunk
+    wa = stream_means(ds.npp, mask, skipna=False)
 
-    # Extract time information.
+    # Extract time information, the monthly values are cached and the annual and seasonal
+    # means are calculated from them in process.
     t = wa["time"].dt.strftime("%Y%m%d").values
     year = list(map(lambda x: selstr(x, start=0, stop=4), t))
+    month = list(map(lambda x: selstr(x, start=4, stop=6), t))
 
     # Format into a data frame.
     val = wa.values
-    d = {'year': year, 'value': val}
+    d = {'year': year, 'month': month, 'value': val}
     df = pd.DataFrame(data=d)
     out = combine_df(meta_data, df)
     out['land_area'] = land_area
 
+    return compact(out)
+
+def process(path):
+    """ Get the monthly land npp for a pangeo file, from the cache if the inputs and the
+    spec of the reduction have not changed, and save its temporal means (FREQUENCIES) as csv files.
+    :param path:  str of the location of the cmip6 data file on pangeo
+    """
+    source = parse_zstore(path)['source_id']
+    weights = fx_zstores(source, ['areacella', 'sftlf'])
+    out = cache.fetch(get_land_npp, path, weights=weights,
+                      region='land', mask='areacella * 0.01 * sftlf', aggregation='monthly mean')
     name = out["model"][0] + "_" + out["experiment"][0] + "_" + out["ensemble"][0]
-    # Save as csv
-    out.to_csv(name + ".csv", header=True, index=True)
+    for freq, df in temporal_means(out, FREQUENCIES).items():
+        if freq == FREQUENCIES[0]:
+            stats.update(df, path)
+        # Save as csv
+        df.to_csv(frequency_file(".", name + ".csv", freq, FREQUENCIES), header=True, index=True)
+
+# Temporal means to write, the first is the main product written to the working directory and the
+# others go to ./<frequency>, see hector_cmip6/frequency.py
+FREQUENCIES = ['annual']
 
 # Access Pangeo files
 dat = fetch_pangeo_table()
@@ -150,17 +104,32 @@ exps = ['1pctCO2', 'abrupt-4xCO2', 'abrupt-2xCO2', 'esm-hist', 'esm-ssp585', 'ss
 
 mips = ['CMIP', 'ScenarioMIP']
 
-fails = ['BCC-ESM1', 'BCC-CSM2-MR', 'NORESM2-LM', 'IPSL-CM5A2-INCA', 'CAS-ESM2-0']
-
 # Access desired zstore addresses
 address_all = dat[(dat['variable_id'] == 'npp') & (dat['experiment_id'].isin(exps)) &
-                   (dat['table_id'] == 'Lmon') & (dat['activity_id'].isin(mips)) &
-                   (~dat['source_id'].isin(fails))].zstore
+                   (dat['table_id'] == 'Lmon') & (dat['activity_id'].isin(mips))]
+
+# Keep only the latest version of each dataset
+address_all = select_versions(address_all, policy='latest').zstore
+
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(address_all, 'npp', manifest)
 
-address_all = address_all.reset_index(drop=True)
+# Skip models and datasets that failed on a previous run, see ./inputs/quarantine.csv
+quarantine = Quarantine()
+address_all = quarantine.exclude(address_all, 'npp')
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics are updated as each run finishes
+stats = EnsembleStats('npp')
 
 # Loop
 for items in address_all:
-    get_land_npp(items)
+    run_safely(process, items, 'npp', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+stats.save()
 
 session_info.show()
@@ -0,0 +1,143 @@
+# ------------------------------------------------------------------------------
+# Program Name: A7.day.py
+# Date Last Modified: October 2026
+# Program Purpose: Downloads CMIP6 daily (`day` table) tas, tasmax and pr using
+# Pangeo and calculates the area weighted global and land means of every day,
+# along with the area fraction above the thresholds in THRESHOLDS, reading one
+# chunk of the store at a time. The daily series are aggregated to monthly and
+# annual means, maxima and numbers of days above each threshold.
+# Outputs: One csv file per variable, region and run with the annual statistics
+# saved as "model_experiment_ensemble.csv" in ./day/<variable>_<region>, and the
+# monthly statistics in ./day/<variable>_<region>/monthly
+# TODO:
+# ------------------------------------------------------------------------------
+
+# Import packages
+import os
+import pandas as pd
+
+from hector_cmip6.areas import cell_area
+from hector_cmip6.catalog import MissingFxError, fetch_pangeo_table, fx_zstores, parse_zstore, select_versions
+from hector_cmip6.cache import ReductionCache
+from hector_cmip6.ensemble import EnsembleStats
+from hector_cmip6.frequency import OVER, compact, daily_stats, frequency_file
+from hector_cmip6.helpers import combine_df, get_ds_meta, get_lat_name, selstr
+from hector_cmip6.manifest import Manifest, plan_updates
+from hector_cmip6.quarantine import Quarantine, run_safely
+from hector_cmip6.reduce import cos_lat_area, on_grid, region_weights
+from hector_cmip6.remote import open_store, open_fx
+from hector_cmip6.stream import stream_stats
+
+def get_day(path):
+    """ For a pangeo day table file, calculate the area weighted global and land means of every day
+    and the area fraction above each threshold of the variable, from a single read of the data.
+    Without sftlf only the global means are calculated.
+    :param path: str of the location of the cmip6 data file on pangeo
+    :return: pd data frame of the daily outputs, with an area column and an over_ column per
+    threshold
+    """
+    ds = open_store(path)
+    meta = get_ds_meta(ds, calendar=True)
+    v = meta.variable[0]
+    thresholds = THRESHOLDS[v]
+
+    # Weights of every region, stacked so that all regions come from one pass over the data
+    try:
+        area = cell_area(ds, v)
+    except MissingFxError:
+        area = cos_lat_area(ds[v], get_lat_name(ds))
+    land_frac = None
+    landper_path = fx_zstores(meta.model[0], ['sftlf'])
+    if len(landper_path) > 0:
+        land_frac = on_grid(open_fx(landper_path[0])['sftlf'], area)
+    weights = region_weights(area, land_frac, lat_name=get_lat_name(ds))
+    if land_frac is not None:
+        weights = weights.sel(region=['global', 'land'])
+
+    # Daily regional means and area fractions, reading the chunks of the store one at a time
+    daily = stream_stats(ds[v], weights, thresholds=list(thresholds.values()))
+    # Get date information
+    t = daily["time"].dt.strftime("%Y%m%d").values
+    year = list(map(lambda x: selstr(x, start=0, stop=4), t))
+    month = list(map(lambda x: selstr(x, start=4, stop=6), t))
+    day = list(map(lambda x: selstr(x, start=6, stop=8), t))
+
+    # One block of rows per region
+    out = []
+    for region in daily['region'].values:
+        d = {'year': year, 'month': month, 'day': day, 'value': daily['mean'].sel(region=region).values}
+        for label, value in thresholds.items():
+            d[OVER + label] = daily['over'].sel(region=region, threshold=value).values
+        df = combine_df(meta.copy(), pd.DataFrame(data=d))
+        df["area"] = region
+        out.append(df)
+    return compact(pd.concat(out, ignore_index=True))
+
+def process(path):
+    """ Get the daily regional means of a pangeo day table file, from the cache if the inputs and
+    the spec of the reduction have not changed, and save their monthly and annual statistics as one
+    csv file per region.
+    :param path:  str of the location of the cmip6 data file on pangeo
+    """
+    info = parse_zstore(path)
+    weights = fx_zstores(info['source_id'], ['areacella', 'sftlf'])
+    out = cache.fetch(get_day, path, weights=weights, region='global, land', mask='areacella * 0.01 * sftlf',
+                      thresholds=THRESHOLDS[info['variable_id']], aggregation='daily mean')
+    v = out["variable"][0]
+    name = out["model"][0] + "_" + out["experiment"][0] + "_" + out["ensemble"][0]
+    for freq, means in daily_stats(out, FREQUENCIES).items():
+        for region, df in means.groupby("area", sort=False):
+            df = df.drop(columns="area").reset_index(drop=True)
+            if freq == FREQUENCIES[0]:
+                stats[(v, region)].update(df.rename(columns={'mean': 'value'}), path)
+            # Save as csv
+            outdir = os.path.join(BASEDIR, "day", v + "_" + region)
+            df.to_csv(frequency_file(outdir, name + ".csv", freq, FREQUENCIES), header=True, index=True)
+
+# Thresholds of the days counted per variable, in the units of the variable (K and kg m-2 s-1),
+# i.e. tasmax above 35 C or more than 20 mm of rain a day
+THRESHOLDS = {'tas': {},
+              'tasmax': {'30C': 303.15, '35C': 308.15},
+              'pr': {'1mm': 1 / 86400, '20mm': 20 / 86400}}
+
+# Statistics to write, the first is the main product written to ./day/<variable>_<region> and
+# the others go to a subdirectory of it named after the frequency, see hector_cmip6/frequency.py
+FREQUENCIES = ['annual', 'monthly']
+
+BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Get pangeo table - model, variable info + zstore address
+dat = fetch_pangeo_table()
+
+# Pull out specifics
+mips = ['CMIP', 'ScenarioMIP']
+exps = ['historical', 'ssp126', 'ssp245', 'ssp370', 'ssp585', '1pctCO2', 'abrupt-4xCO2']
+
+# Get zstore addresses for desired files
+address_all = dat[(dat['variable_id'].isin(list(THRESHOLDS))) & (dat['table_id'] == 'day') &
+                  (dat['activity_id'].isin(mips)) & (dat['experiment_id'].isin(exps))]
+
+# Keep only the latest version of each dataset
+address_all = select_versions(address_all, policy='latest').zstore
+
+# Only process datasets that are new, re-versioned or not completed yet
+manifest = Manifest()
+address_all = plan_updates(address_all, 'day', manifest)
+
+# Skip datasets that failed on a previous run
+quarantine = Quarantine()
+address_all = quarantine.exclude(address_all, 'day')
+
+# Reductions whose inputs and spec have not changed are served from the local cache
+cache = ReductionCache()
+
+# Ensemble statistics of the annual means of every variable and region are updated as each run finishes
+stats = {(v, region): EnsembleStats('day_' + v + '_' + region) for v in THRESHOLDS for region in ['global', 'land']}
+
+# Process data
+for items in address_all:
+    run_safely(process, items, 'day', quarantine, manifest)
+
+# Write the moments of the runs added since the last save
+for region_stats in stats.values():
+    region_stats.save()
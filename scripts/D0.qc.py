@@ -0,0 +1,52 @@
+# ------------------------------------------------------------------------------
+# Program Name: D0.qc.py
+# Date Last Modified: October 2026
+# Program Purpose: Rule based quality control of the extracted series with
+# hector_cmip6.qc. Replaces the temperature bounds and minimum length loops of
+# land-ocean-warming-ratio/cleaning_temp_data.R and re-checks the processed tos
+# output against the B5b consistency rules (global vs 0.15 HL + 0.85 LL).
+# Outputs: ./outputs/qc_flags.csv with one row per flagged value, run or model
+# and the reason, and land-ocean-warming-ratio/cleaned_1pctCO2_temp.csv
+# TODO:
+# ------------------------------------------------------------------------------
+
+# Import packages
+import os
+import csv
+
+import numpy as np
+import pandas as pd
+
+from hector_cmip6.qc import LAND_OCEAN_RULES, TOS_RULES, apply_flags, run_qc
+
+here = os.path.dirname(os.path.abspath(__file__))
+ratio_dir = os.path.join(here, "..", "land-ocean-warming-ratio")
+
+# 1. Land and ocean temperature of the 1pctCO2 runs -------------------------------
+# Split the run name and convert the time (YYYYMMDD.x) to years counted from the
+# first year of each run.
+temp = pd.read_csv(os.path.join(ratio_dir, "1pctCO2_temp.csv"))
+run = temp["Ensemble_Model"].str.split("_", expand=True)
+data = pd.DataFrame({'experiment': run[0], 'ensemble': run[1], 'model': run[2], 'variable': 'tas',
+                     'area': temp["Data"], 'year': np.round(temp["Time"] / 10000).astype(int),
+                     'value': temp["Temp"]})
+data['year'] = data['year'] - data.groupby(['model', 'experiment', 'ensemble'])['year'].transform('min')
+
+land_ocean_flags = run_qc(data, LAND_OCEAN_RULES)
+cleaned = apply_flags(data, land_ocean_flags)
+
+# Written like R's write.csv (15 significant digits) to keep the file comparable.
+out = pd.DataFrame({'Experiment': cleaned['experiment'], 'Ensemble': cleaned['ensemble'],
+                    'Model': cleaned['model'], 'Data': cleaned['area'], 'Time': cleaned['year'],
+                    'Temp': cleaned['value'].map('{:.15g}'.format).astype(float)})
+out.to_csv(os.path.join(ratio_dir, "cleaned_1pctCO2_temp.csv"), index=False,
+           quoting=csv.QUOTE_NONNUMERIC)
+
+# 2. Processed tos ----------------------------------------------------------------
+tos = pd.read_csv(os.path.join(here, "..", "outputs", "ocean_componet-tos_values.csv"))
+tos_flags = run_qc(tos, TOS_RULES)
+
+# 3. Save the flags ---------------------------------------------------------------
+flags = pd.concat([land_ocean_flags, tos_flags], ignore_index=True)
+flags.to_csv(os.path.join(here, "..", "outputs", "qc_flags.csv"), index=False)
+print(flags.groupby(['rule', 'scope']).size())
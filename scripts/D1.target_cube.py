@@ -0,0 +1,31 @@
+# ------------------------------------------------------------------------------
+# Program Name: D1.target_cube.py
+# Date Last Modified: October 2026
+# Program Purpose: Packs the processed outputs in ./outputs (written by the
+# B-scripts) into a dense variable x run x year array for Hector calibration.
+# The array is saved as a .npy file that calibration code memory-maps with
+# hector_cmip6.cube.TargetCube, runs without a value for a year are NaN.
+# Outputs: ./outputs/target_cube/cube.npy plus variables.csv, runs.csv and
+# meta.json lookup tables for the variable, run and year axes. The idealized
+# outputs, whose years count from the start of the experiment, go to
+# ./outputs/target_cube_idealized.
+# TODO:
+# ------------------------------------------------------------------------------
+
+# Import packages
+import os
+
+from hector_cmip6.cube import export_cube, TargetCube
+
+here = os.path.dirname(os.path.abspath(__file__))
+outdirs = {False: os.path.join(here, "..", "outputs", "target_cube"),
+           True: os.path.join(here, "..", "outputs", "target_cube_idealized")}
+
+# Pack the long format csv files in ./outputs, one cube per year axis
+for idealized, outdir in outdirs.items():
+    export_cube(outdir, idealized=idealized)
+
+    # Print the axes of the cube
+    cube = TargetCube(outdir)
+    print(cube.variables)
+    print(str(len(cube.runs)) + " runs, years " + str(cube.years[0]) + "-" + str(cube.years[-1]))
@@ -0,0 +1,58 @@
+# ------------------------------------------------------------------------------
+# Program Name: D2.land_ocean_ratio.py
+# Date Last Modified: October 2026
+# Program Purpose: Computes the land-ocean warming ratio of every model,
+# experiment and ensemble member of the cleaned 1pctCO2 temperature data (see
+# D0.qc.py) and draws Hector parameter sets from it. Replaces the ratio and
+# distributionInHector.R steps of land-ocean-warming-ratio, which drew 5000
+# normal samples.
+# Outputs: land-ocean-warming-ratio/ratio_cleaned_1pctCO2_temp.csv and
+# ./outputs/lo_warming_ratio_parameters.csv with N_SAMPLES parameter sets.
+# TODO:
+# ------------------------------------------------------------------------------
+
+# Import packages
+import os
+import csv
+
+import numpy as np
+import pandas as pd
+
+from hector_cmip6.warming_ratio import warming_ratio, write_parameter_sets
+
+# Number of parameter sets, how they are drawn ('normal' or 'bootstrap' over the
+# models) and the seed, so the sets can be regenerated exactly.
+N_SAMPLES = 1000000
+METHOD = 'normal'
+SEED = 2020
+
+here = os.path.dirname(os.path.abspath(__file__))
+ratio_dir = os.path.join(here, "..", "land-ocean-warming-ratio")
+
+# Read the cleaned land and ocean temperature
+temp = pd.read_csv(os.path.join(ratio_dir, "cleaned_1pctCO2_temp.csv"))
+data = pd.DataFrame({'model': temp["Model"], 'experiment': temp["Experiment"],
+                     'ensemble': temp["Ensemble"], 'area': temp["Data"], 'year': temp["Time"],
+                     'value': temp["Temp"]})
+
+# Ratio of every run and 30 year window, in the order of the input, saved like R's write.csv
+ratios = warming_ratio(data, window=30)
+out = pd.DataFrame({'Model': ratios['model'],
+                    'Ratio': ratios['ratio'].map('{:.15g}'.format).astype(float),
+                    'Error': ratios['error'].map('{:.15g}'.format).astype(float),
+                    'Year': ratios['year']})
+
+# Only rewrite the file when the ratios changed, not for differences in the last digits of the
+# floating point sums (about 1e-13).
+ofile = os.path.join(ratio_dir, "ratio_cleaned_1pctCO2_temp.csv")
+old = pd.read_csv(ofile) if os.path.exists(ofile) else None
+unchanged = (old is not None and old.shape == out.shape and
+             old[['Model', 'Year']].equals(out[['Model', 'Year']]) and
+             np.allclose(old[['Ratio', 'Error']].values, out[['Ratio', 'Error']].values, rtol=1e-10, atol=0))
+if not unchanged:
+    out.to_csv(ofile, index=False, quoting=csv.QUOTE_NONNUMERIC)
+
+# Draw the parameter sets
+ofile = os.path.join(here, "..", "outputs", "lo_warming_ratio_parameters.csv")
+write_parameter_sets(ofile, ratios, N_SAMPLES, method=METHOD, seed=SEED)
+print(ratios['ratio'].describe())
@@ -0,0 +1,6 @@
+""" Shared helpers for the hector_cmip6data Pangeo extraction scripts.
+
+The A-scripts in ./scripts import from this package; because Python puts the
+directory of the script being run on the path, ``import hector_cmip6`` works
+no matter which directory the script is launched from.
+"""
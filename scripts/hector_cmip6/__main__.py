@@ -0,0 +1,99 @@
+""" Command line of the extraction engine, run from ./scripts with
+
+    python -m hector_cmip6 list
+    python -m hector_cmip6 extract --var tas_land --exp historical ssp585 --workers 32 --max-mem 8G --out <dir>
+
+or, split over the tasks of a SLURM array job (see shard.py and extract_job.txt),
+
+    python -m hector_cmip6 plan --var tas tas_land tas_ocean --shards 16 --work <dir>
+    python -m hector_cmip6 shard --work <dir> --shard $SLURM_ARRAY_TASK_ID --workers 8
+    python -m hector_cmip6 merge --work <dir>
+
+See extract.extract for what a run does and products.PRODUCTS for the products.
+"""
+
+import argparse
+import sys
+
+from .cache import CACHE_DIR
+from .extract import FORMATS, REPO_DIR, extract
+from .frequency import FREQUENCIES
+from .manifest import INPUTS_DIR
+from .products import MIPS, PRODUCTS
+from .shard import merge_shards, run_shard, write_plan
+
+
+def list_products():
+    """ Print the products and their defaults. """
+    for name, spec in PRODUCTS.items():
+        print(name + ": " + spec['variable'] + " (" + spec['table'] + ") " + spec['region'] + " mean -> " +
+              spec['outdir'] + ", " + ", ".join(spec['frequencies']) + ", " + str(len(spec['experiments'])) +
+              " experiments")
+
+
+def _add_selection(p):
+    """ Arguments choosing the products, the stores and the outputs. """
+    p.add_argument('--var', nargs='+', required=True, choices=list(PRODUCTS), metavar='PRODUCT',
+                   help="products to extract, see the list command")
+    p.add_argument('--exp', nargs='+', default=None, help="experiments, defaults to those of each product")
+    p.add_argument('--mip', nargs='+', default=MIPS, help="activities, default: %(default)s")
+    p.add_argument('--out', default=REPO_DIR, help="root directory of the outputs, default: the repository")
+    p.add_argument('--format', default='csv', choices=FORMATS, help="output format, default: %(default)s")
+    p.add_argument('--freq', nargs='+', default=None, choices=FREQUENCIES,
+                   help="frequencies, the first goes to the product directory, defaults to those of each product")
+    p.add_argument('--inputs', default=INPUTS_DIR, help="manifest and quarantine directory, default: ./inputs")
+
+
+def _add_resources(p):
+    """ Arguments sizing a run on one node. """
+    p.add_argument('--workers', type=int, default=1, help="worker processes, default: %(default)s")
+    p.add_argument('--max-mem', default=None, help="memory ceiling of the run split over the workers, i.e. 8G")
+    p.add_argument('--cache', default=CACHE_DIR, help="reduction cache directory, default: %(default)s")
+
+
+def parser():
+    """ Arguments of the command line. """
+    p = argparse.ArgumentParser(prog='python -m hector_cmip6', description="Extract area weighted means of "
+                                "CMIP6 variables from the Pangeo archive.")
+    sub = p.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="list the products")
+
+    e = sub.add_parser('extract', help="extract products")
+    _add_selection(e)
+    _add_resources(e)
+    e.add_argument('--dry-run', action='store_true', help="only count the stores that would be reduced")
+
+    pl = sub.add_parser('plan', help="split the stores to reduce into shards for an array job")
+    _add_selection(pl)
+    pl.add_argument('--shards', type=int, required=True, help="number of shards, the size of the array job")
+    pl.add_argument('--work', required=True, help="work directory shared by the array tasks")
+
+    sh = sub.add_parser('shard', help="reduce the stores of one shard")
+    sh.add_argument('--work', required=True, help="work directory of the plan")
+    sh.add_argument('--shard', type=int, required=True, help="shard number, i.e. $SLURM_ARRAY_TASK_ID")
+    _add_resources(sh)
+
+    m = sub.add_parser('merge', help="merge the outputs of the shards into the output directory")
+    m.add_argument('--work', required=True, help="work directory of the plan")
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.command == 'list':
+        list_products()
+    elif args.command == 'extract':
+        extract(args.var, experiments=args.exp, mips=args.mip, workers=args.workers, max_mem=args.max_mem,
+                out=args.out, fmt=args.format, frequencies=args.freq, cache_dir=args.cache, inputs_dir=args.inputs,
+                dry_run=args.dry_run)
+    elif args.command == 'plan':
+        write_plan(args.var, args.shards, args.work, experiments=args.exp, mips=args.mip, out=args.out,
+                   fmt=args.format, frequencies=args.freq, inputs_dir=args.inputs)
+    elif args.command == 'shard':
+        run_shard(args.work, args.shard, workers=args.workers, max_mem=args.max_mem, cache_dir=args.cache)
+    elif args.command == 'merge':
+        print(merge_shards(args.work).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,103 @@
+""" Grid cell areas computed from the grid itself.
+
+For rectilinear grids (1-D latitude and longitude) the exact area of a cell on
+the sphere is R^2 * (sin(lat_north) - sin(lat_south)) * (lon_east - lon_west),
+from the lat_bnds/lon_bnds of the store or, if there are none, from the
+midpoints between the cell centres. The areas are cached per grid, so a model
+costs one calculation per process and no remote fx store is opened. Only
+curvilinear grids (2-D latitude and longitude) fall back to the areacella or
+areacello field on pangeo.
+"""
+
+import hashlib
+
+import numpy as np
+
+from .catalog import find_fx
+from .remote import open_fx
+
+# Radius of the earth in m, the CMIP6 fx fields use the radius of each model which is within
+# 0.01 % of this value.
+EARTH_RADIUS = 6371000.0
+
+# Cell areas per grid, filled as grids are seen.
+_AREA_CACHE = {}
+
+
+def _coord_name(ds, names):
+    for name in names:
+        if name in ds.coords or name in ds.variables:
+            return name
+    raise RuntimeError("Couldn't find any of the coordinates " + ", ".join(names))
+
+
+def _bounds(ds, name, limits=None):
+    """ Cell bounds of a 1-D coordinate, from its bounds variable or the midpoints between the centres.
+    :param ds:      xarray dataset of CMIP data.
+    :param name:    str name of the coordinate.
+    :param limits:  optional (min, max) the outer bounds are clipped to, i.e. (-90, 90) for latitude.
+    :return:        np array (n, 2) of the lower and upper bound of every cell.
+    """
+    for bnds in [ds[name].attrs.get('bounds'), name + '_bnds', name + '_bounds']:
+        if bnds is not None and bnds in ds.variables and ds[bnds].ndim == 2:
+            return np.asarray(ds[bnds].values, dtype='float64')
+
+    centres = np.asarray(ds[name].values, dtype='float64')
+    mid = (centres[1:] + centres[:-1]) / 2
+    edges = np.concatenate([[centres[0] - (mid[0] - centres[0])], mid,
+                            [centres[-1] + (centres[-1] - mid[-1])]])
+    if limits is not None:
+        edges = np.clip(edges, *limits)
+    return np.stack([edges[:-1], edges[1:]], axis=1)
+
+
+def is_rectilinear(ds, variable):
+    """ Check if a variable is on a grid with 1-D latitude and longitude dimensions.
+    :param ds:          xarray dataset of CMIP data.
+    :param variable:    str name of the variable.
+    :return:            bool
+    """
+    lat = _coord_name(ds, ['lat', 'latitude'])
+    lon = _coord_name(ds, ['lon', 'longitude'])
+    return ds[lat].ndim == 1 and ds[lon].ndim == 1 and lat in ds[variable].dims and lon in ds[variable].dims
+
+
+def grid_area(ds):
+    """ Exact spherical cell areas of a rectilinear grid, cached per grid.
+    :param ds:  xarray dataset of CMIP data on a rectilinear grid.
+    :return:    xarray DataArray (lat, lon) of the cell areas in m2.
+    """
+    lat = _coord_name(ds, ['lat', 'latitude'])
+    lon = _coord_name(ds, ['lon', 'longitude'])
+    lat_b = _bounds(ds, lat, limits=(-90, 90))
+    lon_b = _bounds(ds, lon)
+
+    import xarray as xr
+
+    key = hashlib.sha1(lat_b.tobytes() + lon_b.tobytes()).hexdigest()
+    if key not in _AREA_CACHE:
+        dsin = np.abs(np.sin(np.deg2rad(lat_b[:, 1])) - np.sin(np.deg2rad(lat_b[:, 0])))
+        # Widths modulo 360, so a cell with bounds across the meridian (i.e. [359.5, 0.5]) is 1
+        # degree wide. A single cell around the globe keeps its 360 degrees.
+        width = lon_b[:, 1] - lon_b[:, 0]
+        dlon = np.deg2rad(np.where(np.abs(width) == 360, 360, width % 360))
+        _AREA_CACHE[key] = EARTH_RADIUS ** 2 * np.outer(dsin, dlon)
+
+    return xr.DataArray(_AREA_CACHE[key], dims=(lat, lon),
+                        coords={lat: ds[lat].values, lon: ds[lon].values},
+                        attrs={'units': 'm2', 'source': 'grid bounds'})
+
+
+def cell_area(ds, variable, fx_var='areacella'):
+    """ Cell areas for a variable, from the grid when it is rectilinear and from the fx field on
+    pangeo otherwise.
+    :param ds:          xarray dataset of CMIP data.
+    :param variable:    str name of the variable.
+    :param fx_var:      str fx field to fall back to, areacella or areacello.
+    :return:            xarray DataArray of the cell areas on the grid of the variable.
+    """
+    if is_rectilinear(ds, variable):
+        return grid_area(ds)
+
+    # Curvilinear grid, raises a MissingFxError if the model does not have the fx field.
+    return open_fx(find_fx(fx_var, ds.source_id, grid_label=ds.attrs.get('grid_label')))[fx_var]
@@ -0,0 +1,219 @@
+""" Benchmarks of the shared reduction code, run from ./scripts with
+
+    python -m hector_cmip6.benchmarks
+
+The reduction benchmarks write a synthetic store shaped like a CMIP6 Amon field
+(float32, one zarr chunk per year) to a temporary directory, so no network
+access is needed, and print a table of the results. The import benchmark times
+the import of every module of the package in a fresh interpreter, the cost every
+new worker process pays. The schedule benchmark simulates the wall time of a
+full run dispatched in catalog order and largest-first.
+"""
+
+import heapq
+import json
+import os
+import pkgutil
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .reduce import region_weights
+from .stream import stream_means
+
+
+def synthetic_store(path, years=50, nlat=96, nlon=192, seed=0):
+    """ Write a float32 tas like field with a seasonal cycle, a trend and noise.
+    :param path:    str directory of the zarr store.
+    :param years:   int number of years of monthly data.
+    :param nlat:    int number of latitudes.
+    :param nlon:    int number of longitudes.
+    :param seed:    int seed of the noise.
+    :return:        tuple (lazy xarray dataset of the store, xarray DataArray of cell areas,
+                    xarray DataArray of the land fraction in percent).
+    """
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-90 + 90 / nlat, 90 - 90 / nlat, nlat)
+    lon = np.arange(nlon) * 360 / nlon
+    time_ = xr.cftime_range('1850-01-01', periods=12 * years, freq='MS', calendar='noleap')
+    month = np.arange(12 * years) % 12
+    clim = 288 - 30 * np.sin(np.deg2rad(lat)) ** 2
+    season = 10 * np.sin(np.deg2rad(lat))[np.newaxis, :] * np.cos(2 * np.pi * month / 12)[:, np.newaxis]
+    trend = 0.01 * np.arange(12 * years) / 12
+    tas = (clim[np.newaxis, :, np.newaxis] + season[:, :, np.newaxis] + trend[:, np.newaxis, np.newaxis] +
+           rng.normal(0, 2, (12 * years, nlat, nlon))).astype('float32')
+
+    ds = xr.Dataset({'tas': (('time', 'lat', 'lon'), tas)}, coords={'time': time_, 'lat': lat, 'lon': lon})
+    ds.chunk({'time': 12, 'lat': nlat, 'lon': nlon}).to_zarr(path, mode='w')
+
+    area = xr.DataArray(np.cos(np.deg2rad(lat))[:, np.newaxis] * np.ones(nlon) * 1e10, dims=('lat', 'lon'),
+                        coords={'lat': lat, 'lon': lon})
+    land_frac = xr.DataArray(np.clip(rng.normal(30, 40, (nlat, nlon)), 0, 100), dims=('lat', 'lon'),
+                             coords={'lat': lat, 'lon': lon})
+    return xr.open_zarr(path), area, land_frac
+
+
+def profile(func):
+    """ Run a function, timing it and tracing its peak memory.
+    :param func:    function without arguments.
+    :return:        tuple (result of func, float seconds, float peak MB allocated during the call).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        out = func()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return out, seconds, peak / 2 ** 20
+
+
+def bench_precision(years=50, nlat=96, nlon=192):
+    """ Annual global, land and ocean means with the xarray weighted sum the scripts used before
+    the streaming reducer, and with stream_means in float64 (the outputs up to now), float32 and
+    float32 with compensated summation.
+    :param years:   int number of years of the synthetic store.
+    :param nlat:    int number of latitudes.
+    :param nlon:    int number of longitudes.
+    :return:        pd data frame with the seconds, peak MB and the largest absolute and relative
+                    difference of the annual means from the float64 stream, per setting.
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        ds, area, land_frac = synthetic_store(tmp + "/tas.zarr", years, nlat, nlon)
+        weights = region_weights(area, land_frac)
+
+        def xarray_sum():
+            return ((ds.tas * weights).sum(dim=['lat', 'lon']) / weights.sum(dim=['lat', 'lon'])).compute()
+
+        settings = {'xarray float64': xarray_sum,
+                    'stream float64': lambda: stream_means(ds.tas, weights, precision='float64'),
+                    'stream float32': lambda: stream_means(ds.tas, weights, precision='source'),
+                    'stream float32 compensated': lambda: stream_means(ds.tas, weights, precision='source',
+                                                                       compensated=True)}
+        rows = []
+        results = {}
+        with dask.config.set(scheduler='synchronous'):
+            for name, func in settings.items():
+                out, seconds, peak = profile(func)
+                results[name] = out.transpose('region', 'time').coarsen(time=12).mean().values
+                rows.append({'setting': name, 'seconds': seconds, 'peak_MB': peak})
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    base = results['stream float64']
+    out = pd.DataFrame(rows)
+    out['max_abs_diff'] = [np.abs(results[name] - base).max() for name in out['setting']]
+    out['max_rel_diff'] = [np.abs((results[name] - base) / base).max() for name in out['setting']]
+    return out
+
+
+# Dependencies that should only be imported when they are first used.
+HEAVY = ['xarray', 'dask', 'zarr', 'cftime', 'fsspec', 'gcsfs', 'intake', 'session_info']
+
+# Imported before the clock starts, every worker needs them for its result frames.
+BASE = ['numpy', 'pandas']
+
+_IMPORT_SCRIPT = """
+import builtins, importlib, json, os, sys, time
+calls = []
+def watch(func):
+    def wrapped(*args, **kwargs):
+        calls.append(func.__name__)
+        return func(*args, **kwargs)
+    return wrapped
+builtins.open, os.mkdir, os.makedirs = watch(builtins.open), watch(os.mkdir), watch(os.makedirs)
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+heavy = [m for m in sys.argv[2:] if m in sys.modules]
+print(json.dumps({'seconds': seconds, 'io_calls': len(calls), 'heavy': heavy}))
+"""
+
+
+def bench_import(repeat=3):
+    """ Import every module of the package in a fresh interpreter that has already imported BASE,
+    timing the import, counting the files it opens or directories it makes and listing the heavy
+    dependencies it pulls in.
+    :param repeat:  int number of fresh interpreters per module, the fastest import is kept.
+    :return:        pd data frame with the seconds, number of I/O calls and heavy modules imported,
+                    per module.
+    """
+    package = os.path.dirname(os.path.abspath(__file__))
+    modules = ['hector_cmip6'] + ['hector_cmip6.' + m.name for m in pkgutil.iter_modules([package])
+                                 if m.name not in ['__main__', 'benchmarks']]
+    script = "import " + ", ".join(BASE) + "\n" + _IMPORT_SCRIPT
+    rows = []
+    for module in modules:
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-c', script, module] + HEAVY, cwd=os.path.dirname(package),
+                                 capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        best = min(runs, key=lambda r: r['seconds'])
+        rows.append({'module': module, 'seconds': best['seconds'], 'io_calls': best['io_calls'],
+                     'heavy': ", ".join(best['heavy'])})
+    return pd.DataFrame(rows)
+
+
+def makespan(seconds, workers):
+    """ Wall time of a list of jobs handed, in order, to whichever worker is free first.
+    :param seconds: list of float seconds of every job, in dispatch order.
+    :param workers: int number of workers.
+    :return:        float seconds until the last job finishes.
+    """
+    free = [0.0] * workers
+    for s in seconds:
+        heapq.heapreplace(free, free[0] + s)
+    return max(free)
+
+
+def bench_schedule(workers=32, seed=0):
+    """ Makespan of a synthetic full run dispatched in catalog order and largest-first (see
+    schedule.largest_first), no data is read. The jobs mimic the mix of a full run: mostly 150 to
+    250 year Amon runs, some 1000 year piControl / abrupt-4xCO2 like runs and some high
+    resolution ocean grids, their seconds proportional to the bytes read.
+    :param workers: int number of workers.
+    :param seed:    int seed of the job mix.
+    :return:        pd data frame with the makespan, its ratio to the lower bound (the larger of the
+                    longest job and the total work over the workers) per dispatch order.
+    """
+    rng = np.random.default_rng(seed)
+    amon = rng.uniform(150, 250, 1500) * 12 * 192 * 288 * 4
+    long_runs = rng.uniform(500, 1000, 60) * 12 * 192 * 288 * 4
+    ocean = rng.uniform(150, 250, 40) * 12 * 1080 * 1440 * 4
+    seconds = np.concatenate([amon, long_runs, ocean]) / 50e6
+    catalog = rng.permutation(seconds)
+
+    bound = max(seconds.max(), seconds.sum() / workers)
+    rows = []
+    for name, order in [('catalog order', catalog), ('largest first', np.sort(seconds)[::-1])]:
+        span = makespan(order, workers)
+        rows.append({'order': name, 'jobs': len(order), 'workers': workers, 'hours': span / 3600,
+                     'vs_lower_bound': span / bound})
+    return pd.DataFrame(rows)
+
+
+BENCHMARKS = {'import': bench_import, 'precision': bench_precision, 'schedule': bench_schedule}
+
+
+def main():
+    """ Run every benchmark and print its table. """
+    with pd.option_context('display.width', 120, 'display.max_columns', None):
+        for name, bench in BENCHMARKS.items():
+            print("# " + name)
+            print(bench())
+            print()
+
+
+if __name__ == '__main__':
+    main()
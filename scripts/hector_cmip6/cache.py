@@ -0,0 +1,97 @@
+""" Content-addressed cache of reduction results.
+
+A reduction result (the data frame an A-script writes to csv) is stored under a
+hash of everything that produced it: the zstore and its version, the fx fields
+used as weights (their zstores include their versions), the region, mask and
+aggregation spec, and the code version. Changing e.g. the HL/LL latitude split
+only changes the key of the affected products, everything else is served from
+the local cache.
+"""
+
+import os
+import json
+import hashlib
+
+import pandas as pd
+
+from .catalog import parse_zstore
+
+# Bump when a change to the shared reduction code changes the results.
+CODE_VERSION = 5
+
+# Default cache location, can be set with the HECTOR_CMIP6_CACHE environment variable.
+CACHE_DIR = os.environ.get('HECTOR_CMIP6_CACHE',
+                           os.path.join(os.path.expanduser("~"), ".cache", "hector_cmip6"))
+
+
+def cache_key(zstore, weights=(), **spec):
+    """ Hash the inputs and the spec of a reduction.
+    :param zstore:  str of the location of the cmip6 data file on pangeo.
+    :param weights: list of str zstores of the fx fields used as weights.
+    :param spec:    json serialisable description of the region, mask and aggregation,
+                    i.e. region='HL', mask='lat >= 55 | lat <= -55', aggregation='annual mean'.
+    :return:        str hex digest.
+    """
+    content = {'zstore': zstore,
+               'version': parse_zstore(zstore)['version'],
+               'weights': sorted(weights),
+               'spec': spec,
+               'code': CODE_VERSION}
+    text = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ReductionCache:
+    """ Local store of reduction results keyed by cache_key. """
+
+    def __init__(self, path=CACHE_DIR):
+        """
+        :param path:    str directory the cached results are written to.
+        """
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + ".pkl")
+
+    def get(self, key):
+        """ Get a cached result.
+        :param key: str cache key.
+        :return:    pd data frame, or None if the key is not cached.
+        """
+        f = self._file(key)
+        if not os.path.exists(f):
+            return None
+        return pd.read_pickle(f)
+
+    def put(self, key, out, content=None):
+        """ Store a result, written to a temporary file first so a killed job never leaves a
+        half written entry behind.
+        :param key:     str cache key.
+        :param out:     pd data frame to cache.
+        :param content: optional dict describing what produced the result, saved next to it.
+        """
+        f = self._file(key)
+        os.makedirs(os.path.dirname(f), exist_ok=True)
+        out.to_pickle(f + ".tmp")
+        os.replace(f + ".tmp", f)
+        if content is not None:
+            with open(f.replace(".pkl", ".json"), "w") as js:
+                json.dump(content, js, indent=1, sort_keys=True, default=str)
+
+    def fetch(self, func, zstore, weights=(), **spec):
+        """ Get the result of func(zstore) from the cache, computing and caching it on a miss.
+        :param func:    function that reduces a single zstore to a pd data frame.
+        :param zstore:  str of the location of the cmip6 data file on pangeo.
+        :param weights: list of str zstores of the fx fields func uses.
+        :param spec:    description of the region, mask and aggregation, see cache_key.
+        :return:        pd data frame
+        """
+        key = cache_key(zstore, weights, **spec)
+        out = self.get(key)
+        if out is not None:
+            print("cached: " + zstore)
+            return out
+
+        out = func(zstore)
+        self.put(key, out, dict(zstore=zstore, weights=list(weights), spec=spec, code=CODE_VERSION))
+        return out
@@ -0,0 +1,255 @@
+""" Catalog-side helpers: everything that can be answered from the pangeo
+table of contents before a single data store is opened. """
+
+import pandas as pd
+
+# The url path that contains to the pangeo archive table of contents.
+PANGEO_URL = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
+
+# The flat csv listing of every consolidated zarr store, used to find fx fields.
+STORES_URL = "https://storage.googleapis.com/cmip6/cmip6-zarr-consolidated-stores.csv"
+
+# Columns that identify a single model/experiment/ensemble run.
+RUN_COLS = ['source_id', 'experiment_id', 'member_id']
+
+# Columns that identify a dataset, a dataset can be published in several versions.
+DATASET_COLS = ['source_id', 'experiment_id', 'member_id', 'table_id', 'variable_id', 'grid_label']
+
+# The parts of a pangeo zstore path, gs://cmip6/CMIP6/<activity_id>/.../<version>/
+ZSTORE_PARTS = ['activity_id', 'institution_id', 'source_id', 'experiment_id', 'member_id',
+                'table_id', 'variable_id', 'grid_label', 'version']
+
+# Cache of the consolidated stores table, it is only read once per process.
+_STORE_TABLE = {}
+
+
+class MissingFxError(RuntimeError):
+    """ Raised when a model does not provide an fx field (areacella, sftlf, areacello) """
+    pass
+
+
+def fetch_pangeo_table():
+    """ Get a copy of the pangeo archive contents
+    :return: a pd data frame containing information about the model, source, experiment, ensemble and
+    so on that is available for download on pangeo.
+    """
+    import intake
+
+    out = intake.open_esm_datastore(PANGEO_URL)
+    return out.df
+
+
+def fetch_store_table():
+    """ Get the table of consolidated zarr stores, this is where the fx fields are looked up.
+    The table is only downloaded once per process.
+    :return: a pd data frame with one row per zarr store on pangeo.
+    """
+    if 'stores' not in _STORE_TABLE:
+        _STORE_TABLE['stores'] = pd.read_csv(STORES_URL)
+    return _STORE_TABLE['stores']
+
+
+def parse_zstore(zstore):
+    """ Split a pangeo zstore address into its catalog fields.
+    :param zstore:  str of the location of the cmip6 data file on pangeo.
+    :return:        dict with the activity_id, institution_id, source_id, experiment_id, member_id,
+                    table_id, variable_id, grid_label and version of the store. The version
+                    is returned without the leading "v" to match the pangeo table.
+    """
+    parts = zstore.rstrip("/").split("/")
+    if len(parts) < len(ZSTORE_PARTS):
+        raise ValueError("not a pangeo zstore address: " + zstore)
+    out = dict(zip(ZSTORE_PARTS, parts[-len(ZSTORE_PARTS):]))
+    out['version'] = out['version'].lstrip("v")
+    return out
+
+
+def find_fx(fx_var, source_id, grid_label=None, stores=None, **match):
+    """ Find the zstore of an fx field for a model.
+    :param fx_var:      str fx variable, i.e. 'areacella', 'sftlf' or 'areacello'.
+    :param source_id:   str model name.
+    :param grid_label:  optional str grid label the fx field must be on, i.e. 'gn'.
+    :param stores:      optional pd data frame of stores, defaults to fetch_store_table().
+    :param match:       other catalog columns the fx field must match, i.e. member_id='r1i1p1f1'.
+    :return: str zstore address of the first matching fx field.
+    """
+    if stores is None:
+        stores = fetch_store_table()
+    sel = stores[(stores['variable_id'] == fx_var) & (stores['source_id'] == source_id)]
+    if grid_label is not None:
+        sel = sel[sel['grid_label'] == grid_label]
+    for col, value in match.items():
+        sel = sel[sel[col] == value]
+    if sel.shape[0] < 1:
+        raise MissingFxError("Could not find " + fx_var + " for " + source_id)
+    return sel.zstore.values[0]
+
+
+def fx_zstores(source_id, fx_vars, **kwargs):
+    """ Find the zstores of the fx fields a model has, skipping the ones it does not have. Used to
+    list the inputs of a reduction when some fx fields are optional (i.e. areacella, which is only
+    read for curvilinear grids).
+    :param source_id:   str model name.
+    :param fx_vars:     list of str fx variables.
+    :param kwargs:      passed on to find_fx.
+    :return:            list of str zstore addresses.
+    """
+    out = []
+    for fx_var in fx_vars:
+        try:
+            out.append(find_fx(fx_var, source_id, **kwargs))
+        except MissingFxError:
+            pass
+    return out
+
+
+def availability_matrix(dat, variables, fx_vars=(), table_id=None, fx_grid_label=None, stores=None):
+    """ Build a boolean run x variable availability matrix from the pangeo table.
+    :param dat:             pd data frame of the pangeo table, see fetch_pangeo_table.
+    :param variables:       list of variable_id values that vary per run, i.e. ['hfls', 'hfss'].
+    :param fx_vars:         list of fx variable_id values, i.e. ['areacella', 'sftlf']. These are
+                            looked up per model (source_id) in the table find_fx searches, so a
+                            field is available here exactly when the extraction finds it.
+    :param table_id:        optional str, only count variables from this table, i.e. 'Amon'.
+    :param fx_grid_label:   optional str, only count fx fields on this grid, i.e. 'gn'.
+    :param stores:          optional pd data frame of stores the fx fields are looked up in,
+                            defaults to fetch_store_table() like find_fx.
+    :return: pd data frame indexed by source_id/experiment_id/member_id with one boolean column
+    per requested variable and fx field.
+    """
+    variables = list(variables)
+    fx_vars = list(fx_vars)
+
+    runs = dat[dat['variable_id'].isin(variables)]
+    if table_id is not None:
+        runs = runs[runs['table_id'] == table_id]
+
+    # One row per run, True where at least one store exists for the variable.
+    matrix = pd.crosstab(index=[runs[c] for c in RUN_COLS], columns=runs['variable_id']) > 0
+    matrix = matrix.reindex(columns=variables, fill_value=False)
+    matrix.columns.name = None
+
+    if len(fx_vars) > 0:
+        stores = fetch_store_table() if stores is None else stores
+        fx = stores[stores['variable_id'].isin(fx_vars)]
+        if fx_grid_label is not None:
+            fx = fx[fx['grid_label'] == fx_grid_label]
+        # fx fields are time invariant, any experiment/ensemble of the model will do.
+        fx_avail = pd.crosstab(fx['source_id'], fx['variable_id']) > 0
+        fx_avail = fx_avail.reindex(columns=fx_vars, fill_value=False)
+        fx_avail.columns.name = None
+        fx_avail = fx_avail.reindex(matrix.index.get_level_values('source_id'), fill_value=False)
+        fx_avail.index = matrix.index
+        matrix = pd.concat([matrix, fx_avail], axis=1)
+
+    return matrix
+
+
+def runs_with(matrix, variables=(), fx_vars=()):
+    """ Find the runs that have all of the requested variables and fx fields.
+    :param matrix:      pd data frame returned by availability_matrix.
+    :param variables:   list of variables that must all be present.
+    :param fx_vars:     list of fx fields that must all be present.
+    :return: pd data frame with the source_id, experiment_id and member_id of the complete runs.
+    """
+    cols = list(variables) + list(fx_vars)
+    missing = set(cols) - set(matrix.columns)
+    if len(missing) > 0:
+        raise KeyError("availability matrix has no column(s) for: " + ", ".join(sorted(missing)))
+
+    keep = matrix[cols].all(axis=1)
+    return matrix.index[keep.values].to_frame(index=False)
+
+
+def select_complete(dat, variables, fx_vars=(), table_id=None, fx_grid_label=None, stores=None):
+    """ Subset the pangeo table to the stores belonging to runs that have every requested
+    variable and fx field, so that nothing is downloaded only to be discarded later.
+    :param dat:             pd data frame of the pangeo table, see fetch_pangeo_table.
+    :param variables:       list of variable_id values that must all be present for a run.
+    :param fx_vars:         list of fx variable_id values that must be present for the model.
+    :param table_id:        optional str table to restrict the variables to.
+    :param fx_grid_label:   optional str grid label to restrict the fx fields to.
+    :param stores:          optional pd data frame of stores the fx fields are looked up in.
+    :return: pd data frame, rows of dat for the selected variables of complete runs only.
+    """
+    matrix = availability_matrix(dat, variables, fx_vars=fx_vars, table_id=table_id,
+                                 fx_grid_label=fx_grid_label, stores=stores)
+    complete = runs_with(matrix, variables, fx_vars)
+
+    out = dat[dat['variable_id'].isin(list(variables))]
+    if table_id is not None:
+        out = out[out['table_id'] == table_id]
+    out = out.merge(complete, on=RUN_COLS, how='inner')
+
+    return out.reset_index(drop=True)
+
+
+def select_versions(dat, policy='latest', pinned=None):
+    """ Resolve every dataset (source_id, experiment_id, member_id, table_id, variable_id and
+    grid_label) to a single version before anything is scheduled, so that superseded versions
+    are never downloaded.
+    :param dat:     pd data frame of the pangeo table (or a subset of it).
+    :param policy:  str 'latest' or 'earliest', the version to keep when nothing is pinned.
+    :param pinned:  optional pd data frame with the DATASET_COLS and a version column, the
+                    pinned version is kept for those datasets when it exists.
+    :return:        pd data frame with one row per dataset.
+    """
+    if policy not in ['latest', 'earliest']:
+        raise ValueError("policy must be 'latest' or 'earliest'")
+
+    out = dat.copy()
+    out['_index'] = out.index
+    out['_version'] = out['version'].astype(str).str.lstrip("v")
+    out = out.sort_values('_version', ascending=(policy == 'earliest'), kind='stable')
+
+    if pinned is not None and len(pinned) > 0:
+        pins = pinned[DATASET_COLS + ['version']].copy()
+        pins['_pin'] = pins.pop('version').astype(str).str.lstrip("v")
+        out = out.merge(pins, on=DATASET_COLS, how='left')
+        # Put the pinned version first, datasets whose pin is not available fall back to the policy.
+        out['_rank'] = (out['_version'] != out['_pin']).astype(int)
+        missing = out.groupby(DATASET_COLS, dropna=False)['_rank'].transform('min') > 0
+        missing = out.loc[missing & out['_pin'].notna(), DATASET_COLS].drop_duplicates()
+        if len(missing) > 0:
+            print(str(len(missing)) + " pinned versions are not available, using the " + policy)
+        out = out.sort_values('_rank', kind='stable').drop(columns=['_pin', '_rank'])
+
+    out = out.drop_duplicates(subset=DATASET_COLS, keep='first')
+    out = out.drop(columns='_version').set_index('_index').sort_index()
+    out.index.name = dat.index.name
+
+    return out
+
+
+def stores_frame(zstores):
+    """ Build a catalog-like data frame from a list of zstore addresses.
+    :param zstores: iterable of str zstore addresses.
+    :return:        pd data frame with a zstore column and one column per part of the address.
+    """
+    rows = []
+    for zstore in zstores:
+        row = parse_zstore(zstore)
+        row['zstore'] = zstore
+        rows.append(row)
+    return pd.DataFrame(rows, columns=ZSTORE_PARTS + ['zstore'])
+
+
+def diff_snapshots(old, new):
+    """ Compare two catalog snapshots, both with one version per dataset (see select_versions).
+    :param old:     pd data frame of the previous snapshot, DATASET_COLS, version and zstore.
+    :param new:     pd data frame of the current catalog, same columns.
+    :return:        pd data frame with the DATASET_COLS, zstore, old_zstore and a status column,
+                    one of 'added', 'updated' (new version, old_zstore is superseded), 'removed'
+                    or 'unchanged'.
+    """
+    cols = DATASET_COLS + ['zstore']
+    old = old[cols].rename(columns={'zstore': 'old_zstore'})
+    out = new[cols].merge(old, on=DATASET_COLS, how='outer', indicator=True)
+
+    out['status'] = 'unchanged'
+    out.loc[out['_merge'] == 'left_only', 'status'] = 'added'
+    out.loc[out['_merge'] == 'right_only', 'status'] = 'removed'
+    changed = (out['_merge'] == 'both') & (out['zstore'] != out['old_zstore'])
+    out.loc[changed, 'status'] = 'updated'
+
+    return out.drop(columns='_merge').reset_index(drop=True)
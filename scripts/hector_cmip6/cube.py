@@ -0,0 +1,252 @@
+""" Dense, memory-mappable cube of the processed outputs for Hector calibration.
+
+export_cube packs the long csv files in ./outputs into a single variable x run x
+year array (NaN where a run has no value) saved as a .npy file, plus lookup
+tables for the variable and run axes. TargetCube maps the array read-only, so
+many calibration workers on a node share one page-cache copy and a single
+target series is a zero-copy slice.
+
+The idealized outputs (i.e. CMIP6_idealized_tas_global.csv) count years from
+the start of the experiment instead of calendar years, they are packed into a
+cube of their own so the two year axes are never mixed.
+"""
+
+import os
+import glob
+import json
+
+import numpy as np
+import pandas as pd
+
+RUN_COLS = ['model', 'experiment', 'ensemble']
+
+# Columns every output file must have to be packed into the cube.
+REQUIRED_COLS = RUN_COLS + ['variable', 'year', 'value']
+
+# Output files with this in their name have years relative to the start of the experiment.
+IDEALIZED = 'idealized'
+
+OUTPUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "outputs")
+
+
+def cube_name(path):
+    """ Name of the variable axis entry for an output file, i.e. CMIP6_annual_rh_land.csv -> rh_land.
+    :param path:    str path to the output csv file.
+    :return:        str
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    for prefix in ['cmip6_annual_', 'cmip6_']:
+        if name.lower().startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def output_files(idealized=False, path=OUTPUTS_DIR):
+    """ The output csv files on one year axis.
+    :param idealized:   bool, the idealized outputs (years since the start of the experiment)
+                        instead of the outputs on calendar years.
+    :param path:        str directory of the outputs.
+    :return:            sorted list of str paths.
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.csv")))
+    return [f for f in files if (IDEALIZED in os.path.basename(f).lower()) == idealized]
+
+
+def read_outputs(files):
+    """ Read the long format output files into a single data frame.
+    :param files:   list of str paths to output csv files.
+    :return:        pd data frame with the model, experiment, ensemble, name, units, year and value.
+                    Files with an area column (i.e. tos global/HL/LL) get one name per area.
+    """
+    data = []
+    for f in files:
+        df = pd.read_csv(f)
+        if not set(REQUIRED_COLS).issubset(df.columns):
+            print("skipping " + f + ", it is not in the long model/experiment/ensemble/year/value format")
+            continue
+        df['name'] = cube_name(f)
+        if 'area' in df.columns:
+            df['name'] = df['name'] + "_" + df['area'].astype(str)
+        if 'units' not in df.columns:
+            df['units'] = ""
+        data.append(df[RUN_COLS + ['name', 'units', 'year', 'value']])
+
+    if len(data) < 1:
+        raise RuntimeError("no output files to pack")
+    return pd.concat(data, ignore_index=True)
+
+
+def export_cube(outdir, files=None, dtype='float64', idealized=False):
+    """ Pack the processed outputs into a memory-mappable cube.
+    :param outdir:      str directory to write cube.npy, variables.csv, runs.csv and meta.json to.
+    :param files:       list of str output csv files on one year axis, defaults to
+                        output_files(idealized).
+    :param dtype:       str dtype of the cube.
+    :param idealized:   bool, pack the idealized outputs, see output_files.
+    :return:            str outdir
+    """
+    if files is None:
+        files = output_files(idealized)
+    data = read_outputs(files)
+
+    # Duplicated rows (i.e. several versions of a run) are averaged.
+    data = data.groupby(RUN_COLS + ['name', 'units', 'year'], as_index=False)['value'].mean()
+
+    variables = data[['name', 'units']].drop_duplicates('name').sort_values('name')
+    variables = variables.reset_index(drop=True)
+    runs = data[RUN_COLS].drop_duplicates().sort_values(RUN_COLS).reset_index(drop=True)
+    first_year = int(data['year'].min())
+    n_year = int(data['year'].max()) - first_year + 1
+
+    var_idx = pd.Index(variables['name']).get_indexer(data['name'])
+    run_idx = pd.MultiIndex.from_frame(runs).get_indexer(pd.MultiIndex.from_frame(data[RUN_COLS]))
+    year_idx = data['year'].astype(int).values - first_year
+
+    os.makedirs(outdir, exist_ok=True)
+    shape = (len(variables), len(runs), n_year)
+    cube = np.lib.format.open_memmap(os.path.join(outdir, "cube.npy"), mode='w+',
+                                     dtype=dtype, shape=shape)
+    cube[:] = np.nan
+    cube[var_idx, run_idx, year_idx] = data['value'].values
+    cube.flush()
+    del cube
+
+    variables.to_csv(os.path.join(outdir, "variables.csv"), index_label='index')
+    runs.to_csv(os.path.join(outdir, "runs.csv"), index_label='index')
+    with open(os.path.join(outdir, "meta.json"), "w") as js:
+        json.dump({'first_year': first_year, 'n_year': n_year, 'shape': list(shape),
+                   'years': 'relative' if idealized else 'calendar', 'dtype': dtype, 'files': [os.path.basename(f) for f in files]}, js, indent=1)
+
+    print("packed " + str(len(data)) + " values into a " + "x".join(str(s) for s in shape) + " cube")
+    return outdir
+
+
+class TargetCube:
+    """ Read-only, memory-mapped view of a cube written by export_cube. """
+
+    def __init__(self, path):
+        """
+        :param path:    str directory written by export_cube.
+        """
+        with open(os.path.join(path, "meta.json")) as js:
+            self.meta = json.load(js)
+        self.data = np.load(os.path.join(path, "cube.npy"), mmap_mode='r')
+        self.variables = pd.read_csv(os.path.join(path, "variables.csv"), index_col='index',
+                                     keep_default_na=False)
+        self.runs = pd.read_csv(os.path.join(path, "runs.csv"), index_col='index',
+                                keep_default_na=False)
+        self.first_year = self.meta['first_year']
+        self.years = np.arange(self.first_year, self.first_year + self.meta['n_year'])
+
+        # Plain dicts so that a lookup does not go through pandas.
+        self._var = {n: i for i, n in enumerate(self.variables['name'])}
+        self._run = {tuple(r): i for i, r in enumerate(self.runs[RUN_COLS].itertuples(index=False))}
+
+    def run_index(self, model, experiment, ensemble):
+        """ Position of a run on the run axis.
+        :return:    int
+        """
+        return self._run[(model, experiment, ensemble)]
+
+    def var_index(self, name):
+        """ Position of a variable on the variable axis, i.e. 'rh_land' or 'ocean_componet-tos_values_HL'.
+        :return:    int
+        """
+        return self._var[name]
+
+    def series(self, name, model, experiment, ensemble, start=None, end=None):
+        """ Target time series of a single run, a zero-copy view of the cube.
+        :param name:        str variable name, see self.variables.
+        :param model:       str model name.
+        :param experiment:  str experiment name.
+        :param ensemble:    str ensemble member.
+        :param start:       optional int first year.
+        :param end:         optional int last year (inclusive).
+        :return:            tuple of np arrays (years, values)
+        """
+        years = self._years(start, end)
+        values = self.data[self.var_index(name), self.run_index(model, experiment, ensemble), years]
+        return self.years[years], values
+
+    def _match(self, **match):
+        """ Boolean mask of the runs matching the model/experiment/ensemble filters, only the small
+        run lookup table is read.
+        :param match:   model, experiment and/or ensemble values (str or list of str) to keep,
+                        None keeps everything.
+        :return:        np array of bool, one per run.
+        """
+        keep = np.ones(len(self.runs), dtype=bool)
+        for col, value in match.items():
+            if value is None:
+                continue
+            value = [value] if isinstance(value, str) else value
+            keep &= self.runs[col].isin(value).values
+        return keep
+
+    def _years(self, start=None, end=None):
+        """ Slice of the year axis for start..end (inclusive), clipped to the cube. """
+        i0 = 0 if start is None else max(start - self.first_year, 0)
+        i1 = len(self.years) if end is None else min(end - self.first_year + 1, len(self.years))
+        return slice(i0, i1)
+
+    def select(self, name, start=None, end=None, **match):
+        """ Targets of all runs matching the model/experiment/ensemble filters.
+        :param name:    str variable name.
+        :param start:   optional int first year.
+        :param end:     optional int last year (inclusive).
+        :param match:   model, experiment and/or ensemble values (str or list of str) to keep.
+        :return:        tuple (pd data frame of the selected runs, np array run x year)
+        """
+        keep = self._match(**match)
+        values = self.data[self.var_index(name), np.nonzero(keep)[0], self._years(start, end)]
+        return self.runs[keep], values
+
+    def query(self, variables=None, models=None, experiments=None, ensembles=None, start=None,
+              end=None, complete=False, as_frame=True):
+        """ Get only the requested variables, runs and years from the cube. The filters are applied
+        to the lookup tables first and only the matching block of the cube is read, i.e. the
+        historical tas of the runs that are complete over 1850-2014 is
+        cube.query('tas_global', experiments='historical', start=1850, end=2014, complete=True).
+        :param variables:   str or list of str variable names, None for all of them.
+        :param models:      str or list of str models, None for all of them.
+        :param experiments: str or list of str experiments, None for all of them.
+        :param ensembles:   str or list of str ensemble members, None for all of them.
+        :param start:       optional int first year.
+        :param end:         optional int last year (inclusive).
+        :param complete:    bool, only keep runs that have a value for every selected variable
+                            and year. Runs without any value are always dropped.
+        :param as_frame:    bool, return a long pd data frame like the output csv files instead
+                            of arrays.
+        :return:            pd data frame with model, experiment, ensemble, variable, units, year
+                            and value, or a tuple (variables, runs, years, values) where values
+                            is a variable x run x year np array.
+        """
+        if variables is None:
+            variables = list(self.variables['name'])
+        variables = [variables] if isinstance(variables, str) else list(variables)
+        var_idx = [self.var_index(v) for v in variables]
+        run_idx = np.nonzero(self._match(model=models, experiment=experiments, ensemble=ensembles))[0]
+        years = self._years(start, end)
+
+        # Basic slicing of the years is a view, the fancy index then copies only the selected block.
+        values = self.data[:, :, years][np.ix_(var_idx, run_idx)]
+
+        # Drop the runs without data (or with gaps when complete is set).
+        missing = np.isnan(values)
+        drop = missing.any(axis=(0, 2)) if complete else missing.all(axis=(0, 2))
+        run_idx = run_idx[~drop]
+        values = values[:, ~drop, :]
+        runs = self.runs.iloc[run_idx]
+        years = self.years[years]
+
+        if not as_frame:
+            return variables, runs, years, values
+
+        # Long format, one row per variable, run and year with a value.
+        v, r, y = np.nonzero(~np.isnan(values))
+        out = runs.iloc[r].reset_index(drop=True)
+        out['variable'] = np.asarray(variables)[v]
+        out['units'] = self.variables['units'].values[np.asarray(var_idx)[v]]
+        out['year'] = years[y]
+        out['value'] = values[v, r, y]
+        return out
@@ -0,0 +1,251 @@
+""" Streaming ensemble statistics of the extracted runs.
+
+EnsembleStats is updated with each run as soon as it is extracted. It keeps a
+running count, mean and sum of squared deviations (Welford) of the members of
+every model per variable, experiment and year, so the member mean and spread
+and the multi-model percentiles (one vote per model) can be read at any time
+without re-reading the raw csv files. Monthly and seasonal series are averaged
+to one value per year first, so a member counts once per year. The state is one
+row per model and year, small enough to keep exact instead of sketching it.
+
+The annual value of every member is its contribution to the moments. They are
+appended to <product>_values.csv (and the member with its version to
+<product>_members.csv) as each run finishes, so a member that is re-versioned
+on the archive replaces its old contribution instead of being skipped or
+counted twice. Both files are append-only logs, the last version of a member
+counts. The moments are rebuilt from them when the statistics are read and
+written to <product>.csv every SAVE_EVERY runs and by save.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .catalog import parse_zstore
+
+# Default location of the statistics, ./outputs/ensemble_stats in the repository root.
+STATS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                         "outputs", "ensemble_stats")
+
+KEY_COLS = ['variable', 'experiment', 'model', 'year']
+STATE_COLS = KEY_COLS + ['n', 'mean', 'm2']
+MEMBER_COLS = ['variable', 'experiment', 'model', 'ensemble']
+VALUE_COLS = MEMBER_COLS + ['year', 'value']
+LOG_COLS = {'members': MEMBER_COLS + ['version'], 'values': VALUE_COLS + ['version']}
+
+# Number of runs added between two writes of the moments.
+SAVE_EVERY = 50
+
+
+def merge_moments(a, b):
+    """ Combine two sets of running moments (Chan et al.), aligned on their index.
+    :param a:   pd data frame with n, mean and m2 columns.
+    :param b:   pd data frame with n, mean and m2 columns.
+    :return:    pd data frame with the combined n, mean and m2 over the union of the indices.
+    """
+    index = a.index.union(b.index)
+    a = a.reindex(index)
+    b = b.reindex(index)
+    na = a['n'].fillna(0).values
+    nb = b['n'].fillna(0).values
+    ma = a['mean'].fillna(0).values
+    mb = b['mean'].fillna(0).values
+    n = na + nb
+    delta = mb - ma
+    mean = ma + delta * nb / n
+    m2 = a['m2'].fillna(0).values + b['m2'].fillna(0).values + delta ** 2 * na * nb / n
+    return pd.DataFrame({'n': n, 'mean': mean, 'm2': m2}, index=index)
+
+
+def remove_moments(a, b):
+    """ Take a set of moments back out of running moments, the inverse of merge_moments.
+    :param a:   pd data frame with n, mean and m2 columns, the running moments.
+    :param b:   pd data frame with n, mean and m2 columns, moments that were merged into a.
+    :return:    pd data frame with the n, mean and m2 of a without b, the keys left without
+                values are dropped.
+    """
+    b = b.reindex(a.index)
+    n = a['n'].values.astype('float64')
+    nb = b['n'].fillna(0).values
+    mb = b['mean'].fillna(0).values
+    na = n - nb
+    keep = na > 0.5
+    ma = np.where(keep, (n * a['mean'].values - nb * mb) / np.where(keep, na, 1), 0)
+    delta = mb - ma
+    m2 = a['m2'].values - b['m2'].fillna(0).values - delta ** 2 * na * nb / n
+    out = pd.DataFrame({'n': na, 'mean': ma, 'm2': np.maximum(m2, 0)}, index=a.index)
+    return out[keep]
+
+
+def annual(out):
+    """ One value per member and year, the mean of the monthly or seasonal values of a year.
+    :param out: pd data frame of a run with the MEMBER_COLS, year and value columns.
+    :return:    pd data frame with VALUE_COLS.
+    """
+    df = out[MEMBER_COLS + ['year', 'value']].copy()
+    df['year'] = df['year'].astype(int)
+    df = df[np.isfinite(df['value'])]
+    return df.groupby(MEMBER_COLS + ['year'], sort=False)['value'].mean().reset_index()
+
+
+def moments(values):
+    """ Count, mean and sum of squared deviations per KEY_COLS.
+    :param values:  pd data frame with VALUE_COLS.
+    :return:        pd data frame with n, mean and m2 indexed by KEY_COLS.
+    """
+    batch = values.groupby(KEY_COLS)['value'].agg(['count', 'mean', 'var'])
+    return pd.DataFrame({'n': batch['count'], 'mean': batch['mean'],
+                         'm2': batch['var'].fillna(0) * (batch['count'] - 1)})
+
+
+class EnsembleStats:
+    """ Running per-model ensemble moments of one product. """
+
+    def __init__(self, product, path=STATS_DIR, exclude=None):
+        """
+        :param product: str name of the product, i.e. 'tas' or 'tos_HL'.
+        :param path:    str directory the state is saved to.
+        :param exclude: optional EnsembleStats whose members are not counted again, i.e. the
+                        statistics a shard of a run is merged into.
+        """
+        self.product = product
+        self.file = os.path.join(path, product + ".csv")
+        self.members_file = os.path.join(path, product + "_members.csv")
+        self.values_file = os.path.join(path, product + "_values.csv")
+
+        self.members = pd.DataFrame(columns=LOG_COLS['members'])
+        self._values = pd.DataFrame(columns=LOG_COLS['values'])
+        if os.path.exists(self.members_file):
+            members = pd.read_csv(self.members_file, keep_default_na=False, dtype=str)
+            self.members = members.drop_duplicates(MEMBER_COLS, keep='last').reset_index(drop=True)
+        if os.path.exists(self.values_file):
+            values = pd.read_csv(self.values_file, keep_default_na=False, na_values=[""],
+                                 dtype={c: str for c in LOG_COLS['members']})
+            # Only the values of the current version of every member count.
+            values = values.merge(self.members, on=LOG_COLS['members'])
+            self._values = values.drop_duplicates(MEMBER_COLS + ['year'], keep='last').reset_index(drop=True)
+        self._new = []
+        self.state = pd.DataFrame(columns=STATE_COLS).set_index(KEY_COLS)
+        if not self._values.empty:
+            self.state = moments(self._values)
+        self._unsaved = 0
+        self._versions = self._member_versions(self.members)
+        self._excluded = {} if exclude is None else exclude._versions
+
+    @property
+    def values(self):
+        """ pd data frame of the annual values of the members counted, VALUE_COLS and version. """
+        if len(self._new) > 0:
+            frames = [self._values] if not self._values.empty else []
+            self._values = pd.concat(frames + self._new, ignore_index=True)
+            self._new = []
+        return self._values
+
+    @staticmethod
+    def _member_versions(members):
+        return dict(zip(members[MEMBER_COLS].itertuples(index=False, name=None), members['version']))
+
+    def _remove(self, runs):
+        """ Take the contribution of some members out of the state, the logs are not changed.
+        :param runs:    list of tuples of the MEMBER_COLS values of members counted here.
+        """
+        if len(runs) == 0:
+            return
+        ids = pd.DataFrame(runs, columns=MEMBER_COLS)
+        values = self.values.merge(ids, how='left', indicator=True)
+        old = values['_merge'] == 'both'
+        if old.any():
+            self.state = remove_moments(self.state, moments(values[old]))
+        self._values = values.loc[~old, LOG_COLS['values']].reset_index(drop=True)
+        members = self.members.merge(ids, how='left', indicator=True)
+        self.members = members.loc[members['_merge'] == 'left_only', LOG_COLS['members']].reset_index(drop=True)
+        for r in runs:
+            self._versions.pop(r, None)
+
+    def _add(self, values, members):
+        """ Count new members and append them to the logs. The values are written first, they
+        only count once the member is in the members log.
+        :param values:  pd data frame with VALUE_COLS and version.
+        :param members: pd data frame with MEMBER_COLS and version.
+        """
+        self.state = moments(values) if self.state.empty else merge_moments(self.state, moments(values))
+        self._new.append(values[LOG_COLS['values']])
+        self.members = members if self.members.empty else pd.concat([self.members, members], ignore_index=True)
+        self._versions.update(self._member_versions(members))
+
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        for df, f in [(values, self.values_file), (members, self.members_file)]:
+            cols = LOG_COLS['values'] if f == self.values_file else LOG_COLS['members']
+            df[cols].to_csv(f, mode='a', index=False, header=not os.path.exists(f))
+
+    def update(self, out, zstore=None):
+        """ Add an extracted run to the statistics. A run that was already added with the same
+        version (i.e. served from the cache on a rerun) is not counted twice, a run added with an
+        older version is replaced. The moments are written every SAVE_EVERY runs, call save once
+        the last run is added.
+        :param out:     pd data frame of a single run as written by the A-scripts, with model,
+                        experiment, ensemble, variable, year (and month or season) and value columns.
+        :param zstore:  optional str zstore the run was extracted from, for its version.
+        """
+        version = "" if zstore is None else parse_zstore(zstore)['version']
+        df = annual(out)
+
+        runs = [r for r in df[MEMBER_COLS].drop_duplicates().itertuples(index=False, name=None)
+                if version not in [self._versions.get(r), self._excluded.get(r)]]
+        if len(runs) == 0:
+            return
+        self._remove([r for r in runs if r in self._versions])
+
+        members = pd.DataFrame(runs, columns=MEMBER_COLS)
+        members['version'] = version
+        self._add(df.merge(members), members)
+        self._unsaved += 1
+        if self._unsaved >= SAVE_EVERY:
+            self.save()
+
+    def merge(self, other):
+        """ Add the statistics of another set of runs, i.e. of one shard of a run. Members of
+        other counted here with another version replace them.
+        :param other:   EnsembleStats of the same product over runs not counted here yet.
+        """
+        if other.members.empty:
+            return
+        same = [r for r, v in other._versions.items() if self._versions.get(r) == v]
+        if len(same) > 0:
+            raise ValueError(str(len(same)) + " " + self.product + " runs would be counted twice")
+        self._remove([r for r in other._versions if r in self._versions])
+        self._add(other.values, other.members)
+        self.save()
+
+    def save(self):
+        """ Write the moments to csv, via a temporary file so a killed job keeps the old ones. """
+        if self.state.empty and not os.path.exists(self.members_file):
+            return
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        self.state.reset_index().to_csv(self.file + ".tmp", index=False)
+        os.replace(self.file + ".tmp", self.file)
+        self._unsaved = 0
+
+    def model_summary(self):
+        """ Ensemble mean and spread of every model.
+        :return:    pd data frame with variable, experiment, model, year, n (members), mean and sd.
+        """
+        out = self.state.reset_index()
+        out['sd'] = np.sqrt(out['m2'] / (out['n'] - 1)).where(out['n'] > 1)
+        return out[KEY_COLS + ['n', 'mean', 'sd']]
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """ Multi-model statistics of the model ensemble means, each model counts once.
+        :param quantiles:   list of float quantiles to report.
+        :return:            pd data frame with variable, experiment, year, n_models, n_runs,
+                            mean, sd and one column per quantile, i.e. q05 and q95.
+        """
+        models = self.model_summary()
+        group = models.groupby(['variable', 'experiment', 'year'])
+        out = group.agg(n_models=('mean', 'size'), n_runs=('n', 'sum'))
+        out['mean'] = group['mean'].mean()
+        out['sd'] = group['mean'].std()
+        for q in quantiles:
+            out['q' + format(round(q * 100), '02d')] = group['mean'].quantile(q)
+        return out.reset_index()
@@ -0,0 +1,444 @@
+""" Extraction engine behind ``python -m hector_cmip6 extract``.
+
+The products asked for (see products.py) are grouped by variable, table and
+cell areas. For every store of a group the regions that are not cached yet are
+reduced in a single streaming pass (stream.stream_means) and each region is
+cached under its own key, so tas, tas_land and tas_ocean cost one read whether
+they are extracted together or one after the other. Stores are reduced in a
+pool of worker processes, each with its own memory ceiling. The parent process
+owns the manifest, the quarantine, the ensemble statistics and the output files,
+so no two processes ever write the same file.
+"""
+
+import importlib.util
+import os
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from .cache import CACHE_DIR, CODE_VERSION, ReductionCache, cache_key
+from .catalog import MissingFxError, fetch_pangeo_table, find_fx, fx_zstores, parse_zstore, select_versions
+from .ensemble import STATS_DIR, EnsembleStats
+from .frequency import compact, frequency_file, temporal_means
+from .manifest import INPUTS_DIR, Manifest, plan_updates
+from .metadata import read_index
+from .products import HL_LAT, MIPS, get_product
+from .quarantine import Quarantine, classify_failure
+from .schedule import estimate_cost, largest_first
+from .subset import year_window
+
+# Root of the product output directories, the repository root by default.
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+FORMATS = ['csv', 'parquet']
+
+# Product keys that decide which products can share a read of a store.
+GROUP_KEYS = ['variable', 'table', 'area', 'grid_label', 'skipna', 'years']
+
+
+def parse_bytes(text):
+    """ Read a memory size such as 8G, 512M or 1.5GB.
+    :param text:    str size, a number of bytes or a number followed by K, M, G or T.
+    :return:        int number of bytes.
+    """
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    t = str(text).strip().upper()
+    if t.endswith('B'):
+        t = t[:-1]
+    factor = 1
+    if len(t) > 0 and t[-1] in units:
+        factor = units[t[-1]]
+        t = t[:-1]
+    try:
+        return int(float(t) * factor)
+    except ValueError:
+        raise ValueError("can't read the memory size " + str(text) + ", use i.e. 8G or 512M")
+
+
+def limit_memory(max_bytes):
+    """ Cap the address space of the current process, a reduction that needs more raises a
+    MemoryError (recorded as out_of_memory and retried on the next run) instead of taking the
+    node down.
+    :param max_bytes:   int number of bytes.
+    """
+    import resource
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def _init_worker(max_bytes):
+    if max_bytes is not None:
+        limit_memory(max_bytes)
+
+
+def product_columns(spec):
+    """ Columns of the monthly means of a product, in the order of the A-script it replaces (see
+    products.PRODUCTS), temporal_means drops the month from the annual and seasonal means.
+    :param spec:    dict spec of the product.
+    :return:        list of str column names.
+    """
+    cols = ['variable', 'experiment', 'units'] + (['frequency'] if spec['frequency_column'] else [])
+    cols += ['ensemble', 'model', 'year', 'month', 'value']
+    if spec['area_column']:
+        cols.append('area')
+    if spec['land_area_column']:
+        cols.append('land_area')
+    return cols
+
+
+def group_key(spec):
+    """ Products with the same group key are reduced from the same read of a store. """
+    return tuple(str(spec[k]) for k in GROUP_KEYS)
+
+
+def find_zstores(dat, spec, experiments, mips=MIPS):
+    """ Find the latest version of every store of a product.
+    :param dat:         pd data frame of the pangeo table, see catalog.fetch_pangeo_table.
+    :param spec:        dict spec of the product.
+    :param experiments: list of str experiment_ids.
+    :param mips:        list of str activity_ids.
+    :return:            list of str zstores.
+    """
+    d = dat[(dat['variable_id'] == spec['variable']) & (dat['table_id'] == spec['table']) &
+            (dat['activity_id'].isin(mips)) & (dat['experiment_id'].isin(experiments))]
+    if spec['grid_label'] is not None:
+        d = d[d['grid_label'] == spec['grid_label']]
+    if spec['members'] is not None:
+        d = d[d['member_id'].str.contains(spec['members'])]
+    return list(select_versions(d, policy='latest')['zstore'])
+
+
+def product_key(zstore, spec):
+    """ Cache key of the monthly means of a product for a store, see cache.cache_key. """
+    info = parse_zstore(zstore)
+    weights = fx_zstores(info['source_id'], [spec['area']], grid_label=spec['grid_label'])
+    if spec['region'] in ['land', 'ocean']:
+        weights += fx_zstores(info['source_id'], ['sftlf'])
+    years = None
+    if spec['years'] is not None:
+        years = year_window(spec['years'], spec['variable'], info['experiment_id'])
+    return cache_key(zstore, weights, product=spec['variable'] + "_" + spec['region'], region=spec['region'],
+                     hl_lat=HL_LAT, skipna=spec['skipna'], years=years, aggregation='monthly mean',
+                     columns=product_columns(spec))
+
+
+def product_weights(ds, variable, regions, area_fx='areacella', grid_label=None):
+    """ Weights of every region on the grid of a variable, stacked along a region dimension.
+    :param ds:          xarray dataset of CMIP data.
+    :param variable:    str name of the variable.
+    :param regions:     list of str regions, see products.REGIONS.
+    :param area_fx:     str cell area field, areacella (cell areas from the grid, cos(lat) if a
+                        curvilinear grid has no areacella) or areacello.
+    :param grid_label:  optional str grid label of the cell area field.
+    :return:            xarray DataArray with a region dimension.
+    """
+    import xarray as xr
+
+    from .areas import cell_area
+    from .reduce import cos_lat_area, on_grid
+    from .remote import open_fx
+
+    lat = 'lat' if 'lat' in ds.coords else 'latitude'
+    if area_fx == 'areacella':
+        try:
+            area = cell_area(ds, variable)
+        except MissingFxError:
+            area = cos_lat_area(ds[variable], lat)
+    else:
+        ds_area = open_fx(find_fx(area_fx, ds.source_id, grid_label=grid_label))
+        area = on_grid(ds_area[area_fx], ds[variable])
+
+    land_frac = None
+    if 'land' in regions or 'ocean' in regions:
+        land_frac = 0.01 * on_grid(open_fx(find_fx('sftlf', ds.source_id))['sftlf'], area).fillna(0)
+
+    weights = []
+    for region in regions:
+        if region == 'global':
+            weights.append(area)
+        elif region == 'land':
+            weights.append(area * land_frac)
+        elif region == 'ocean':
+            weights.append(area * (1 - land_frac))
+        elif region == 'HL':
+            weights.append(area.where((area[lat] >= HL_LAT) | (area[lat] <= -HL_LAT), 0))
+        elif region == 'LL':
+            weights.append(area.where((area[lat] <= HL_LAT) & (area[lat] >= -HL_LAT), 0))
+        else:
+            raise ValueError("unknown region " + str(region))
+    return xr.concat(weights, dim=pd.Index(regions, name='region'), coords='minimal', compat='override')
+
+
+def _reduce(zstore, products):
+    """ Monthly means of every product of a group from one read of a store. """
+    from .remote import open_store
+    from .stream import stream_means
+    from .subset import select_years
+
+    spec = list(products.values())[0]
+    v = spec['variable']
+    ds = open_store(zstore)
+    if spec['years'] is not None:
+        ds = select_years(ds, year_window(spec['years'], v, ds.experiment_id))
+
+    regions = [p['region'] for p in products.values()]
+    weights = product_weights(ds, v, regions, spec['area'], spec['grid_label'])
+    means = stream_means(ds[v], weights, skipna=spec['skipna'])
+
+    meta = {'variable': v, 'experiment': ds.experiment_id, 'units': ds[v].attrs['units'],
+            'frequency': ds.attrs["frequency"], 'ensemble': ds.attrs["variant_label"], 'model': ds.source_id}
+    out = {}
+    for name, p in products.items():
+        df = pd.DataFrame(dict(meta, year=means['time'].dt.year.values, month=means['time'].dt.month.values,
+                               value=means.sel(region=p['region']).values))
+        df['area'] = p['region']
+        df['land_area'] = float(weights.sel(region=p['region']).sum())
+        out[name] = compact(df[product_columns(p)])
+    return out
+
+
+def reduce_store(zstore, products, cache_dir=CACHE_DIR):
+    """ Monthly means of the products of a group for one store, from the cache where possible. The
+    regions that are not cached are reduced together, in one read of the store.
+    :param zstore:      str of the location of the cmip6 data file on pangeo.
+    :param products:    dict of product name to spec, all with the same group_key.
+    :param cache_dir:   str directory of the reduction cache.
+    :return:            tuple (dict of product name to compact monthly pd data frame, float seconds).
+    """
+    start = time.time()
+    cache = ReductionCache(cache_dir)
+    keys = {name: product_key(zstore, spec) for name, spec in products.items()}
+    out = {name: cache.get(key) for name, key in keys.items()}
+    todo = {name: products[name] for name in products if out[name] is None}
+    if len(todo) > 0:
+        for name, df in _reduce(zstore, todo).items():
+            cache.put(keys[name], df, dict(zstore=zstore, product=name, code=CODE_VERSION))
+            out[name] = df
+    return out, time.time() - start
+
+
+def write_product(monthly, name, spec, out=REPO_DIR, fmt='csv', frequencies=None, stats=None, zstore=None):
+    """ Write the temporal means of one product of one run.
+    :param monthly:     pd data frame of the monthly means, see reduce_store.
+    :param name:        str name of the product.
+    :param spec:        dict spec of the product.
+    :param out:         str root directory, the product goes to <out>/<outdir of the product>.
+    :param fmt:         str output format, csv or parquet.
+    :param frequencies: list of str frequencies, defaults to the frequencies of the product. The
+                        first goes to the product directory, the others to subdirectories of it.
+    :param stats:       optional EnsembleStats updated with the first frequency.
+    :param zstore:      optional str zstore of the run, its version is recorded with the statistics.
+    :return:            list of str files written.
+    """
+    frequencies = spec['frequencies'] if frequencies is None else frequencies
+    outdir = os.path.join(out, spec['outdir'])
+    file = "_".join(str(monthly[c].iloc[0]) for c in ['model', 'experiment', 'ensemble']) + "." + fmt
+
+    written = []
+    for freq, df in temporal_means(monthly, frequencies).items():
+        if freq == frequencies[0] and stats is not None:
+            stats.update(df, zstore)
+        path = frequency_file(outdir, file, freq, frequencies)
+        if fmt == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=spec['index_column'])
+        written.append(path)
+    return written
+
+
+def check_format(fmt):
+    """ Check an output format before any store is reduced rather than on the first write.
+    :param fmt: str output format, one of FORMATS.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("unknown output format " + str(fmt) + ", use one of " + ", ".join(FORMATS))
+    if fmt == 'parquet' and importlib.util.find_spec("pyarrow") is None:
+        raise RuntimeError("the parquet output format needs pyarrow")
+
+
+def plan_tasks(products, experiments=None, mips=MIPS, inputs_dir=INPUTS_DIR, snapshot_dir=None, dry_run=False):
+    """ Find the stores that are new, re-versioned or not completed yet for some products, and
+    the products each of them is needed for.
+    :param products:        list of str product names, see products.PRODUCTS.
+    :param experiments:     optional list of str experiment_ids, defaults to those of each product.
+    :param mips:            list of str activity_ids.
+    :param inputs_dir:      str directory of the manifest and quarantine.
+    :param snapshot_dir:    str directory of the catalog snapshots, defaults to <inputs_dir>/snapshots.
+    :param dry_run:         bool, only find the stores, the manifest and the snapshots are not changed.
+    :return:                list of tuples (str zstore, list of str product names), one per store
+                            and group of products that share a read of it.
+    """
+    specs = {name: get_product(name) for name in products}
+    dat = fetch_pangeo_table()
+    os.makedirs(inputs_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(inputs_dir, "manifest.csv"))
+    quarantine = Quarantine(os.path.join(inputs_dir, "quarantine.csv"))
+    snapshot_dir = os.path.join(inputs_dir, "snapshots") if snapshot_dir is None else snapshot_dir
+
+    # The products every store is needed for, per group of products that share a read.
+    jobs = {}
+    for name, spec in specs.items():
+        zstores = find_zstores(dat, spec, spec['experiments'] if experiments is None else experiments, mips)
+        zstores = plan_updates(zstores, name, manifest, snapshot_dir=snapshot_dir, dry_run=dry_run)
+        for zstore in quarantine.exclude(zstores, name):
+            jobs.setdefault((group_key(spec), zstore), []).append(name)
+
+    tasks = [(zstore, names) for (_, zstore), names in jobs.items()]
+    print(str(len(tasks)) + " stores to reduce for " + ", ".join(specs))
+    return tasks
+
+
+def run_tasks(tasks, manifest, quarantine, stats, workers=1, max_mem=None, out=REPO_DIR, fmt='csv',
+              frequencies=None, cache_dir=CACHE_DIR):
+    """ Reduce the stores of a plan and write their products. The tasks are taken in order and
+    handed to a worker only when it is free, so with the most expensive stores first (see
+    schedule.largest_first) no large store is left for the end of the run, and tasks can be
+    generated as they are dispatched (see shard.run_shard).
+    :param tasks:       iterable of tuples (str zstore, list of str product names), see plan_tasks.
+    :param manifest:    Manifest the completed stores are recorded in.
+    :param quarantine:  Quarantine the failed stores are recorded in.
+    :param stats:       dict of product name to the EnsembleStats updated with each run.
+    :param workers:     int number of worker processes reducing stores, 1 without max_mem runs in this
+                        process.
+    :param max_mem:     optional str or int memory ceiling of the whole run (i.e. 8G), split evenly
+                        over the workers.
+    :param out:         str root directory of the outputs.
+    :param fmt:         str output format, csv or parquet.
+    :param frequencies: optional list of str frequencies, defaults to those of each product.
+    :param cache_dir:   str directory of the reduction cache.
+    """
+    check_format(fmt)
+    workers = max(int(workers), 1)
+    max_bytes = None if max_mem is None else parse_bytes(max_mem) // workers
+    groups = ((zstore, {name: get_product(name) for name in names}) for zstore, names in tasks)
+
+    def finish(zstore, group, result=None, error=None):
+        if error is not None:
+            reason = classify_failure(error)
+            print("problem with " + zstore + " (" + reason + "): " + str(error))
+            for name in group:
+                quarantine.add(name, zstore, reason, str(error))
+            return
+        frames, seconds = result
+        for name, spec in group.items():
+            write_product(frames[name], name, spec, out, fmt, frequencies, stats[name], zstore)
+            manifest.record(name, zstore, seconds)
+
+    # The memory ceiling is only set in worker processes, never on the process running the engine.
+    if workers == 1 and max_bytes is None:
+        for zstore, group in groups:
+            try:
+                result = reduce_store(zstore, group, cache_dir)
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                finish(zstore, group, error=e)
+                continue
+            finish(zstore, group, result)
+    else:
+        # Stores in flight when a worker died are retried one at a time, so only the store that
+        # kills its worker is quarantined.
+        suspects = []
+        while True:
+            lost = _run_pool(groups, suspects, finish, workers, max_bytes, cache_dir)
+            if len(lost) == 0:
+                break
+            if len(lost) == 1:
+                (zstore, group), error = lost[0]
+                finish(zstore, group, error=error)
+            else:
+                print("a worker died with " + str(len(lost)) + " stores in flight, retrying them one at a time")
+                suspects[:0] = [task for task, _ in lost]
+
+    for product_stats in stats.values():
+        product_stats.save()
+
+
+def _run_pool(groups, suspects, finish, workers, max_bytes, cache_dir):
+    """ Reduce stores in a new process pool until there are none left or a worker dies (i.e. killed
+    for running out of memory), which breaks the pool.
+    :param groups:      iterator of tuples (str zstore, dict of product specs) still to reduce.
+    :param suspects:    list of the same tuples that were in flight when a worker died before, they
+                        are taken first and one at a time.
+    :param finish:      function called with the zstore, group and result or error of every store.
+    :param workers:     int number of worker processes.
+    :param max_bytes:   optional int memory ceiling of every worker.
+    :param cache_dir:   str directory of the reduction cache.
+    :return:            list of tuples (task, BrokenProcessPool error) of the stores in flight when
+                        the pool broke, empty once every store is done.
+    """
+    lost = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(max_bytes,)) as pool:
+        futures = {}
+
+        def submit():
+            if len(suspects) > 0:
+                task = suspects.pop(0) if len(futures) == 0 else None
+            else:
+                task = next(groups, None)
+            if task is not None:
+                futures[pool.submit(reduce_store, task[0], task[1], cache_dir)] = task
+
+        # One store per worker in flight, the next one is only taken when a worker is free.
+        for _ in range(workers):
+            submit()
+        while len(futures) > 0:
+            # Once the pool is broken every future left fails, collect them all.
+            done, _ = wait(futures, return_when=FIRST_COMPLETED if len(lost) == 0 else ALL_COMPLETED)
+            for future in done:
+                zstore, group = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    lost.append(((zstore, group), e))
+                except Exception as e:
+                    finish(zstore, group, error=e)
+                else:
+                    finish(zstore, group, result)
+                if len(lost) == 0:
+                    submit()
+    return lost
+
+def extract(products, experiments=None, mips=MIPS, workers=1, max_mem=None, out=REPO_DIR, fmt='csv',
+            frequencies=None, cache_dir=CACHE_DIR, inputs_dir=INPUTS_DIR, stats_dir=STATS_DIR,
+            dry_run=False):
+    """ Extract products for every store that is new, re-versioned or not completed yet.
+    :param products:    list of str product names, see products.PRODUCTS.
+    :param experiments: optional list of str experiment_ids, defaults to those of each product.
+    :param mips:        list of str activity_ids.
+    :param workers:     int number of worker processes reducing stores, 1 without max_mem runs in this
+                        process.
+    :param max_mem:     optional str or int memory ceiling of the whole run (i.e. 8G), split evenly
+                        over the workers.
+    :param out:         str root directory of the outputs.
+    :param fmt:         str output format, csv or parquet.
+    :param frequencies: optional list of str frequencies, defaults to those of each product.
+    :param cache_dir:   str directory of the reduction cache.
+    :param inputs_dir:  str directory of the manifest, quarantine and catalog snapshots.
+    :param stats_dir:   str directory of the ensemble statistics.
+    :param dry_run:     bool, only list the stores that would be reduced, the manifest and the catalog
+                        snapshots are not changed.
+    :return:            list of str zstores that were (or with dry_run would be) reduced, in the order
+                        they were dispatched.
+    """
+    check_format(fmt)
+    tasks = plan_tasks(products, experiments, mips, inputs_dir, dry_run=dry_run)
+    manifest = Manifest(os.path.join(inputs_dir, "manifest.csv"))
+    cost = estimate_cost(list(pd.unique(pd.Series([zstore for zstore, _ in tasks], dtype=object))), read_index(),
+                         manifest)
+    tasks = largest_first(tasks, cost)
+    print("estimated " + format(cost.sum() / 3600, '.1f') + " hours of work, the largest store " +
+          format(cost.max() / 3600 if len(cost) > 0 else 0, '.1f') + " hours")
+    if dry_run:
+        return [zstore for zstore, _ in tasks]
+
+    quarantine = Quarantine(os.path.join(inputs_dir, "quarantine.csv"))
+    stats = {name: EnsembleStats(name, stats_dir) for name in products}
+    run_tasks(tasks, manifest, quarantine, stats, workers, max_mem, out, fmt, frequencies, cache_dir)
+    return [zstore for zstore, _ in tasks]
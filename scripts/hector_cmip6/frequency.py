@@ -0,0 +1,163 @@
+""" Monthly, seasonal and annual series from the monthly area means of a run.
+
+The A-scripts reduce each store to its monthly area means once. That monthly
+series is what gets cached (stored compactly, see compact), and every temporal
+product is calculated from it: the monthly values themselves, the seasonal
+means (DJF, MAM, JJA, SON) and the annual means. Asking for another frequency
+later is served from the cache and never reads the raw fields again.
+
+Day table variables are reduced the same way to a daily series of area means
+(and area fractions above thresholds), daily_stats turns it into monthly and
+annual means, maxima and counts of days above the thresholds.
+"""
+
+import os
+
+import pandas as pd
+
+# Months of every season, December counts towards the winter of the following year.
+SEASONS = {'DJF': [12, 1, 2], 'MAM': [3, 4, 5], 'JJA': [6, 7, 8], 'SON': [9, 10, 11]}
+FREQUENCIES = ['monthly', 'annual'] + list(SEASONS)
+
+TIME_COLS = ['year', 'month', 'day']
+
+# Prefix of the columns of the daily area fraction above a threshold, i.e. over_308.15.
+OVER = 'over_'
+
+
+def compact(monthly):
+    """ Compact copy of a long monthly data frame for the cache, the repeated meta data columns are
+    stored as categories and the year and month as small integers.
+    :param monthly: pd data frame with year, month (and for daily data day) and value columns and
+                    any number of meta data columns (model, experiment, ensemble, variable, area ...).
+    :return:        pd data frame
+    """
+    out = monthly.copy()
+    for col in out.columns:
+        if out[col].dtype == object and col not in TIME_COLS:
+            out[col] = out[col].astype('category')
+    out['year'] = out['year'].astype('int16')
+    for col in ['month', 'day']:
+        if col in out.columns:
+            out[col] = out[col].astype('int8')
+    return out
+
+
+def _expand(df):
+    """ Undo compact, meta data columns back to str and the time columns to int. """
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    for col in TIME_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype(int)
+    return df
+
+
+def temporal_means(monthly, frequencies=('annual',)):
+    """ Temporal means of a long monthly data frame.
+    :param monthly:     pd data frame with year, month and value columns (as returned by compact
+                        or not) and meta data columns, every combination of the meta data is a
+                        separate series.
+    :param frequencies: list of str, any of FREQUENCIES. Annual and seasonal means only use
+                        complete years and seasons.
+    :return:            dict of pd data frames, one per frequency, with the columns of monthly
+                        (without month for the annual and seasonal means).
+    """
+    for freq in frequencies:
+        if freq not in FREQUENCIES:
+            raise ValueError("unknown frequency " + str(freq) + ", use one of " + ", ".join(FREQUENCIES))
+
+    df = _expand(monthly)
+    keys = [c for c in df.columns if c not in TIME_COLS + ['value']]
+    columns = [c for c in df.columns if c != 'month']
+
+    out = {}
+    for freq in frequencies:
+        if freq == 'monthly':
+            out[freq] = df.reset_index(drop=True)
+            continue
+
+        # Label every month with the year of its season (or calendar year) and drop the others.
+        d = df
+        if freq in SEASONS:
+            d = df[df['month'].isin(SEASONS[freq])].copy()
+            d.loc[d['month'] == 12, 'year'] += 1
+        n = 12 if freq == 'annual' else len(SEASONS[freq])
+
+        group = d.groupby(keys + ['year'], sort=False, dropna=False)['value']
+        means = group.agg(['mean', 'size'])
+        means = means[means['size'] == n].rename(columns={'mean': 'value'}).reset_index()
+        out[freq] = means[columns]
+    return out
+
+
+def days_in(year, month=None, calendar='standard'):
+    """ Number of days of a month or a year in a CF calendar.
+    :param year:        int year.
+    :param month:       int month, None for the whole year.
+    :param calendar:    str CF calendar, i.e. standard, noleap or 360_day.
+    :return:            int
+    """
+    import cftime
+
+    start = cftime.datetime(year, 1 if month is None else month, 1, calendar=calendar)
+    if month is None or month == 12:
+        end = cftime.datetime(year + 1, 1, 1, calendar=calendar)
+    else:
+        end = cftime.datetime(year, month + 1, 1, calendar=calendar)
+    return (end - start).days
+
+
+def daily_stats(daily, frequencies=('annual',)):
+    """ Monthly or annual statistics of a long daily data frame: the mean and the maximum of the
+    daily values, and for every over_<threshold> column (the area fraction above the threshold
+    each day) the number of days above the threshold, averaged over the area.
+    :param daily:       pd data frame with year, month, day, value and over_ columns (as returned by
+                        compact or not) and meta data columns, every combination of the meta data
+                        is a separate series. The calendar column, if there is one, is used to tell
+                        complete months and years, the standard calendar otherwise.
+    :param frequencies: list of str, 'monthly' and/or 'annual'. Only complete months and years
+                        are used.
+    :return:            dict of pd data frames, one per frequency, with the meta data columns, year
+                        (and month), mean, max and a days_over_<threshold> column per threshold.
+    """
+    for freq in frequencies:
+        if freq not in ['monthly', 'annual']:
+            raise ValueError("unknown frequency " + str(freq) + " for daily statistics, use monthly or annual")
+
+    df = _expand(daily)
+    over = [c for c in df.columns if c.startswith(OVER)]
+    keys = [c for c in df.columns if c not in TIME_COLS + ['value'] + over]
+    calendar = df['calendar'].iloc[0] if 'calendar' in df.columns and len(df) > 0 else 'standard'
+
+    out = {}
+    for freq in frequencies:
+        period = ['year'] if freq == 'annual' else ['year', 'month']
+        group = df.groupby(keys + period, sort=False, dropna=False)
+        stats = group['value'].agg(['mean', 'max', 'size'])
+        for col in over:
+            stats['days_' + col] = group[col].sum()
+        stats = stats.reset_index()
+
+        # Drop the months or years that are not complete in the calendar of the run.
+        expected = [days_in(y, m, calendar) for y, m in
+                    zip(stats['year'], stats['month'] if freq == 'monthly' else [None] * len(stats))]
+        stats = stats[stats['size'] == expected]
+        out[freq] = stats[keys + period + ['mean', 'max'] + ['days_' + c for c in over]].reset_index(drop=True)
+    return out
+
+
+def frequency_file(outdir, name, frequency, frequencies):
+    """ Output file of a frequency, the first frequency of a script is its main product and is
+    written to outdir, the others to a subdirectory of outdir named after the frequency.
+    :param outdir:      str directory of the main product.
+    :param name:        str file name.
+    :param frequency:   str frequency of the file.
+    :param frequencies: list of str frequencies the script writes.
+    :return:            str path, its directory is created.
+    """
+    d = outdir if frequency == frequencies[0] else os.path.join(outdir, frequency)
+    os.makedirs(d, exist_ok=True)
+    return os.path.join(d, name)
@@ -0,0 +1,89 @@
+""" Data processing helpers the A-scripts used to carry a copy of each.
+
+Adapted from the stitches project:
+https://github.com/JGCRI/stitches/blob/mega_cleanup/stitches/fx_data.py#L29
+
+Importing this module does not import xarray, the functions work on the xarray
+objects they are given.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def get_lat_name(ds):
+    """ Get the name for the latitude values (could be either lat or latitude).
+    :param ds:    xarray dataset of CMIP data.
+    :return:    the string name for the latitude variable.
+    """
+    for lat_name in ['lat', 'latitude']:
+        if lat_name in ds.coords:
+            return lat_name
+    raise RuntimeError("Couldn't find a latitude coordinate")
+
+
+def global_mean(ds):
+    """ Get the cos(lat) weighted global mean for a variable, missing values are left out of the
+    weights.
+    :param ds:  xarray dataset of CMIP data.
+    :return:    xarray dataset of the weighted global mean.
+    """
+    lat = ds[get_lat_name(ds)]
+    weight = np.cos(np.deg2rad(lat))
+    other_dims = set(ds.dims) - {'time'}
+    return (ds * weight).sum(other_dims) / (ds.notnull() * weight).sum(other_dims)
+
+
+def get_ds_meta(ds, frequency=True, calendar=False):
+    """ Get the meta data information from the xarray data set.
+    :param ds:          xarray dataset of CMIP data.
+    :param frequency:   bool, add the frequency of the data set.
+    :param calendar:    bool, add the calendar of the time axis.
+    :return:            pandas dataset of MIP information.
+    """
+    v = ds.variable_id
+
+    data = {'variable': v,
+            'experiment': ds.experiment_id,
+            'units': ds[v].attrs['units']}
+    if frequency:
+        data['frequency'] = ds.attrs["frequency"]
+    if calendar:
+        data['calendar'] = ds['time'].dt.calendar
+    data['ensemble'] = ds.attrs["variant_label"]
+    data['model'] = ds.source_id
+
+    return pd.DataFrame([data])
+
+
+def combine_df(df1, df2):
+    """ Join the data frames together.
+    :param df1:   pandas data frame 1.
+    :param df2:   pandas data frame 2.
+    :return:    a single pandas data frame.
+    """
+
+    # Combine the two data frames with one another.
+    df1["j"] = 1
+    df2["j"] = 1
+    out = df1.merge(df2)
+    out = out.drop(columns="j")
+
+    return out
+
+
+def selstr(a, start, stop):
+    """ Select elements of a string from an array.
+    :param a:   array containing a string.
+    :param start: int referring to the first character index to select.
+    :param stop: int referring to the last character index to select.
+    :return:    array of strings
+    """
+    if type(a) not in [str]:
+        raise TypeError("a: must be a single string")
+
+    out = []
+    for i in range(start, stop):
+        out.append(a[i])
+    out = "".join(out)
+    return out
@@ -0,0 +1,119 @@
+""" Manifest of completed outputs and incremental planning.
+
+run_safely appends a row to ./inputs/manifest.csv for every dataset that was
+processed successfully. plan_updates compares the current list of candidate
+zstores with the snapshot saved by the previous run and with the manifest, so
+only new, re-versioned or not yet completed datasets are scheduled.
+"""
+
+import os
+import datetime
+
+import pandas as pd
+
+from .catalog import diff_snapshots, stores_frame
+
+INPUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "inputs")
+
+# Default location of the manifest and of the per product catalog snapshots.
+MANIFEST_PATH = os.path.join(INPUTS_DIR, "manifest.csv")
+SNAPSHOT_DIR = os.path.join(INPUTS_DIR, "snapshots")
+
+COLUMNS = ['product', 'zstore', 'seconds', 'date']
+
+
+class Manifest:
+    """ Record of the datasets that have been processed for each product. """
+
+    def __init__(self, path=MANIFEST_PATH):
+        """
+        :param path:    str path to the manifest csv file.
+        """
+        self.path = path
+        if os.path.exists(path):
+            self.table = pd.read_csv(path, dtype={'product': str, 'zstore': str})
+        else:
+            self.table = pd.DataFrame(columns=COLUMNS)
+
+    def record(self, product, zstore, seconds):
+        """ Record a completed dataset, the row is appended to the manifest file right away.
+        :param product: str name of the output product, i.e. 'tas_land'.
+        :param zstore:  str of the location of the cmip6 data file on pangeo.
+        :param seconds: float time it took to process the dataset.
+        """
+        entry = pd.DataFrame([{'product': product, 'zstore': zstore, 'seconds': round(seconds, 2),
+                               'date': datetime.date.today().isoformat()}], columns=COLUMNS)
+        entry.to_csv(self.path, mode='a', index=False, header=not os.path.exists(self.path))
+        self.table = entry if self.table.empty else pd.concat([self.table, entry], ignore_index=True)
+
+    def merge(self, other):
+        """ Append the entries of another manifest, i.e. of one shard of a run, to this one.
+        :param other:   Manifest to merge in.
+        """
+        if other.table.empty:
+            return
+        other.table[COLUMNS].to_csv(self.path, mode='a', index=False, header=not os.path.exists(self.path))
+        self.table = other.table[COLUMNS] if self.table.empty else pd.concat([self.table, other.table[COLUMNS]],
+                                                                            ignore_index=True)
+
+    def completed(self, product):
+        """ Get the zstores that have been processed for a product.
+        :param product: str name of the output product.
+        :return:        set of str zstore addresses.
+        """
+        return set(self.table.loc[self.table['product'] == product, 'zstore'])
+
+    def forget(self, product, zstores):
+        """ Drop entries from the manifest, i.e. for superseded or removed datasets.
+        :param product: str name of the output product.
+        :param zstores: iterable of str zstore addresses.
+        """
+        drop = (self.table['product'] == product) & self.table['zstore'].isin(list(zstores))
+        if drop.any():
+            self.table = self.table[~drop]
+            self.table.to_csv(self.path, index=False)
+
+
+def plan_updates(zstores, product, manifest, name=None, snapshot_dir=SNAPSHOT_DIR, dry_run=False):
+    """ Find the datasets that need to be processed for a product. The delta against the previous
+    snapshot is written to <snapshot_dir>/<name>_delta.csv, the current list of zstores becomes
+    the new snapshot and the superseded datasets are dropped from the manifest.
+    :param zstores:         iterable of str zstore addresses, one version per dataset.
+    :param product:         str name of the output product.
+    :param manifest:        Manifest of the completed outputs.
+    :param name:            optional str name of the snapshot, defaults to the product. Scripts
+                            that share a product (i.e. the heat flux variables) use their own.
+    :param snapshot_dir:    str directory holding the catalog snapshots.
+    :param dry_run:         bool, only find the datasets, neither the manifest nor the snapshots
+                            are changed.
+    :return:                list of str zstores that are new, updated or not completed yet.
+    """
+    name = product if name is None else name
+    new = stores_frame(zstores)
+    snapshot_path = os.path.join(snapshot_dir, name + ".csv")
+    if os.path.exists(snapshot_path):
+        old = pd.read_csv(snapshot_path, dtype=str)
+    else:
+        old = new.iloc[0:0]
+
+    delta = diff_snapshots(old, new)
+    counts = delta['status'].value_counts()
+    print(name + ": " + ", ".join(str(n) + " " + s for s, n in counts.items()))
+
+    # Outputs of superseded versions and removed datasets are no longer current.
+    stale = delta.loc[delta['status'].isin(['updated', 'removed']), 'old_zstore']
+    if dry_run:
+        done = manifest.completed(product) - set(stale)
+        return [z for z in new['zstore'] if z not in done]
+    manifest.forget(product, stale)
+
+    done = manifest.completed(product)
+    todo = [z for z in new['zstore'] if z not in done]
+
+    if not os.path.exists(snapshot_dir):
+        os.mkdir(snapshot_dir)
+    delta[delta['status'] != 'unchanged'].to_csv(os.path.join(snapshot_dir, name + "_delta.csv"),
+                                                 index=False)
+    new.to_csv(snapshot_path, index=False)
+
+    return todo
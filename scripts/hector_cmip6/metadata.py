@@ -0,0 +1,151 @@
+""" Metadata-only scan of the pangeo zarr stores.
+
+Only the consolidated .zmetadata of each store is read (plus the first and last
+value of the time coordinate for the time range), so thousands of stores can be
+indexed concurrently before any data bytes move. The index is kept in
+./inputs/store_index.csv and is used for planning, sizing and validation.
+"""
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .catalog import parse_zstore
+from .remote import RetryingMapper
+
+# Default location of the store index, ./inputs/store_index.csv in the repository root.
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                          "inputs", "store_index.csv")
+
+INDEX_COLS = ['zstore', 'source_id', 'experiment_id', 'member_id', 'table_id', 'variable_id',
+              'grid_label', 'version', 'frequency', 'units', 'calendar', 'time_units', 'start',
+              'end', 'dims', 'shape', 'chunks', 'dtype', 'nbytes', 'branch_time_in_parent',
+              'parent_experiment_id', 'parent_variant_label', 'error']
+
+
+def read_zmetadata(zstore):
+    """ Read the consolidated metadata of a zarr store.
+    :param zstore:  str of the location of the cmip6 data file on pangeo.
+    :return:        dict mapping the zarr keys (.zattrs, tas/.zarray, ...) to their json content.
+    """
+    mapper = RetryingMapper(zstore)
+    return json.loads(mapper['.zmetadata'])['metadata']
+
+
+def _xjoin(values):
+    """ Format a shape or chunk tuple as a compact string, i.e. 1980x180x288. """
+    return "x".join(str(v) for v in values)
+
+
+def _time_range(zstore, time_attrs):
+    """ Read only the first and last time values of a store and decode them.
+    :param zstore:      str of the location of the cmip6 data file on pangeo.
+    :param time_attrs:  dict of the time/.zattrs metadata.
+    :return:            tuple of str start and end dates, YYYY-MM-DD.
+    """
+    import cftime
+    import zarr
+
+    time = zarr.open_array(RetryingMapper(zstore), path='time', mode='r')
+    values = [time[0], time[time.shape[0] - 1]]
+    dates = cftime.num2date(values, time_attrs['units'], time_attrs.get('calendar', 'standard'))
+    return tuple(d.strftime("%Y-%m-%d") for d in dates)
+
+
+def summarise_store(zstore, time_range=True):
+    """ Summarise a single store from its consolidated metadata.
+    :param zstore:      str of the location of the cmip6 data file on pangeo.
+    :param time_range:  bool, also read the first and last time value for the start/end dates.
+    :return:            dict with one entry per column of INDEX_COLS.
+    """
+    import numpy as np
+
+    out = dict.fromkeys(INDEX_COLS, None)
+    out.update(parse_zstore(zstore))
+    out['zstore'] = zstore
+    out['error'] = ""
+
+    meta = read_zmetadata(zstore)
+    attrs = meta.get('.zattrs', {})
+    v = attrs.get('variable_id', out['variable_id'])
+    zarray = meta[v + '/.zarray']
+    var_attrs = meta.get(v + '/.zattrs', {})
+    time_attrs = meta.get('time/.zattrs', {})
+
+    out['frequency'] = attrs.get('frequency')
+    out['units'] = var_attrs.get('units')
+    out['calendar'] = time_attrs.get('calendar')
+    out['time_units'] = time_attrs.get('units')
+    out['dims'] = " ".join(var_attrs.get('_ARRAY_DIMENSIONS', []))
+    out['shape'] = _xjoin(zarray['shape'])
+    out['chunks'] = _xjoin(zarray['chunks'])
+    out['dtype'] = zarray['dtype']
+    out['nbytes'] = int(np.prod(zarray['shape'])) * np.dtype(zarray['dtype']).itemsize
+    out['branch_time_in_parent'] = attrs.get('branch_time_in_parent')
+    out['parent_experiment_id'] = attrs.get('parent_experiment_id')
+    out['parent_variant_label'] = attrs.get('parent_variant_label')
+
+    if time_range and 'time/.zarray' in meta and 'units' in time_attrs:
+        out['start'], out['end'] = _time_range(zstore, time_attrs)
+
+    return out
+
+
+def _summarise_or_error(zstore, time_range):
+    """ Like summarise_store but a failure is recorded in the error column instead of raised. """
+    try:
+        return summarise_store(zstore, time_range=time_range)
+    except Exception as e:
+        out = dict.fromkeys(INDEX_COLS, None)
+        out['zstore'] = zstore
+        out['error'] = type(e).__name__ + ": " + str(e)
+        return out
+
+
+def scan_stores(zstores, workers=32, time_range=True):
+    """ Summarise many stores concurrently from their metadata only.
+    :param zstores:     iterable of str zstore addresses.
+    :param workers:     int number of concurrent metadata requests.
+    :param time_range:  bool, also read the first and last time values.
+    :return:            pd data frame with INDEX_COLS, one row per store.
+    """
+    zstores = list(zstores)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(lambda z: _summarise_or_error(z, time_range), zstores))
+    return pd.DataFrame(rows, columns=INDEX_COLS)
+
+
+def read_index(path=INDEX_PATH):
+    """ Read the store index.
+    :param path:    str path to the index csv file.
+    :return:        pd data frame with INDEX_COLS, empty if the index does not exist yet.
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=INDEX_COLS)
+    return pd.read_csv(path, dtype={'version': str, 'error': str}, keep_default_na=True)
+
+
+def update_index(zstores, path=INDEX_PATH, workers=32, time_range=True, rescan_errors=True):
+    """ Add the stores that are not in the index yet (or that failed last time) to the index.
+    :param zstores:         iterable of str zstore addresses.
+    :param path:            str path to the index csv file.
+    :param workers:         int number of concurrent metadata requests.
+    :param time_range:      bool, also read the first and last time values.
+    :param rescan_errors:   bool, scan stores whose previous scan failed again.
+    :return:                pd data frame of the updated index.
+    """
+    index = read_index(path)
+    if rescan_errors:
+        index = index[index['error'].fillna("") == ""]
+
+    done = set(index['zstore'])
+    todo = [z for z in pd.unique(pd.Series(list(zstores))) if z not in done]
+    print("scanning metadata of " + str(len(todo)) + " stores")
+    if len(todo) > 0:
+        scanned = scan_stores(todo, workers=workers, time_range=time_range)
+        index = scanned if index.empty else pd.concat([index, scanned], ignore_index=True)
+    index.to_csv(path, index=False)
+
+    return index
@@ -0,0 +1,77 @@
+""" Registry of the products the extraction engine can build.
+
+A product is one area weighted series of one variable, i.e. tas over land. Its
+entry says where the data comes from (variable, table, grid, cell area field),
+which region the weights cover, the default experiments and where the output
+goes. Products of the same variable, table and cell areas are reduced together,
+so asking for tas, tas_land and tas_ocean reads every tas store once.
+"""
+
+# Default experiments and activities, the list the A-scripts used.
+EXPERIMENTS = ['1pctCO2', 'abrupt-4xCO2', 'abrupt-2xCO2', 'esm-hist', 'esm-ssp585', 'ssp119',
+               'ssp126', 'ssp245', 'ssp370', 'ssp434', 'ssp460', 'ssp585', 'historical']
+TOS_EXPERIMENTS = ['historical', 'ssp119', 'ssp126', 'ssp245', 'ssp370', 'ssp434', 'ssp460',
+                   'ssp534-over', 'ssp585']
+MIPS = ['CMIP', 'ScenarioMIP']
+
+# The HL region is poleward and the LL region equatorward of this latitude.
+HL_LAT = 55
+
+# Regions the weights can cover:
+#   global  all cells, weighted by the cell area
+#   land    cell area * 0.01 * sftlf
+#   ocean   cell area * (1 - 0.01 * sftlf)
+#   HL, LL  cell area poleward / equatorward of HL_LAT
+REGIONS = ['global', 'land', 'ocean', 'HL', 'LL']
+
+
+def _product(variable, region, table='Amon', area='areacella', outdir=None, experiments=EXPERIMENTS,
+             frequencies=('annual',), skipna=False, area_column=False, grid_label=None, members=None,
+             years=None, frequency_column=True, index_column=True, land_area_column=False):
+    return {'variable': variable, 'region': region, 'table': table, 'area': area,
+            'outdir': variable if outdir is None else outdir, 'experiments': list(experiments),
+            'frequencies': list(frequencies), 'skipna': skipna, 'area_column': area_column,
+            'grid_label': grid_label, 'members': members, 'years': years,
+            'frequency_column': frequency_column, 'index_column': index_column,
+            'land_area_column': land_area_column}
+
+
+# The tas products keep missing values out of the weights (A1.tas.py), the others divide by the
+# total area of the region (A4a-f, A5, A5a-c, A6). The outputs have the columns of the A-script
+# they replace, the B-scripts read them by position: an unnamed row index, variable, experiment,
+# units, frequency, ensemble, model, year and value, plus land_area for rh and npp. The tos
+# scripts write no index and no frequency, and add an area column.
+PRODUCTS = {
+    'tas': _product('tas', 'global', outdir='tas/csv1', skipna=True),
+    'tas_land': _product('tas', 'land', outdir='tas_land', skipna=True),
+    'tas_ocean': _product('tas', 'ocean', outdir='tas_ocean', skipna=True),
+    'hfls': _product('hfls', 'ocean'),
+    'hfss': _product('hfss', 'ocean'),
+    'rlds': _product('rlds', 'ocean'),
+    'rlus': _product('rlus', 'ocean'),
+    'rsds': _product('rsds', 'ocean'),
+    'rsus': _product('rsus', 'ocean'),
+    'rh': _product('rh', 'land', table='Lmon', land_area_column=True),
+    'npp': _product('npp', 'land', table='Lmon', land_area_column=True),
+    'tos_global': _product('tos', 'global', table='Omon', area='areacello', outdir='tos/global',
+                           experiments=TOS_EXPERIMENTS, frequencies=('monthly',), area_column=True,
+                           grid_label='gn', members='p1', frequency_column=False, index_column=False),
+    'tos_HL': _product('tos', 'HL', table='Omon', area='areacello', outdir='tos/HL',
+                       experiments=['historical'], area_column=True, grid_label='gn', members='p1',
+                       years={('tos', 'historical'): (1850, 1900)}, frequency_column=False,
+                       index_column=False),
+    'tos_LL': _product('tos', 'LL', table='Omon', area='areacello', outdir='tos/LL',
+                       experiments=['historical'], area_column=True, grid_label='gn', members='p1',
+                       years={('tos', 'historical'): (1850, 1900)}, frequency_column=False,
+                       index_column=False),
+}
+
+
+def get_product(name):
+    """ Look up a product.
+    :param name:    str name of the product, a key of PRODUCTS.
+    :return:        dict spec of the product.
+    """
+    if name not in PRODUCTS:
+        raise ValueError("unknown product " + str(name) + ", use one of " + ", ".join(PRODUCTS))
+    return PRODUCTS[name]
@@ -0,0 +1,186 @@
+""" Rule based quality control of the extracted series.
+
+The checks that used to be spread over the R scripts (the HL/LL/global tos
+consistency filter and abnormal value check in B5b, the temperature bounds and
+minimum length loops of land-ocean-warming-ratio/cleaning_temp_data.R) are
+declared as rules and evaluated with grouped vector operations over the whole
+long data frame at once. The result is a flag table with one row per flagged
+value, run or model and the reason, apply_flags removes the flagged data.
+
+A rule is a dict with the check to run, the data it applies to and the scope of
+a failure, i.e.
+    {'name': 'tas_bounds', 'check': 'range', 'variable': 'tas', 'lower': 270,
+     'upper': 300, 'scope': 'model'}
+selectors:  variable, area, experiment (str or list of str) and years (start, end).
+checks:     range (lower and/or upper), jump (max_step between consecutive years),
+            min_length (min_years per run), start (first year of each run),
+            consistency (whole ~ sum of weighted parts of the area column, tolerance).
+scope:      row (only the failing values), run (the whole model/experiment/ensemble
+            run) or model (every run of the model).
+"""
+
+import numpy as np
+import pandas as pd
+
+RUN_COLS = ['model', 'experiment', 'ensemble']
+SERIES_COLS = RUN_COLS + ['variable', 'area']
+FLAG_COLS = SERIES_COLS + ['year', 'rule', 'scope', 'reason']
+
+# The checks of B5b.process_historical_regional_tos.R.
+TOS_RULES = [
+    {'name': 'tos_consistency', 'check': 'consistency', 'variable': 'tos', 'experiment': 'historical',
+     'whole': 'global', 'parts': {'HL': 0.15, 'LL': 0.85}, 'tolerance': 0.1, 'scope': 'row'},
+    {'name': 'tos_global_1850', 'check': 'range', 'variable': 'tos', 'area': 'global',
+     'years': (1850, 1850), 'lower': 16, 'scope': 'run'},
+    {'name': 'tos_regional_1850', 'check': 'range', 'variable': 'tos', 'area': ['HL', 'LL'],
+     'years': (1850, 1850), 'lower': 1e-3, 'scope': 'run'},
+]
+
+# The checks of land-ocean-warming-ratio/cleaning_temp_data.R, years count from 0.
+LAND_OCEAN_RULES = [
+    {'name': 'min_length', 'check': 'min_length', 'variable': 'tas', 'min_years': 150, 'scope': 'model'},
+    {'name': 'tas_bounds', 'check': 'range', 'variable': 'tas', 'lower': 270, 'upper': 300,
+     'scope': 'model'},
+]
+
+
+def _as_list(value):
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _select(data, rule):
+    """ Boolean mask of the rows a rule applies to. """
+    keep = np.ones(len(data), dtype=bool)
+    for col in ['variable', 'area', 'experiment']:
+        if rule.get(col) is not None:
+            keep &= data[col].isin(_as_list(rule[col])).values
+    if rule.get('years') is not None:
+        start, end = rule['years']
+        keep &= ((data['year'] >= start) & (data['year'] <= end)).values
+    return keep
+
+
+def _fmt(values):
+    return values.round(4).astype(str)
+
+
+def check_range(d, rule):
+    lower = rule.get('lower', -np.inf)
+    upper = rule.get('upper', np.inf)
+    hit = (d['value'] < lower) | (d['value'] > upper)
+    reason = "value " + _fmt(d['value']) + " outside [" + str(lower) + ", " + str(upper) + "]"
+    return hit, reason
+
+
+def check_jump(d, rule):
+    step = d.groupby(SERIES_COLS, sort=False)['value'].diff().abs()
+    hit = step > rule['max_step']
+    reason = "jump of " + _fmt(step) + " from the previous year, max " + str(rule['max_step'])
+    return hit, reason
+
+
+def check_min_length(d, rule):
+    n = d.groupby(SERIES_COLS, sort=False)['year'].transform('nunique')
+    hit = n < rule['min_years']
+    reason = "only " + n.astype(str) + " years, need " + str(rule['min_years'])
+    return hit, reason
+
+
+def check_start(d, rule):
+    first = d.groupby(SERIES_COLS, sort=False)['year'].transform('min')
+    hit = first != rule['start']
+    reason = "starts in " + first.astype(str) + ", expected " + str(rule['start'])
+    return hit, reason
+
+
+def check_consistency(d, rule):
+    key = RUN_COLS + ['variable', 'year']
+    wide = d.pivot_table(index=key, columns='area', values='value', aggfunc='mean')
+    areas = [rule['whole']] + list(rule['parts'])
+    wide = wide.reindex(columns=areas)
+    total = sum(wide[area] * w for area, w in rule['parts'].items())
+    diff = (wide[rule['whole']] - total).abs()
+
+    # A year with a missing area can not be checked and is flagged too.
+    bad = pd.DataFrame({'diff': diff, 'missing': wide.isna().any(axis=1)}, index=wide.index)
+    bad = bad[(bad['diff'] >= rule['tolerance']) | bad['missing']].reset_index()
+    rows = d[key].merge(bad, how='left', on=key)
+    missing = rows['missing'].eq(True).values
+    hit = pd.Series(rows['diff'].notna().values | missing, index=d.index)
+    reason = pd.Series(np.where(missing,
+                                "missing one of " + "/".join(areas),
+                                rule['whole'] + " differs from the weighted " + "/".join(rule['parts']) +
+                                " by " + _fmt(rows['diff']) + ", tolerance " + str(rule['tolerance'])),
+                       index=d.index)
+    return hit, reason
+
+
+CHECKS = {'range': check_range, 'jump': check_jump, 'min_length': check_min_length,
+          'start': check_start, 'consistency': check_consistency}
+
+
+def run_qc(data, rules):
+    """ Evaluate the rules over a long data frame.
+    :param data:    pd data frame with model, experiment, ensemble, variable, year, value and
+                    optionally area columns.
+    :param rules:   list of rule dicts, see the module docstring.
+    :return:        pd data frame with FLAG_COLS, one row per flagged value (scope row), run (scope
+                    run, year is NaN) or model (scope model, experiment/ensemble/variable/area empty).
+    """
+    data = data.copy()
+    if 'area' not in data.columns:
+        data['area'] = ""
+    data = data.sort_values(SERIES_COLS + ['year'], kind='stable')
+
+    flags = []
+    for rule in rules:
+        if rule['check'] not in CHECKS:
+            raise RuntimeError("unknown qc check " + str(rule['check']))
+        d = data[_select(data, rule)]
+        if d.empty:
+            continue
+        hit, reason = CHECKS[rule['check']](d, rule)
+        hit = hit.fillna(False).astype(bool)
+        failed = d[hit].copy()
+        if failed.empty:
+            continue
+        failed['reason'] = reason[hit]
+
+        # Report each run or model once, with the number of failures and the first one.
+        scope = rule.get('scope', 'row')
+        if scope != 'row':
+            keys = RUN_COLS if scope == 'run' else ['model']
+            group = failed.groupby(keys, sort=False)
+            count = group['reason'].transform('size')
+            failed['reason'] = (count.astype(str) + " failing value(s), first in " +
+                                failed['year'].astype(str) + ": " + failed['reason'])
+            failed = failed.drop_duplicates(keys).copy()
+            failed['year'] = np.nan
+            for col in SERIES_COLS:
+                if col not in keys:
+                    failed[col] = ""
+
+        failed['rule'] = rule.get('name', rule['check'])
+        failed['scope'] = scope
+        flags.append(failed[FLAG_COLS])
+
+    if len(flags) < 1:
+        return pd.DataFrame(columns=FLAG_COLS)
+    return pd.concat(flags, ignore_index=True)
+
+
+def apply_flags(data, flags):
+    """ Remove the flagged values, runs and models.
+    :param data:    pd data frame checked by run_qc.
+    :param flags:   pd data frame returned by run_qc.
+    :return:        pd data frame without the flagged data.
+    """
+    keep = np.ones(len(data), dtype=bool)
+    area = data['area'] if 'area' in data.columns else pd.Series("", index=data.index)
+    for scope, keys in [('model', ['model']), ('run', RUN_COLS), ('row', SERIES_COLS + ['year'])]:
+        f = flags.loc[flags['scope'] == scope, keys].drop_duplicates()
+        if f.empty:
+            continue
+        d = data.assign(area=area)[keys]
+        keep &= ~pd.MultiIndex.from_frame(d).isin(pd.MultiIndex.from_frame(f.astype(d.dtypes.to_dict())))
+    return data[keep]
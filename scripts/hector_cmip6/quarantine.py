@@ -0,0 +1,164 @@
+""" Failure classification and a persistent quarantine of datasets that could not be processed.
+
+Each A-script wraps the processing of a single zstore in run_safely. A failure is
+classified (missing fx field, decode error, timeout, shape mismatch) and recorded in
+./inputs/quarantine.csv so that the next run skips the dataset before opening it,
+instead of relying on hand-edited lists of failing models.
+"""
+
+import os
+import time
+import datetime
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from .catalog import MissingFxError, parse_zstore
+
+# Default location of the quarantine store, ./inputs/quarantine.csv in the repository root.
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..",
+                            "inputs", "quarantine.csv")
+
+COLUMNS = ['product', 'source_id', 'zstore', 'reason', 'message', 'date']
+
+# Failure reasons that will not go away on a rerun. Timeouts, stores that ran out of memory and
+# failures that could not be classified (i.e. a bug fixed since, or a network error that outlived
+# its retries) are recorded but retried.
+PERMANENT = ['missing_fx', 'decode_error', 'shape_mismatch', 'manual']
+
+# Exception types by class name, so the optional packages that raise them need not be imported.
+TIMEOUT_TYPES = ['TimeoutError', 'ServerTimeoutError', 'ReadTimeout', 'ConnectTimeout']
+DECODE_TYPES = ['UnicodeDecodeError', 'OutOfBoundsDatetime', 'OutOfBoundsTimedelta']
+SHAPE_TYPES = ['AlignmentError']
+
+# Messages of the decoding and alignment errors xarray and numpy raise as a plain ValueError.
+DECODE_MESSAGES = ['unable to decode time units', 'failed to decode variable', 'unrecognized calendar',
+                   'cannot decode times']
+SHAPE_MESSAGES = ['conflicting sizes for dimension', 'cannot reindex or align along dimension',
+                  'operands could not be broadcast together', 'cannot align objects']
+
+
+def _is_type(exc, names):
+    """ Is the exception of one of the named types or of a subclass of them? """
+    return any(c.__name__ in names for c in type(exc).__mro__)
+
+
+def classify_failure(exc):
+    """ Classify the exception raised while processing a dataset, by its type or by the exact
+    messages of the errors that are only raised as a ValueError.
+    :param exc:     the exception raised.
+    :return:        str reason, one of missing_fx, out_of_memory, timeout, decode_error,
+                    shape_mismatch or other.
+    """
+    msg = str(exc).lower()
+
+    if isinstance(exc, MissingFxError):
+        return 'missing_fx'
+    if isinstance(exc, (MemoryError, BrokenProcessPool)):
+        return 'out_of_memory'
+    if _is_type(exc, TIMEOUT_TYPES):
+        return 'timeout'
+    if _is_type(exc, DECODE_TYPES) or (isinstance(exc, ValueError) and any(m in msg for m in DECODE_MESSAGES)):
+        return 'decode_error'
+    if _is_type(exc, SHAPE_TYPES) or (isinstance(exc, ValueError) and any(m in msg for m in SHAPE_MESSAGES)):
+        return 'shape_mismatch'
+    return 'other'
+
+
+class Quarantine:
+    """ Persistent record of datasets (or whole models) that failed for a product.
+
+    An entry with an empty zstore quarantines every dataset of the model for that product.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """ Read the quarantine store, an empty store is used if the file does not exist.
+        :param path:    str path to the quarantine csv file.
+        """
+        self.path = path
+        if os.path.exists(path):
+            self.table = pd.read_csv(path, dtype=str, keep_default_na=False)
+        else:
+            self.table = pd.DataFrame(columns=COLUMNS)
+
+    def add(self, product, zstore, reason, message=""):
+        """ Record a failed dataset and write the quarantine store back to disk.
+        :param product: str name of the output product, i.e. 'tas_land'.
+        :param zstore:  str of the location of the cmip6 data file on pangeo.
+        :param reason:  str failure reason, see classify_failure.
+        :param message: str error message.
+        """
+        entry = pd.DataFrame([{'product': product,
+                               'source_id': parse_zstore(zstore)['source_id'],
+                               'zstore': zstore,
+                               'reason': reason,
+                               'message': " ".join(str(message).split())[:500],
+                               'date': datetime.date.today().isoformat()}], columns=COLUMNS)
+        # Only keep the most recent failure for a dataset.
+        old = self.table[~((self.table['product'] == product) & (self.table['zstore'] == zstore))]
+        self.table = entry if old.empty else pd.concat([old, entry], ignore_index=True)
+        self.save()
+
+    def merge(self, other):
+        """ Add the entries of another quarantine, i.e. of one shard of a run, the most recent
+        failure of a dataset is kept.
+        :param other:   Quarantine to merge in.
+        """
+        if other.table.empty:
+            return
+        table = other.table if self.table.empty else pd.concat([self.table, other.table], ignore_index=True)
+        self.table = table.drop_duplicates(['product', 'zstore'], keep='last').reset_index(drop=True)
+        self.save()
+
+    def save(self):
+        """ Write the quarantine store to disk. """
+        self.table.to_csv(self.path, index=False)
+
+    def exclude(self, zstores, product, reasons=PERMANENT):
+        """ Drop the quarantined datasets from a list of zstores, this is what the
+        A-scripts call before opening anything.
+        :param zstores: iterable of str zstore addresses.
+        :param product: str name of the output product.
+        :param reasons: list of failure reasons that should be skipped.
+        :return:        list of the zstores that are not quarantined.
+        """
+        entries = self.table[(self.table['product'] == product) & (self.table['reason'].isin(reasons))]
+        bad_stores = set(entries.loc[entries['zstore'] != "", 'zstore'])
+        bad_models = set(entries.loc[entries['zstore'] == "", 'source_id'])
+
+        out = []
+        for zstore in zstores:
+            if zstore in bad_stores or parse_zstore(zstore)['source_id'] in bad_models:
+                continue
+            out.append(zstore)
+
+        n_skip = len(zstores) - len(out) if hasattr(zstores, '__len__') else None
+        if n_skip:
+            print("skipping " + str(n_skip) + " quarantined " + product + " datasets")
+        return out
+
+
+def run_safely(func, zstore, product, quarantine, manifest=None):
+    """ Process a single dataset, recording any failure in the quarantine instead of
+    letting one bad model stop the whole job.
+    :param func:        function that processes a single zstore, i.e. get_tas.
+    :param zstore:      str of the location of the cmip6 data file on pangeo.
+    :param product:     str name of the output product.
+    :param quarantine:  Quarantine object the failure is recorded in.
+    :param manifest:    optional Manifest object the completed dataset is recorded in.
+    :return:            whatever func returns, or None if it failed.
+    """
+    start = time.time()
+    try:
+        out = func(zstore)
+    except KeyboardInterrupt:
+        raise
+    except Exception as e:
+        reason = classify_failure(e)
+        print("problem with " + zstore + " (" + reason + "): " + str(e))
+        quarantine.add(product, zstore, reason, str(e))
+        return None
+
+    if manifest is not None:
+        manifest.record(product, zstore, time.time() - start)
+    return out
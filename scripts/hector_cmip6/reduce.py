@@ -0,0 +1,61 @@
+""" Cell weights of the regions of an area weighted mean.
+
+The weights of all regions (global, land, ocean and optionally the two
+hemispheres) are stacked along a region dimension, so stream.stream_means gets
+the sums of every region from a single read of each chunk of the variable,
+whatever the number of regions.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def on_grid(field, like):
+    """ Put a field on the coordinates of another field of the same grid. The fx fields can carry
+    slightly different (rounded) coordinates than the data, which would make xarray drop the cells
+    that do not line up.
+    :param field:   xarray DataArray, i.e. areacella or sftlf.
+    :param like:    xarray DataArray with the coordinates to use.
+    :return:        xarray DataArray
+    """
+    dims = [d for d in field.dims if d in like.dims and d in like.coords and d != 'time']
+    for d in dims:
+        if field.sizes[d] != like.sizes[d]:
+            raise ValueError("shape mismatch: " + d + " has " + str(field.sizes[d]) + " values, expected " +
+                             str(like.sizes[d]))
+    return field.assign_coords({d: like[d].values for d in dims})
+
+
+def cos_lat_area(da, lat_name='lat'):
+    """ Relative cell areas from the cosine of the latitude, for when there is no cell area field.
+    :param da:          xarray DataArray on a lat/lon grid.
+    :param lat_name:    str name of the latitude coordinate.
+    :return:            xarray DataArray of the weights on the horizontal dimensions of da.
+    """
+    spatial = [d for d in da.dims if d != 'time']
+    weight = np.cos(np.deg2rad(da[lat_name]))
+    return weight.broadcast_like(da.isel(time=0, drop=True)).transpose(*spatial)
+
+
+def region_weights(area, land_frac=None, hemispheres=False, lat_name='lat'):
+    """ Stack the cell weights of every region along a region dimension.
+    :param area:        xarray DataArray of the cell areas, i.e. areacella.
+    :param land_frac:   optional xarray DataArray of the land fraction in percent (sftlf), adds
+                        the land and ocean regions.
+    :param hemispheres: bool, add the NH and SH regions.
+    :param lat_name:    str name of the latitude coordinate.
+    :return:            xarray DataArray with a region dimension.
+    """
+    import xarray as xr
+
+    weights = [('global', area)]
+    if land_frac is not None:
+        frac = 0.01 * on_grid(land_frac, area).fillna(0)
+        weights.append(('land', area * frac))
+        weights.append(('ocean', area * (1 - frac)))
+    if hemispheres:
+        weights.append(('NH', area.where(area[lat_name] >= 0, 0)))
+        weights.append(('SH', area.where(area[lat_name] < 0, 0)))
+
+    names = [name for name, _ in weights]
+    return xr.concat([w for _, w in weights], dim=pd.Index(names, name='region'))
@@ -0,0 +1,169 @@
+""" Shared remote filesystem sessions for reading the pangeo zarr stores.
+
+Every store is opened through a single filesystem object per worker process, so
+the HTTP connection pool stays warm between the many small fx stores and the
+data stores. Each key read goes through RetryingMapper, which bounds the number
+of concurrent requests per host and retries transient errors with exponential
+backoff and jitter instead of aborting the run.
+"""
+
+import os
+import random
+import threading
+import time
+from collections.abc import MutableMapping
+from urllib.parse import urlparse
+
+# Retry and concurrency settings, can be changed before the first store is opened.
+RETRIES = 6
+BASE_DELAY = 0.5
+MAX_DELAY = 60.0
+MAX_PER_HOST = 16
+
+# Default storage options per protocol, the pangeo bucket is public.
+STORAGE_OPTIONS = {'gs': {'token': 'anon'},
+                   'gcs': {'token': 'anon'}}
+
+# HTTP status codes that are worth retrying.
+TRANSIENT_STATUS = [408, 429, 500, 502, 503, 504]
+
+# One filesystem per (process, protocol) and one semaphore per host.
+_FILESYSTEMS = {}
+_HOST_LIMITS = {}
+_FX_CACHE = {}
+_LOCK = threading.Lock()
+
+
+def is_transient(exc):
+    """ Is the exception a network blip that is worth retrying?
+    :param exc: the exception raised.
+    :return:    bool
+    """
+    if isinstance(exc, (KeyError, FileNotFoundError, PermissionError)):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, 'code', None) or getattr(exc, 'status', None)
+    if isinstance(status, int):
+        return status in TRANSIENT_STATUS
+    name = type(exc).__name__.lower()
+    msg = str(exc).lower()
+    for phrase in ['timeout', 'timed out', 'connection reset', 'connection aborted',
+                   'server disconnected', 'temporarily unavailable']:
+        if phrase in name or phrase in msg:
+            return True
+    return False
+
+
+def with_retries(func, *args, retries=None, base_delay=None, max_delay=None, **kwargs):
+    """ Call a function, retrying transient errors with exponential backoff and full jitter.
+    :param func:        the function to call.
+    :param args:        positional arguments for func.
+    :param retries:     int maximum number of retries, defaults to RETRIES.
+    :param base_delay:  float seconds to wait before the first retry, defaults to BASE_DELAY.
+    :param max_delay:   float cap on the wait between retries, defaults to MAX_DELAY.
+    :param kwargs:      keyword arguments for func.
+    :return:            whatever func returns.
+    """
+    retries = RETRIES if retries is None else retries
+    base_delay = BASE_DELAY if base_delay is None else base_delay
+    max_delay = MAX_DELAY if max_delay is None else max_delay
+
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print("transient error (" + type(e).__name__ + "), retry " + str(attempt + 1) +
+                  " in " + str(round(delay, 1)) + "s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_filesystem(protocol='gs'):
+    """ Get the shared filesystem for a protocol, one per worker process.
+    :param protocol:    str fsspec protocol, i.e. 'gs'.
+    :return:            fsspec filesystem.
+    """
+    import fsspec
+
+    key = (os.getpid(), protocol)
+    with _LOCK:
+        if key not in _FILESYSTEMS:
+            options = STORAGE_OPTIONS.get(protocol, {})
+            _FILESYSTEMS[key] = fsspec.filesystem(protocol, **options)
+        return _FILESYSTEMS[key]
+
+
+def host_limit(url):
+    """ Get the semaphore that bounds the concurrent requests to the host of a url.
+    :param url: str url or zstore address.
+    :return:    threading.BoundedSemaphore
+    """
+    host = urlparse(url).netloc
+    with _LOCK:
+        if host not in _HOST_LIMITS:
+            _HOST_LIMITS[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _HOST_LIMITS[host]
+
+
+class RetryingMapper(MutableMapping):
+    """ Key/value view of a remote store where every read is bounded and retried. """
+
+    def __init__(self, url):
+        """
+        :param url: str address of the store, i.e. a pangeo zstore.
+        """
+        protocol = urlparse(url).scheme or 'file'
+        self.url = url
+        self.mapper = get_filesystem(protocol).get_mapper(url)
+        self.limit = host_limit(url)
+
+    def _call(self, func, *args):
+        with self.limit:
+            return func(*args)
+
+    def __getitem__(self, key):
+        return with_retries(self._call, self.mapper.__getitem__, key)
+
+    def __contains__(self, key):
+        return with_retries(self._call, self.mapper.__contains__, key)
+
+    def __setitem__(self, key, value):
+        with_retries(self._call, self.mapper.__setitem__, key, value)
+
+    def __delitem__(self, key):
+        with_retries(self._call, self.mapper.__delitem__, key)
+
+    def __iter__(self):
+        return iter(with_retries(self._call, list, self.mapper))
+
+    def __len__(self):
+        return with_retries(self._call, len, self.mapper)
+
+
+def open_store(zstore, consolidated=True, **kwargs):
+    """ Open a zarr store through the shared, retrying session.
+    :param zstore:          str of the location of the cmip6 data file on pangeo.
+    :param consolidated:    bool, read the consolidated metadata.
+    :param kwargs:          other arguments passed to xarray.open_zarr.
+    :return:                lazy xarray dataset.
+    """
+    import xarray as xr
+
+    return with_retries(xr.open_zarr, RetryingMapper(zstore), consolidated=consolidated, **kwargs)
+
+
+def open_fx(zstore):
+    """ Open and load a (small) fx store such as areacella, sftlf or areacello. Loaded fx
+    fields are kept for the life of the worker, so every dataset of a model reuses them.
+    :param zstore:  str of the location of the fx file on pangeo.
+    :return:        xarray dataset, loaded into memory.
+    """
+    key = (os.getpid(), zstore)
+    if key not in _FX_CACHE:
+        _FX_CACHE[key] = open_store(zstore).load()
+    return _FX_CACHE[key]
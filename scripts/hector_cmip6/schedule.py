@@ -0,0 +1,120 @@
+""" Cost estimates of reducing a store, for largest-first scheduling.
+
+A full run mixes a single level co2 field with 1000 year abrupt-4xCO2 runs and
+high resolution ocean grids. Started in catalog order, one large store that
+happens to come last dominates the wall time. The cost of a store is estimated
+from the store index, i.e. the bytes to read (shape x dtype) and the number of
+chunks (one request each):
+
+    seconds = nbytes / bytes_per_second + nchunks * seconds_per_chunk
+
+The two rates are fitted to the timings in the manifest when it holds enough
+of them, and a store that was reduced before (any version of the same dataset)
+uses its own timing. The engine then dispatches the most expensive stores first
+and every worker takes the next store as soon as it is free.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .catalog import ZSTORE_PARTS, parse_zstore
+
+# Rates used until the manifest holds MIN_TIMINGS timings to fit them to.
+BYTES_PER_SECOND = 50e6
+SECONDS_PER_CHUNK = 0.05
+
+# Timings below this many seconds were served from the reduction cache and say nothing about the cost.
+MIN_SECONDS = 1.0
+MIN_TIMINGS = 10
+
+
+def dataset_key(zstore):
+    """ The address of a store without its version, shared by every version of a dataset. """
+    info = parse_zstore(zstore)
+    return "/".join(info[p] for p in ZSTORE_PARTS[:-1])
+
+
+def n_chunks(shape, chunks):
+    """ Number of chunks of an array from the shape and chunks columns of the store index.
+    :param shape:   str shape, i.e. 1980x180x288.
+    :param chunks:  str chunk shape, i.e. 600x180x288.
+    :return:        int number of chunks, 1 if either is missing.
+    """
+    if not isinstance(shape, str) or not isinstance(chunks, str):
+        return 1
+    s = [int(v) for v in shape.split("x")]
+    c = [int(v) for v in chunks.split("x")]
+    return int(np.prod([-(-a // b) for a, b in zip(s, c)]))
+
+
+def timings(manifest):
+    """ Seconds it took to reduce each dataset, the slowest recorded run of any product and version.
+    :param manifest:    Manifest of the completed outputs.
+    :return:            pd Series of seconds indexed by dataset key, see dataset_key.
+    """
+    table = manifest.table
+    table = table[pd.to_numeric(table['seconds'], errors='coerce') >= MIN_SECONDS]
+    if table.empty:
+        return pd.Series(dtype='float64')
+    keys = table['zstore'].map(dataset_key)
+    return table['seconds'].astype('float64').groupby(keys).max()
+
+
+def fit_rates(index, seconds):
+    """ Fit the transfer rate and the per chunk overhead to recorded timings.
+    :param index:   pd data frame of the store index with zstore, nbytes, shape and chunks.
+    :param seconds: pd Series of seconds indexed by dataset key, see timings.
+    :return:        tuple (float bytes per second, float seconds per chunk), the defaults when
+                    there are fewer than MIN_TIMINGS timings or the fit is not physical.
+    """
+    known = index[index['nbytes'].notnull()].copy()
+    known['key'] = known['zstore'].map(dataset_key)
+    known = known[known['key'].isin(seconds.index)].drop_duplicates('key')
+    if len(known) < MIN_TIMINGS:
+        return BYTES_PER_SECOND, SECONDS_PER_CHUNK
+
+    x = np.column_stack([known['nbytes'].astype('float64'),
+                         [n_chunks(s, c) for s, c in zip(known['shape'], known['chunks'])]])
+    coef = np.linalg.lstsq(x, seconds[known['key']].values, rcond=None)[0]
+    if coef[0] <= 0 or coef[1] < 0:
+        return BYTES_PER_SECOND, SECONDS_PER_CHUNK
+    return 1 / coef[0], coef[1]
+
+
+def estimate_cost(zstores, index, manifest=None):
+    """ Estimated seconds to reduce each store.
+    :param zstores:     list of str zstores, a store listed more than once is estimated once.
+    :param index:       pd data frame of the store index, see metadata.read_index.
+    :param manifest:    optional Manifest whose timings are used for the stores reduced before and
+                        to fit the rates.
+    :return:            pd Series of float seconds indexed by zstore. Stores that are neither in
+                        the index nor in the manifest get the median of the others.
+    """
+    seconds = pd.Series(dtype='float64') if manifest is None else timings(manifest)
+    bytes_per_second, seconds_per_chunk = fit_rates(index, seconds)
+
+    index = index[index['nbytes'].notnull()].drop_duplicates('zstore').set_index('zstore')
+    cost = {}
+    for zstore in zstores:
+        key = dataset_key(zstore)
+        if key in seconds.index:
+            cost[zstore] = seconds[key]
+        elif zstore in index.index:
+            row = index.loc[zstore]
+            cost[zstore] = row['nbytes'] / bytes_per_second + n_chunks(row['shape'], row['chunks']) * seconds_per_chunk
+    out = pd.Series(cost, dtype='float64').reindex(pd.unique(pd.Series(zstores, dtype=object)))
+    if out.isnull().any():
+        print(str(out.isnull().sum()) + " stores are neither in the store index nor in the manifest, "
+              "their cost is estimated")
+        out = out.fillna(out.median() if out.notnull().any() else 1.0)
+    return out
+
+
+def largest_first(tasks, cost):
+    """ Order tasks by decreasing cost, ties by zstore.
+    :param tasks:   list of tuples (str zstore, list of str product names).
+    :param cost:    pd Series of seconds indexed by zstore, see estimate_cost.
+    :return:        list of the tasks, most expensive first.
+    """
+    cost = cost.to_dict()
+    return sorted(tasks, key=lambda t: (-cost.get(t[0], 0.0), t[0]))
@@ -0,0 +1,269 @@
+""" Sharded extraction for SLURM array jobs.
+
+A full rebuild is split in three steps (see extract_job.txt):
+
+    python -m hector_cmip6 plan --var tas tas_land --shards 16 --work <dir>
+    sbatch --array=0-15 extract_job.txt
+    python -m hector_cmip6 merge --work <dir>
+
+plan runs once. It finds the stores to reduce against the shared manifest and
+quarantine (the only step that updates the catalog snapshots) and splits them
+into shards of about the same estimated cost (see schedule.py). Every array
+task runs one shard, most expensive store first, and then steals the stores
+nobody has started yet from the shards with the most work left. Stores are
+claimed with a file created atomically under <dir>/claims, one per store and
+group of products, so no store is reduced twice for the same products. Each
+task writes its outputs, manifest, quarantine and ensemble statistics to its
+own directory under <dir>, so tasks on different nodes never write the same
+file. Only the reduction cache is shared, its entries are written atomically.
+merge moves the outputs of every shard into the output
+directory and folds the shard manifests, quarantines and statistics into the
+shared ones. A shard that is rerun, or a merge of a
+partly finished array, skips the stores that are already done.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from .cache import CACHE_DIR
+from .ensemble import STATS_DIR, EnsembleStats
+from .extract import REPO_DIR, check_format, plan_tasks, run_tasks
+from .manifest import INPUTS_DIR, Manifest
+from .metadata import INDEX_PATH, read_index
+from .products import MIPS
+from .quarantine import Quarantine
+from .schedule import estimate_cost
+
+PLAN_COLS = ['zstore', 'products', 'nbytes', 'cost', 'shard']
+
+
+def assign_shards(sizes, nshards):
+    """ Split stores into shards of about the same total cost, most expensive store first to the
+    shard with the least work so far. Ties are broken by zstore and shard number, so the same plan
+    always gives the same shards.
+    :param sizes:   pd Series of the cost of every store indexed by zstore, see schedule.estimate_cost.
+    :param nshards: int number of shards.
+    :return:        pd Series of int shard numbers (0 to nshards - 1) indexed by zstore.
+    """
+    if nshards < 1:
+        raise ValueError("the number of shards must be at least 1")
+    order = sorted(sizes.index, key=lambda z: (-sizes[z], z))
+    load = [0.0] * nshards
+    shard = {}
+    for zstore in order:
+        k = min(range(nshards), key=lambda i: (load[i], i))
+        shard[zstore] = k
+        load[k] += sizes[zstore]
+    return pd.Series(shard, dtype='int64').reindex(sizes.index)
+
+
+def shard_dir(work, shard):
+    """ Directory of the outputs, manifest, quarantine and statistics of one shard. """
+    return os.path.join(work, "shard_" + format(int(shard), '04d'))
+
+
+def _claim_path(work, zstore, products):
+    key = zstore if products == "" else zstore + " " + products
+    return os.path.join(work, "claims", hashlib.sha1(key.encode()).hexdigest())
+
+
+def claim(work, zstore, shard, products=""):
+    """ Claim a row of the plan for a shard, only the shard that claims a row first reduces it. The
+    claim is a file created atomically, a shard can take its own claims again when it is resubmitted.
+    A store in several groups of products has one row and one claim per group.
+    :param work:        str work directory, see write_plan.
+    :param zstore:      str of the location of the cmip6 data file on pangeo.
+    :param shard:       int shard number.
+    :param products:    str space separated product names of the row, see write_plan.
+    :return:            bool, the row is claimed by this shard.
+    """
+    path = _claim_path(work, zstore, products)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        with open(path) as f:
+            return f.read().strip() == str(int(shard))
+    with os.fdopen(fd, "w") as f:
+        f.write(str(int(shard)))
+    return True
+
+
+def is_claimed(work, zstore, products=""):
+    """ Whether any shard has claimed a row of the plan, see claim. """
+    return os.path.exists(_claim_path(work, zstore, products))
+
+
+def write_plan(products, nshards, work, experiments=None, mips=MIPS, out=REPO_DIR, fmt='csv', frequencies=None,
+               inputs_dir=INPUTS_DIR, stats_dir=STATS_DIR, index=None):
+    """ Plan a sharded extraction, the plan is written to <work>/plan.csv and the settings every
+    shard and the merge use to <work>/settings.json.
+    :param products:    list of str product names, see products.PRODUCTS.
+    :param nshards:     int number of shards, the size of the array job.
+    :param work:        str work directory shared by the array tasks.
+    :param experiments: optional list of str experiment_ids, defaults to those of each product.
+    :param mips:        list of str activity_ids.
+    :param out:         str root directory the outputs are merged into.
+    :param fmt:         str output format, csv or parquet.
+    :param frequencies: optional list of str frequencies, defaults to those of each product.
+    :param inputs_dir:  str directory of the shared manifest, quarantine and catalog snapshots.
+    :param stats_dir:   str directory of the shared ensemble statistics.
+    :param index:       optional pd data frame of the store index, read from INDEX_PATH by default.
+    :return:            pd data frame of the plan with PLAN_COLS, one row per store and group of
+                        products.
+    """
+    check_format(fmt)
+    if os.path.exists(work) and any(f.startswith("shard_") for f in os.listdir(work)):
+        raise RuntimeError(work + " holds shards that are not merged yet, merge them first")
+    tasks = plan_tasks(products, experiments, mips, inputs_dir)
+
+    plan = pd.DataFrame({'zstore': [z for z, _ in tasks], 'products': [" ".join(n) for _, n in tasks]})
+    index = read_index(INDEX_PATH) if index is None else index
+    cost = estimate_cost(list(pd.unique(plan['zstore'])), index,
+                         Manifest(os.path.join(inputs_dir, "manifest.csv")))
+    plan['nbytes'] = plan['zstore'].map(index.drop_duplicates('zstore').set_index('zstore')['nbytes'])
+    plan['cost'] = plan['zstore'].map(cost).round(1)
+    plan['shard'] = plan['zstore'].map(assign_shards(cost, nshards))
+    plan = plan.sort_values(['shard', 'cost', 'zstore'], ascending=[True, False, True])
+
+    os.makedirs(work, exist_ok=True)
+    shutil.rmtree(os.path.join(work, "claims"), ignore_errors=True)
+    plan[PLAN_COLS].to_csv(os.path.join(work, "plan.csv"), index=False)
+    settings = {'products': list(products), 'shards': nshards, 'out': os.path.abspath(out), 'fmt': fmt,
+                'frequencies': frequencies, 'inputs_dir': os.path.abspath(inputs_dir),
+                'stats_dir': os.path.abspath(stats_dir)}
+    with open(os.path.join(work, "settings.json"), "w") as js:
+        json.dump(settings, js, indent=1)
+
+    load = plan.groupby('shard')['cost'].sum()
+    print(str(len(plan)) + " stores in " + str(nshards) + " shards of " + format(load.min() / 3600, '.1f') +
+          " to " + format(load.max() / 3600, '.1f') + " estimated hours")
+    return plan[PLAN_COLS]
+
+
+def read_plan(work):
+    """ Read the plan and settings of a sharded extraction.
+    :param work:    str work directory, see write_plan.
+    :return:        tuple (pd data frame of the plan, dict of the settings).
+    """
+    path = os.path.join(work, "plan.csv")
+    if not os.path.exists(path):
+        raise RuntimeError("no plan in " + work + ", run the plan step first")
+    with open(os.path.join(work, "settings.json")) as js:
+        settings = json.load(js)
+    return pd.read_csv(path, dtype={'zstore': str, 'products': str}), settings
+
+
+def run_shard(work, shard, workers=1, max_mem=None, cache_dir=CACHE_DIR, steal=True):
+    """ Reduce the stores of one shard, i.e. with shard = $SLURM_ARRAY_TASK_ID. The stores of the
+    shard are taken most expensive first. Once they are all dispatched the shard steals from the
+    shard with the most work left that nobody has claimed yet, taking its cheapest store (its owner
+    works from the other end), until every store of the plan is claimed.
+    :param work:        str work directory, see write_plan.
+    :param shard:       int shard number.
+    :param workers:     int number of worker processes on the node.
+    :param max_mem:     optional str or int memory ceiling of the task (i.e. 8G).
+    :param cache_dir:   str directory of the reduction cache, shared by all shards.
+    :param steal:       bool, take over stores of other shards once this shard runs out of work.
+    :return:            list of str zstores reduced.
+    """
+    plan, settings = read_plan(work)
+    shard = int(shard)
+    if not 0 <= shard < settings['shards']:
+        raise ValueError("shard " + str(shard) + " is not in the plan of " + str(settings['shards']) + " shards")
+    path = shard_dir(work, shard)
+    os.makedirs(path, exist_ok=True)
+
+    # Skip what a previous attempt of this shard or an earlier merge already completed.
+    shared = Manifest(os.path.join(settings['inputs_dir'], "manifest.csv"))
+    manifest = Manifest(os.path.join(path, "manifest.csv"))
+    completed = {name: shared.completed(name) | manifest.completed(name) for name in settings['products']}
+    own = plan[plan['shard'] == shard]
+    print("shard " + str(shard) + ": " + str(len(own)) + " stores planned")
+
+    reduced = []
+
+    def todo(row):
+        names = [n for n in row.products.split() if row.zstore not in completed[n]]
+        if len(names) > 0 and claim(work, row.zstore, shard, row.products):
+            reduced.append(row.zstore)
+            return row.zstore, names
+        return None
+
+    def queue():
+        # The plan is sorted by decreasing cost within each shard.
+        for row in own.itertuples():
+            task = todo(row)
+            if task is not None:
+                yield task
+        if not steal:
+            return
+        others = plan[plan['shard'] != shard]
+        rows = pd.Series(list(zip(others['zstore'], others['products'])), index=others.index)
+        taken = set()
+        while True:
+            rest = others[~rows.isin(taken)]
+            free = [not is_claimed(work, z, p) for z, p in zip(rest['zstore'], rest['products'])]
+            taken.update(rows[rest.index[[not f for f in free]]])
+            rest = rest[free]
+            if rest.empty:
+                return
+            victim = rest.groupby('shard')['cost'].sum().idxmax()
+            row = next(rest[rest['shard'] == victim].iloc[::-1].itertuples())
+            taken.add((row.zstore, row.products))
+            task = todo(row)
+            if task is not None:
+                print("shard " + str(shard) + " took " + row.zstore + " from shard " + str(victim))
+                yield task
+
+    quarantine = Quarantine(os.path.join(path, "quarantine.csv"))
+    stats = {}
+    for name in settings['products']:
+        stats[name] = EnsembleStats(name, os.path.join(path, "stats"),
+                                    exclude=EnsembleStats(name, settings['stats_dir']))
+    run_tasks(queue(), manifest, quarantine, stats, workers, max_mem, os.path.join(path, "out"), settings['fmt'],
+              settings['frequencies'], cache_dir)
+    return reduced
+
+
+def merge_shards(work):
+    """ Move the outputs of every shard into the output directory and fold the shard manifests,
+    quarantines and statistics into the shared ones. A merged shard directory is removed, so the
+    merge can be repeated once the remaining shards have finished.
+    :param work:    str work directory, see write_plan.
+    :return:        pd data frame with the number of stores planned for and completed by (stolen
+                    stores included) every shard.
+    """
+    plan, settings = read_plan(work)
+    manifest = Manifest(os.path.join(settings['inputs_dir'], "manifest.csv"))
+    quarantine = Quarantine(os.path.join(settings['inputs_dir'], "quarantine.csv"))
+    stats = {name: EnsembleStats(name, settings['stats_dir']) for name in settings['products']}
+
+    rows = []
+    for shard in range(settings['shards']):
+        path = shard_dir(work, shard)
+        if not os.path.exists(path):
+            continue
+        out = os.path.join(path, "out")
+        for root, _, files in os.walk(out):
+            dest = os.path.join(settings['out'], os.path.relpath(root, out))
+            os.makedirs(dest, exist_ok=True)
+            for f in files:
+                shutil.move(os.path.join(root, f), os.path.join(dest, f))
+
+        done = Manifest(os.path.join(path, "manifest.csv"))
+        manifest.merge(done)
+        quarantine.merge(Quarantine(os.path.join(path, "quarantine.csv")))
+        for name in settings['products']:
+            stats[name].merge(EnsembleStats(name, os.path.join(path, "stats")))
+        rows.append({'shard': shard, 'planned': int((plan['shard'] == shard).sum()),
+                     'completed': done.table['zstore'].nunique()})
+        shutil.rmtree(path)
+
+    if not any(f.startswith("shard_") for f in os.listdir(work)):
+        shutil.rmtree(os.path.join(work, "claims"), ignore_errors=True)
+    return pd.DataFrame(rows, columns=['shard', 'planned', 'completed'])
@@ -0,0 +1,231 @@
+""" Streaming area weighted means that read every zarr chunk of a variable once.
+
+A store opened with open_store has one dask block per zarr chunk. stream_means
+walks those blocks in the order they are stored (C order of the block index),
+reads one block at a time, folds it into the accumulators of every region and
+time step (the weighted sum and the summed weight) and drops it. Memory is
+bounded by one chunk plus the accumulators, whatever the chunk layout of the
+store, and no chunk is read twice. Only the cells with a non-zero weight are
+gathered from a chunk, and chunks without any weighted cell (i.e. outside a
+latitude band) are not read at all.
+
+The time dimension can be of any frequency. For day table variables
+stream_stats also returns the weighted fraction of each region above a list of
+thresholds, from the same read, so daily extremes never need a daily cube in
+memory (see frequency.daily_stats for the monthly and annual statistics).
+"""
+
+import numpy as np
+
+from .reduce import on_grid
+
+# Working precision of the chunks, 'source' keeps the dtype of the store (float32 for most CMIP6
+# fields) and 'float64' upcasts every chunk. The accumulators are float64 either way.
+PRECISION = 'source'
+
+
+class RegionAccumulator:
+    """ Weighted sums and summed weights of every region and time step, folded in one chunk at a time.
+    The products of a chunk are taken in the working dtype and summed into float64 accumulators.
+    :param weights:     np array (region, spatial dims...) of the weights, NaN counts as zero.
+    :param ntime:       int number of time steps.
+    :param dtype:       working dtype of the chunks, i.e. float32 to keep the dtype of the store.
+    :param compensated: bool, fold the sums of the chunks in with compensated (Neumaier) summation.
+    :param thresholds:  list of float, also sum the weights of the cells above each threshold.
+    """
+
+    def __init__(self, weights, ntime, dtype='float64', compensated=False, thresholds=()):
+        self.dtype = np.dtype(dtype)
+        self.weights = np.nan_to_num(np.asarray(weights, dtype='float64')).astype(self.dtype)
+        self.thresholds = np.asarray(thresholds, dtype=self.dtype)
+        nregion = self.weights.shape[0]
+        self.value = np.zeros((nregion, ntime))
+        self.weight = np.zeros((nregion, ntime))
+        self.over = np.zeros((len(self.thresholds), nregion, ntime))
+        self.compensated = compensated
+        self.comp = {'value': np.zeros_like(self.value), 'weight': np.zeros_like(self.weight),
+                     'over': np.zeros_like(self.over)} if compensated else {}
+        self.chunks = 0
+
+    def cells(self, spatial):
+        """ Weights of the cells of a block that have a non-zero weight in any region.
+        :param spatial: tuple of slices of the block on the spatial dimensions.
+        :return:        tuple (np array of the flat index of the cells, np array (cells, region)).
+        """
+        w = self.weights[(slice(None),) + tuple(spatial)].reshape(self.weights.shape[0], -1)
+        idx = np.flatnonzero(np.any(w != 0, axis=0))
+        return idx, w[:, idx].T
+
+    def _add(self, name, time, v):
+        """ Add the sums of a chunk (..., region, time) to an accumulator. """
+        acc = getattr(self, name)[..., time]
+        if not self.compensated:
+            acc += v
+            return
+        t = acc + v
+        self.comp[name][..., time] += np.where(np.abs(acc) >= np.abs(v), (acc - t) + v, (v - t) + acc)
+        acc[...] = t
+
+    def _total(self, name):
+        acc = getattr(self, name)
+        return acc + self.comp[name] if self.compensated else acc
+
+    def _weighted(self, x, w):
+        """ Sums over the cells of x (time, cells) times every region's weights, as (region, time). """
+        if self.dtype == np.float64:
+            return (x @ w).T
+        # The products stay in the working dtype, the sums over the cells are taken in float64
+        # without a float64 copy of the chunk.
+        return np.stack([(x * w[:, r]).sum(axis=1, dtype='float64') for r in range(w.shape[1])])
+
+    def fold(self, block, time, idx, w):
+        """ Add a block of data to the accumulators.
+        :param block:   np array (time, spatial dims...) of the block, in the working dtype.
+        :param time:    slice of the block on the time dimension.
+        :param idx:     np array of the flat index of the weighted cells, see cells.
+        :param w:       np array (cells, region) of their weights.
+        """
+        x = block.reshape(block.shape[0], -1)[:, idx]
+        if len(self.thresholds) > 0:
+            # NaN compares as False, so missing values are never above a threshold.
+            over = [self._weighted((x > thr).astype(self.dtype), w) for thr in self.thresholds]
+            self._add('over', time, np.stack(over))
+        valid = ~np.isnan(x)
+        x = np.where(valid, x, 0)
+        self._add('value', time, self._weighted(x, w))
+        if valid.all():
+            weight = np.repeat(w.sum(axis=0, dtype='float64')[:, np.newaxis], x.shape[0], axis=1)
+        else:
+            weight = self._weighted(valid.astype(self.dtype), w)
+        self._add('weight', time, weight)
+        self.chunks += 1
+
+    def _denominator(self, skipna):
+        if skipna:
+            return self._total('weight')
+        total = self.weights.reshape(self.weights.shape[0], -1).sum(axis=1, dtype='float64')
+        return total[:, np.newaxis]
+
+    def means(self, skipna=True):
+        """ Weighted means of every region and time step.
+        :param skipna:  bool, divide by the weight of the cells with data (True) or by the total
+                        weight of the region, missing values counting as zero (False).
+        :return:        np array (region, time).
+        """
+        return self._total('value') / self._denominator(skipna)
+
+    def fractions(self, skipna=True):
+        """ Weighted fraction of the region above each threshold, per time step.
+        :param skipna:  bool, see means.
+        :return:        np array (threshold, region, time).
+        """
+        return self._total('over') / self._denominator(skipna)
+
+
+def work_dtype(dtype, precision=None):
+    """ Working dtype of the chunks under a precision policy.
+    :param dtype:       dtype of the variable in the store.
+    :param precision:   str 'source' keeps the dtype of the store for floating point data,
+                        'float64' upcasts every chunk, defaults to PRECISION.
+    :return:            np dtype
+    """
+    precision = PRECISION if precision is None else precision
+    if precision not in ['source', 'float64']:
+        raise ValueError("unknown precision " + str(precision) + ", use 'source' or 'float64'")
+    dtype = np.dtype(dtype)
+    if precision == 'source' and np.issubdtype(dtype, np.floating) and dtype.itemsize >= 4:
+        return dtype
+    return np.dtype('float64')
+
+
+def _block_slices(chunks):
+    """ Slices of every block along one dimension, from the dask chunk sizes. """
+    edges = np.concatenate([[0], np.cumsum(chunks)])
+    return [slice(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])]
+
+
+def stream_stats(da, weights, skipna=True, precision=None, compensated=False, thresholds=()):
+    """ Area weighted means of every region and time step, and the weighted fraction of every region
+    above each threshold, reading the chunks of the store one at a time in their native order.
+    :param da:          xarray DataArray (time, spatial dims...) opened lazily with open_store, of any
+                        frequency (i.e. a day table variable).
+    :param weights:     xarray DataArray of the weights on the spatial dims of da, optionally with a
+                        region dimension (see reduce.region_weights), NaN counts as zero.
+    :param skipna:      bool, leave missing values of da out of the weights or count them as zero
+                        and divide by the total weight (as (da * w).sum() / w.sum()).
+    :param precision:   str working precision of the chunks, 'source' or 'float64', defaults to
+                        PRECISION.
+    :param compensated: bool, fold the chunk sums into the accumulators with compensated summation.
+    :param thresholds:  list of float thresholds in the units of da.
+    :return:            xarray Dataset with mean (region, time) and, with thresholds, over
+                        (threshold, region, time). Without a region dimension on the weights the
+                        region dimension is left out.
+    """
+    spatial = [d for d in da.dims if d != 'time']
+    weights = on_grid(weights, da)
+    extra = [d for d in weights.dims if d not in spatial]
+    if sorted(d for d in weights.dims if d in spatial) != sorted(spatial) or len(extra) > 1:
+        raise ValueError("the weights on " + str(weights.dims) + " do not match the data on " + str(da.dims))
+
+    region = extra[0] if len(extra) > 0 else None
+    w = weights.transpose(*extra, *spatial).values
+    if region is None:
+        w = w[np.newaxis]
+
+    da = da.transpose('time', *spatial)
+    data = da.data
+    chunks = data.chunks if hasattr(data, 'chunks') and data.chunks is not None else tuple((n,) for n in da.shape)
+    slices = [_block_slices(c) for c in chunks]
+
+    dtype = work_dtype(da.dtype, precision)
+    acc = RegionAccumulator(w, da.sizes['time'], dtype=dtype, compensated=compensated, thresholds=thresholds)
+    spatial_cells = {}
+    for block_id in np.ndindex(*[len(s) for s in slices]):
+        spatial_id = block_id[1:]
+        if spatial_id not in spatial_cells:
+            spatial_cells[spatial_id] = acc.cells([slices[i + 1][b] for i, b in enumerate(spatial_id)])
+        idx, cw = spatial_cells[spatial_id]
+        if len(idx) < 1:
+            continue
+
+        # Read one chunk, fold it in and let it go.
+        if hasattr(data, 'blocks'):
+            block = data.blocks[block_id].compute(scheduler='synchronous')
+        else:
+            block = data[tuple(s[b] for s, b in zip(slices, block_id))]
+        acc.fold(np.asarray(block, dtype=dtype), slices[0][block_id[0]], idx, cw)
+
+    import xarray as xr
+
+    coords = {'time': da['time']} if 'time' in da.coords else {}
+    dims = ['time']
+    means = acc.means(skipna=skipna)
+    over = acc.fractions(skipna=skipna)
+    if region is None:
+        means = means[0]
+        over = over[:, 0]
+    else:
+        coords[region] = weights[region].values
+        dims = [region] + dims
+
+    out = xr.Dataset({'mean': (dims, means)}, coords=coords)
+    if len(thresholds) > 0:
+        out['over'] = xr.DataArray(over, dims=['threshold'] + dims,
+                                   coords=dict(coords, threshold=list(thresholds)))
+    return out
+
+
+def stream_means(da, weights, skipna=True, precision=None, compensated=False):
+    """ Area weighted means of every region and time step, reading the chunks of the store one at
+    a time in their native order, see stream_stats.
+    :param da:          xarray DataArray (time, spatial dims...) opened lazily with open_store.
+    :param weights:     xarray DataArray of the weights on the spatial dims of da, optionally with a
+                        region dimension (see reduce.region_weights), NaN counts as zero.
+    :param skipna:      bool, see stream_stats.
+    :param precision:   str working precision of the chunks, 'source' or 'float64', defaults to
+                        PRECISION.
+    :param compensated: bool, fold the chunk sums into the accumulators with compensated summation.
+    :return:            xarray DataArray (region, time) of the means, (time) if weights has no
+                        region dimension.
+    """
+    return stream_stats(da, weights, skipna=skipna, precision=precision, compensated=compensated)['mean']
@@ -0,0 +1,125 @@
+""" Subsetting that is pushed down into the chunk read.
+
+The stores are opened lazily, so selecting by integer position before any
+reduction means only the zarr chunks that overlap the selection are fetched.
+"""
+
+import numpy as np
+
+
+def year_window(windows, variable, experiment):
+    """ Look up the year window for a variable and experiment.
+    :param windows:     dict mapping (variable, experiment) to a (start, end) tuple of years,
+                        None can be used as a wildcard for either key, i.e.
+                        {('tos', 'historical'): (1850, 1900), (None, 'historical'): (1850, 2014)}.
+    :param variable:    str variable_id.
+    :param experiment:  str experiment_id.
+    :return:            tuple (start, end) of years, or None if there is no window.
+    """
+    for key in [(variable, experiment), (variable, None), (None, experiment)]:
+        if key in windows:
+            return windows[key]
+    return None
+
+
+def select_years(ds, window=None):
+    """ Keep only whole years start..end (inclusive) of a lazily opened data set.
+    :param ds:      xarray dataset of CMIP data, opened lazily.
+    :param window:  tuple (start, end) of years, None keeps everything.
+    :return:        xarray dataset of the selected years, still lazy.
+    """
+    if window is None:
+        return ds
+
+    start, end = window
+    # The time coordinate is already in memory, only positions are computed here.
+    years = ds['time'].dt.year.values
+    keep = np.nonzero((years >= start) & (years <= end))[0]
+    if len(keep) < 1:
+        raise ValueError("no time steps between " + str(start) + " and " + str(end))
+
+    return ds.isel(time=slice(keep[0], keep[-1] + 1))
+
+
+def pressure_weights(ds, plev_name='plev'):
+    """ Thickness of the pressure layer around each level, from the level bounds or the midpoints
+    between the levels.
+    :param ds:          xarray dataset of CMIP data with a pressure level dimension (in Pa).
+    :param plev_name:   str name of the pressure level dimension.
+    :return:            xarray DataArray of the layer thickness on the level dimension.
+    """
+    plev = ds[plev_name]
+    for bnds in [plev.attrs.get('bounds'), plev_name + '_bnds', plev_name + '_bounds']:
+        if bnds is not None and bnds in ds.variables:
+            edges = ds[bnds].values
+            return plev.copy(data=np.abs(edges[:, 1] - edges[:, 0]))
+
+    p = plev.values.astype('float64')
+    mid = (p[1:] + p[:-1]) / 2
+    edges = np.concatenate([[p[0] - (mid[0] - p[0])], mid, [p[-1] + (p[-1] - mid[-1])]])
+    edges = np.clip(edges, 0, None)
+    return plev.copy(data=np.abs(np.diff(edges)))
+
+
+def surface_level(ds, plev_name='plev'):
+    """ Keep the lowest level with data of every column. Over high terrain the levels with the
+    highest pressure are below the surface and missing, the column takes the next level up. The
+    levels are chosen from the first time step, so only the chunks of the levels used are read.
+    :param ds:          xarray dataset of CMIP data with a pressure level dimension, opened lazily.
+    :param plev_name:   str name of the pressure level dimension.
+    :return:            xarray dataset without the level dimension, still lazy.
+    """
+    import xarray as xr
+
+    # Position of the levels from the highest pressure up.
+    order = np.argsort(-ds[plev_name].values)
+    out = ds.isel({plev_name: int(order[0])}, drop=True)
+    for v in ds.data_vars:
+        da = ds[v]
+        if plev_name not in da.dims or 'time' not in da.dims or da.ndim <= 2:
+            continue
+        valid = da.isel(time=0).notnull().transpose(plev_name, ...)
+        first = np.argmax(valid.values[order], axis=0)
+        first = xr.DataArray(first, dims=valid.dims[1:], coords={d: valid[d] for d in valid.dims[1:]
+                                                                  if d in valid.coords})
+        surface = None
+        for k in np.unique(first):
+            level = da.isel({plev_name: int(order[k])}, drop=True).where(first == k)
+            surface = level if surface is None else surface.fillna(level)
+        out[v] = surface.transpose(*[d for d in da.dims if d != plev_name]).assign_attrs(da.attrs)
+    return out
+
+
+def select_level(ds, level=None, plev_name='plev'):
+    """ Keep a single pressure level, or the pressure weighted column mean, of a lazily opened data
+    set. A single level is selected by position so only the chunks of that level are read.
+    :param ds:          xarray dataset of CMIP data, opened lazily.
+    :param level:       None keeps every level, 'surface' the lowest level with data of every
+                        column (see surface_level), a number the level at that pressure (Pa),
+                        'column' the pressure weighted
+                        mean over all levels (missing values, i.e. below the surface, left out).
+    :param plev_name:   str name of the pressure level dimension.
+    :return:            xarray dataset without the level dimension, still lazy.
+    """
+    if level is None or plev_name not in ds.dims:
+        return ds
+
+    if level == 'column':
+        weights = pressure_weights(ds, plev_name)
+        out = ds.copy()
+        for v in ds.data_vars:
+            if plev_name in ds[v].dims and ds[v].ndim > 2:
+                da = ds[v]
+                out[v] = ((da * weights).sum(plev_name, skipna=True) /
+                          (da.notnull() * weights).sum(plev_name)).assign_attrs(da.attrs)
+        return out.drop_dims(plev_name)
+
+    if level == 'surface':
+        return surface_level(ds, plev_name)
+
+    plev = ds[plev_name].values
+    i = int(np.argmin(np.abs(plev - level)))
+    if not np.isclose(plev[i], level, rtol=1e-3):
+        raise ValueError("no pressure level at " + str(level) + " Pa, the levels are " +
+                         ", ".join(str(p) for p in plev))
+    return ds.isel({plev_name: i}, drop=True)
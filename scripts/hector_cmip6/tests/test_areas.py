@@ -0,0 +1,28 @@
+import numpy as np
+import xarray as xr
+
+from hector_cmip6.areas import EARTH_RADIUS, grid_area
+
+
+def grid(lon_bounds, nlat=90):
+    lat_edges = np.linspace(-90, 90, nlat + 1)
+    lat = (lat_edges[1:] + lat_edges[:-1]) / 2
+    lon_bounds = np.asarray(lon_bounds, dtype='float64')
+    lon = lon_bounds.mean(axis=1)
+    return xr.Dataset(coords={'lat': lat, 'lon': lon,
+                              'lat_bnds': (('lat', 'bnds'), np.stack([lat_edges[:-1], lat_edges[1:]], axis=1)),
+                              'lon_bnds': (('lon', 'bnds'), lon_bounds)})
+
+
+def test_total_area_of_the_sphere():
+    edges = np.arange(0, 361, 2.5)
+    area = grid_area(grid(np.stack([edges[:-1], edges[1:]], axis=1)))
+    np.testing.assert_allclose(area.sum(), 4 * np.pi * EARTH_RADIUS ** 2, rtol=1e-12)
+
+
+def test_cell_across_the_meridian():
+    # Cells centred on the whole degrees, the first one has bounds [359.5, 0.5].
+    west = np.arange(-0.5, 359, 1.0) % 360
+    area = grid_area(grid(np.stack([west, (west + 1) % 360], axis=1), nlat=45))
+    np.testing.assert_allclose(area.isel(lon=0), area.isel(lon=1))
+    np.testing.assert_allclose(area.sum(), 4 * np.pi * EARTH_RADIUS ** 2, rtol=1e-12)
@@ -0,0 +1,45 @@
+import pandas as pd
+
+from hector_cmip6 import cache
+from hector_cmip6.cache import ReductionCache, cache_key
+
+ZSTORE = "gs://cmip6/CMIP6/CMIP/INST/ModelA/historical/r1i1p1f1/Amon/tas/gn/v20190101/"
+SFTLF = "gs://cmip6/CMIP6/CMIP/INST/ModelA/historical/r1i1p1f1/fx/sftlf/gn/v20190101/"
+AREACELLA = "gs://cmip6/CMIP6/CMIP/INST/ModelA/historical/r1i1p1f1/fx/areacella/gn/v20190101/"
+
+
+def test_cache_key_is_stable():
+    assert cache_key(ZSTORE, [SFTLF, AREACELLA], region='HL') == cache_key(ZSTORE, [AREACELLA, SFTLF], region='HL')
+
+
+def test_cache_key_changes_with_inputs(monkeypatch):
+    key = cache_key(ZSTORE, [SFTLF], region='HL', mask='lat >= 55')
+    assert cache_key(ZSTORE.replace("v20190101", "v20200101"), [SFTLF], region='HL', mask='lat >= 55') != key
+    assert cache_key(ZSTORE, [SFTLF.replace("v20190101", "v20200101")], region='HL', mask='lat >= 55') != key
+    assert cache_key(ZSTORE, [SFTLF], region='HL', mask='lat >= 60') != key
+    assert cache_key(ZSTORE, [], region='HL', mask='lat >= 55') != key
+    monkeypatch.setattr(cache, 'CODE_VERSION', cache.CODE_VERSION + 1)
+    assert cache_key(ZSTORE, [SFTLF], region='HL', mask='lat >= 55') != key
+
+
+def test_fetch_computes_once(tmp_path):
+    store = ReductionCache(str(tmp_path))
+    calls = []
+
+    def reduce(zstore):
+        calls.append(zstore)
+        return pd.DataFrame({'year': [1850, 1851], 'value': [1.0, 2.0]})
+
+    first = store.fetch(reduce, ZSTORE, [SFTLF], region='HL')
+    second = store.fetch(reduce, ZSTORE, [SFTLF], region='HL')
+    pd.testing.assert_frame_equal(first, second)
+    assert calls == [ZSTORE]
+
+    store.fetch(reduce, ZSTORE, [SFTLF], region='LL')
+    assert len(calls) == 2
+    assert not list(tmp_path.rglob("*.tmp"))
+    assert len(list(tmp_path.rglob("*.json"))) == 2
+
+
+def test_get_missing_key(tmp_path):
+    assert ReductionCache(str(tmp_path)).get(cache_key(ZSTORE)) is None
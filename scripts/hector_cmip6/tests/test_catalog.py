@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from hector_cmip6.catalog import (MissingFxError, availability_matrix, diff_snapshots, find_fx, parse_zstore,
+                                  select_complete, select_versions, stores_frame)
+
+
+def zstore(activity, source, experiment, member, table, variable, version, grid='gn'):
+    return "/".join(["gs://cmip6/CMIP6", activity, "INST", source, experiment, member, table, variable, grid,
+                     "v" + version]) + "/"
+
+
+def table(zstores):
+    out = stores_frame(zstores)
+    out['version'] = out['version'].astype(str)
+    return out
+
+
+# The pangeo table filtered to CMIP and ScenarioMIP and the full stores table, where ModelB only
+# has its sftlf under another activity.
+DAT = table([zstore('CMIP', 'ModelA', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101'),
+             zstore('CMIP', 'ModelA', 'historical', 'r1i1p1f1', 'fx', 'sftlf', '20190101'),
+             zstore('CMIP', 'ModelB', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101'),
+             zstore('ScenarioMIP', 'ModelB', 'ssp585', 'r1i1p1f1', 'Amon', 'tas', '20190101')])
+STORES = pd.concat([DAT, table([zstore('LUMIP', 'ModelB', 'hist-noLu', 'r1i1p1f1', 'fx', 'sftlf', '20190101'),
+                                zstore('CMIP', 'ModelC', 'historical', 'r1i1p1f1', 'fx', 'sftlf', '20190101', 'gr')])],
+                   ignore_index=True)
+
+
+def test_parse_zstore():
+    info = parse_zstore(zstore('CMIP', 'ModelA', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101'))
+    assert info['source_id'] == 'ModelA' and info['version'] == '20190101'
+    with pytest.raises(ValueError):
+        parse_zstore("gs://cmip6/tas")
+
+
+def test_fx_availability_matches_find_fx():
+    matrix = availability_matrix(DAT, ['tas'], fx_vars=['sftlf'], stores=STORES)
+    assert matrix['sftlf'].all()
+    for source in matrix.index.get_level_values('source_id'):
+        find_fx('sftlf', source, stores=STORES)
+
+    matrix = availability_matrix(DAT, ['tas'], fx_vars=['sftlf'], fx_grid_label='gr', stores=STORES)
+    assert not matrix['sftlf'].any()
+    with pytest.raises(MissingFxError):
+        find_fx('sftlf', 'ModelA', grid_label='gr', stores=STORES)
+
+
+def test_select_complete():
+    out = select_complete(DAT, ['tas'], fx_vars=['sftlf'], table_id='Amon', stores=STORES)
+    assert sorted(out['source_id']) == ['ModelA', 'ModelB', 'ModelB']
+
+
+def test_select_versions_and_diff():
+    old = table([zstore('CMIP', 'ModelA', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101'),
+                 zstore('CMIP', 'ModelB', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101')])
+    new = table([zstore('CMIP', 'ModelA', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101'),
+                 zstore('CMIP', 'ModelA', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20200101'),
+                 zstore('CMIP', 'ModelC', 'historical', 'r1i1p1f1', 'Amon', 'tas', '20190101')])
+    latest = select_versions(new)
+    assert sorted(latest['version']) == ['20190101', '20200101']
+    assert list(select_versions(new, 'earliest')['version']) == ['20190101', '20190101']
+
+    status = diff_snapshots(old, latest).set_index('source_id')['status']
+    assert status.to_dict() == {'ModelA': 'updated', 'ModelB': 'removed', 'ModelC': 'added'}
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from hector_cmip6.cube import TargetCube, export_cube, output_files
+
+
+def write_outputs(path):
+    rows = [{'model': 'CESM2', 'experiment': 'historical', 'ensemble': 'r1i1p1f1', 'variable': 'rh',
+             'year': y, 'value': float(y), 'units': 'Pg/yr'} for y in range(1850, 1860)]
+    pd.DataFrame(rows).to_csv(path / "CMIP6_annual_rh_land.csv", index=False)
+    rows = [{'variable': 'tas', 'model': 'CESM2', 'experiment': '1pctCO2', 'year': y, 'value': 0.1 * y,
+             'ensemble': 'r1i1p1f1'} for y in range(0, 150)]
+    pd.DataFrame(rows).to_csv(path / "CMIP6_idealized_tas_global.csv", index=False)
+
+
+def test_idealized_outputs_get_their_own_cube(tmp_path):
+    write_outputs(tmp_path)
+    assert [f.split("/")[-1] for f in output_files(path=str(tmp_path))] == ["CMIP6_annual_rh_land.csv"]
+
+    export_cube(str(tmp_path / "cube"), files=output_files(path=str(tmp_path)))
+    cube = TargetCube(str(tmp_path / "cube"))
+    assert cube.data.shape == (1, 1, 10)
+    assert cube.years[0] == 1850 and cube.meta['years'] == 'calendar'
+
+    export_cube(str(tmp_path / "idealized"), files=output_files(True, str(tmp_path)), idealized=True)
+    cube = TargetCube(str(tmp_path / "idealized"))
+    assert cube.data.shape == (1, 1, 150)
+    years, values = cube.series('idealized_tas_global', 'CESM2', '1pctCO2', 'r1i1p1f1', 10, 12)
+    assert list(years) == [10, 11, 12]
+    np.testing.assert_allclose(values, [1.0, 1.1, 1.2])
+
+
+def test_query(tmp_path):
+    write_outputs(tmp_path)
+    export_cube(str(tmp_path / "cube"), files=output_files(path=str(tmp_path)))
+    out = TargetCube(str(tmp_path / "cube")).query('rh_land', start=1855, complete=True)
+    assert list(out['year']) == list(range(1855, 1860))
+    assert (out['units'] == 'Pg/yr').all()
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hector_cmip6.ensemble import EnsembleStats
+
+
+def zstore(member, version="20190308"):
+    return "gs://cmip6/CMIP6/CMIP/CSIRO-ARCCSS/ACCESS-CM2/historical/" + member + "/Amon/tas/gn/v" + version + "/"
+
+
+def monthly(member, offset, years=(1850, 1851)):
+    """ Monthly series of one member, a seasonal cycle of +/- 10 around 280 + offset. """
+    rows = []
+    for year in years:
+        for month in range(1, 13):
+            rows.append({'variable': 'tas', 'experiment': 'historical', 'units': 'K', 'ensemble': member,
+                         'model': 'ACCESS-CM2', 'year': year, 'month': month,
+                         'value': 280 + offset + 10 * np.sin(2 * np.pi * month / 12)})
+    return pd.DataFrame(rows)
+
+
+def test_monthly_runs_count_once_per_year(tmp_path):
+    stats = EnsembleStats('tas', str(tmp_path))
+    stats.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+    stats.update(monthly('r2i1p1f1', 1.0), zstore('r2i1p1f1'))
+    out = stats.model_summary()
+    assert list(out['n']) == [2, 2]
+    np.testing.assert_allclose(out['mean'], 280.5)
+    np.testing.assert_allclose(out['sd'], np.std([0.0, 1.0], ddof=1))
+
+
+def test_rerun_is_not_counted_twice(tmp_path):
+    stats = EnsembleStats('tas', str(tmp_path))
+    stats.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+    stats.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+    assert list(stats.model_summary()['n']) == [1, 1]
+
+
+def test_new_version_replaces_the_old_one(tmp_path):
+    stats = EnsembleStats('tas', str(tmp_path))
+    stats.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+    stats.update(monthly('r2i1p1f1', 1.0), zstore('r2i1p1f1'))
+    stats.update(monthly('r1i1p1f1', 3.0), zstore('r1i1p1f1', "20210101"))
+
+    expected = EnsembleStats('tas', str(tmp_path / "expected"))
+    expected.update(monthly('r2i1p1f1', 1.0), zstore('r2i1p1f1'))
+    expected.update(monthly('r1i1p1f1', 3.0), zstore('r1i1p1f1', "20210101"))
+
+    reread = EnsembleStats('tas', str(tmp_path))
+    for s in [stats, reread]:
+        out = s.model_summary()
+        assert list(out['n']) == [2, 2]
+        np.testing.assert_allclose(out['mean'], expected.model_summary()['mean'])
+        np.testing.assert_allclose(out['sd'], expected.model_summary()['sd'])
+    assert len(reread.members) == 2
+
+
+def test_merge_shards(tmp_path):
+    shared = EnsembleStats('tas', str(tmp_path / "shared"))
+    shared.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+
+    shard = EnsembleStats('tas', str(tmp_path / "shard"), exclude=shared)
+    shard.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+    shard.update(monthly('r2i1p1f1', 2.0), zstore('r2i1p1f1'))
+    assert len(shard.members) == 1
+
+    shared.merge(shard)
+    out = shared.model_summary()
+    assert list(out['n']) == [2, 2]
+    np.testing.assert_allclose(out['mean'], 281.0)
+    with pytest.raises(ValueError):
+        shared.merge(shard)
+
+
+def test_runs_are_appended(tmp_path, monkeypatch):
+    from hector_cmip6 import ensemble
+
+    monkeypatch.setattr(ensemble, 'SAVE_EVERY', 2)
+    stats = EnsembleStats('tas', str(tmp_path))
+    stats.update(monthly('r1i1p1f1', 0.0), zstore('r1i1p1f1'))
+    # The moments are written every SAVE_EVERY runs, the logs with every run.
+    assert not (tmp_path / "tas.csv").exists()
+    assert len(pd.read_csv(stats.values_file)) == 2
+    stats.update(monthly('r2i1p1f1', 1.0), zstore('r2i1p1f1'))
+    assert len(pd.read_csv(stats.file)) == 2
+
+    # A new version is appended, the reread statistics only count it.
+    stats.update(monthly('r1i1p1f1', 3.0), zstore('r1i1p1f1', "20210101"))
+    assert len(pd.read_csv(stats.values_file)) == 6
+    assert len(pd.read_csv(stats.members_file)) == 3
+    reread = EnsembleStats('tas', str(tmp_path))
+    pd.testing.assert_frame_equal(reread.state, stats.state, check_dtype=False)
+    assert len(reread.values) == 4
+    np.testing.assert_allclose(reread.model_summary()['mean'], 282.0)
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import hector_cmip6.remote
+from hector_cmip6 import extract
+from hector_cmip6.products import get_product
+
+ZSTORE = "gs://cmip6/CMIP6/CMIP/NCAR/CESM2/historical/r1i1p1f1/Lmon/rh/gn/v20190308/"
+
+
+def dataset(variable='rh'):
+    """ Two years of monthly data on a 4 x 8 grid, chunked by year. """
+    time = xr.cftime_range("1850-01-01", periods=24, freq="MS", calendar="noleap")
+    lat = np.array([-60.0, -20.0, 20.0, 60.0])
+    lon = np.arange(0, 360, 45.0)
+    data = np.arange(24.0)[:, None, None] + np.zeros((24, 4, 8))
+    ds = xr.Dataset({variable: (('time', 'lat', 'lon'), data, {'units': 'kg m-2 s-1'})},
+                    coords={'time': time, 'lat': lat, 'lon': lon})
+    ds.attrs.update(experiment_id='historical', variant_label='r1i1p1f1', source_id='CESM2', frequency='mon')
+    return ds.chunk({'time': 12})
+
+
+@pytest.fixture
+def reduced(monkeypatch):
+    monkeypatch.setattr(hector_cmip6.remote, 'open_store', lambda zstore: dataset())
+
+    def weights(ds, variable, regions, area_fx='areacella', grid_label=None):
+        w = xr.DataArray(np.ones((4, 8)), dims=('lat', 'lon'), coords={'lat': ds.lat, 'lon': ds.lon})
+        return xr.concat([w * 2] * len(regions), dim=pd.Index(regions, name='region'))
+
+    monkeypatch.setattr(extract, 'product_weights', weights)
+    return extract._reduce(ZSTORE, {'rh': get_product('rh')})['rh']
+
+
+def test_columns_of_the_a_scripts(reduced, tmp_path):
+    spec = get_product('rh')
+    files = extract.write_product(reduced, 'rh', spec, out=str(tmp_path))
+    header = open(files[0]).readline().strip()
+    assert header == ",variable,experiment,units,frequency,ensemble,model,year,value,land_area"
+
+    df = pd.read_csv(files[0], index_col=0)
+    assert list(df['year']) == [1850, 1851]
+    np.testing.assert_allclose(df['value'], [5.5, 17.5])
+    np.testing.assert_allclose(df['land_area'], 64.0)
+    assert df['frequency'].iloc[0] == 'mon'
+
+
+def test_tos_columns():
+    cols = extract.product_columns(get_product('tos_global'))
+    assert cols == ['variable', 'experiment', 'units', 'ensemble', 'model', 'year', 'month', 'value', 'area']
+    assert not get_product('tos_global')['index_column']
+    assert extract.product_columns(get_product('tas'))[:4] == ['variable', 'experiment', 'units', 'frequency']
+
+
+def test_check_format():
+    extract.check_format('csv')
+    with pytest.raises(ValueError):
+        extract.check_format('netcdf')
+
+
+def test_parse_bytes():
+    assert extract.parse_bytes("8G") == 8 * 2 ** 30
+    assert extract.parse_bytes("512MB") == 512 * 2 ** 20
+    assert extract.parse_bytes(1000) == 1000
+    with pytest.raises(ValueError):
+        extract.parse_bytes("lots")
+
+
+def test_memory_ceiling_is_not_set_on_the_engine(tmp_path):
+    import resource
+
+    before = resource.getrlimit(resource.RLIMIT_AS)
+    extract.run_tasks([], None, None, {}, workers=1, max_mem="64G", out=str(tmp_path))
+    assert resource.getrlimit(resource.RLIMIT_AS) == before
+
+
+def exit_on_bad(zstore, group, cache_dir):
+    """ Stand-in for reduce_store whose worker dies on the BadModel store, i.e. killed for memory. """
+    import os
+    import time
+
+    if '/BadModel/' in zstore:
+        os._exit(1)
+    time.sleep(0.2)
+    return {name: zstore for name in group}, 1.0
+
+
+def test_worker_that_dies(monkeypatch, tmp_path):
+    from hector_cmip6.ensemble import EnsembleStats
+    from hector_cmip6.manifest import Manifest
+    from hector_cmip6.quarantine import Quarantine
+
+    monkeypatch.setattr(extract, 'reduce_store', exit_on_bad)
+    written = []
+    monkeypatch.setattr(extract, 'write_product', lambda frame, name, *args: written.append(frame))
+    manifest = Manifest(str(tmp_path / "manifest.csv"))
+    quarantine = Quarantine(str(tmp_path / "quarantine.csv"))
+
+    zstores = [ZSTORE.replace('CESM2', model) for model in ['A', 'BadModel', 'B', 'C', 'D']]
+    extract.run_tasks([(z, ['tas']) for z in zstores], manifest, quarantine, {'tas': EnsembleStats('tas', str(tmp_path))}, workers=2,
+                      out=str(tmp_path))
+    good = [z for z in zstores if '/BadModel/' not in z]
+    assert sorted(written) == sorted(good)
+    assert manifest.completed('tas') == set(good)
+    assert list(quarantine.table['zstore']) == [zstores[1]]
+    assert list(quarantine.table['reason']) == ['out_of_memory']
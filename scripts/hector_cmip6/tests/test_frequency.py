@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hector_cmip6.frequency import compact, daily_stats, days_in, temporal_means
+
+
+def monthly(years, model='ModelA'):
+    n = 12 * len(years)
+    return pd.DataFrame({'model': model, 'variable': 'tas',
+                         'year': np.repeat(years, 12), 'month': np.tile(np.arange(1, 13), len(years)),
+                         'value': np.arange(n, dtype='float64')})
+
+
+def test_compact_round_trip():
+    df = monthly([1850, 1851])
+    out = temporal_means(compact(df), ['monthly'])['monthly']
+    pd.testing.assert_frame_equal(out, df)
+
+
+def test_annual_and_seasonal_means():
+    df = pd.concat([monthly([1850, 1851]), monthly([1850], 'ModelB').iloc[:11]], ignore_index=True)
+    out = temporal_means(compact(df), ['annual', 'DJF', 'JJA'])
+
+    annual = out['annual']
+    assert list(annual.columns) == ['model', 'variable', 'year', 'value']
+    # ModelB has no complete year.
+    assert list(annual['model']) == ['ModelA', 'ModelA']
+    assert list(annual['value']) == [5.5, 17.5]
+
+    # The December of 1850 belongs to the winter of 1851, the winter of 1850 is not complete.
+    djf = out['DJF']
+    assert list(djf['year']) == [1851]
+    assert djf['value'].iloc[0] == pytest.approx(np.mean([11, 12, 13]))
+    assert list(out['JJA'].loc[out['JJA']['model'] == 'ModelA', 'value']) == [6.0, 18.0]
+
+
+def test_unknown_frequency():
+    with pytest.raises(ValueError):
+        temporal_means(monthly([1850]), ['weekly'])
+
+
+def test_days_in():
+    assert days_in(2000, 2) == 29
+    assert days_in(2000, 2, 'noleap') == 28
+    assert days_in(2000, calendar='360_day') == 360
+    assert days_in(2001) == 365
+
+
+def test_daily_stats():
+    days = pd.date_range("1850-01-01", "1850-02-27")
+    df = pd.DataFrame({'model': 'ModelA', 'calendar': 'noleap', 'year': days.year, 'month': days.month,
+                       'day': days.day, 'value': np.arange(len(days), dtype='float64'),
+                       'over_300': np.where(days.day <= 10, 0.5, 0.0)})
+    out = daily_stats(compact(df), ['monthly', 'annual'])
+
+    # February is one day short and the year is not complete.
+    monthly_stats = out['monthly']
+    assert list(monthly_stats['month']) == [1]
+    assert monthly_stats['mean'].iloc[0] == 15.0
+    assert monthly_stats['max'].iloc[0] == 30.0
+    assert monthly_stats['days_over_300'].iloc[0] == 5.0
+    assert out['annual'].empty
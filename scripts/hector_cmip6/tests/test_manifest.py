@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+
+from hector_cmip6.manifest import Manifest, plan_updates
+
+
+def zstore(source, member, version):
+    return "/".join(["gs://cmip6/CMIP6/CMIP/INST", source, "historical", member, "Amon", "tas", "gn",
+                     "v" + version]) + "/"
+
+
+A = zstore('ModelA', 'r1i1p1f1', '20190101')
+B = zstore('ModelB', 'r1i1p1f1', '20190101')
+B_NEW = zstore('ModelB', 'r1i1p1f1', '20200101')
+C = zstore('ModelC', 'r1i1p1f1', '20190101')
+
+
+def test_manifest_record_and_reload(tmp_path):
+    path = str(tmp_path / "manifest.csv")
+    manifest = Manifest(path)
+    manifest.record('tas_global', A, 1.234)
+    manifest.record('tas_land', A, 2.0)
+    assert manifest.completed('tas_global') == {A}
+    assert Manifest(path).completed('tas_land') == {A}
+
+    manifest.forget('tas_global', [A])
+    assert Manifest(path).completed('tas_global') == set()
+    assert Manifest(path).completed('tas_land') == {A}
+
+
+def test_manifest_merge(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.csv"))
+    shard = Manifest(str(tmp_path / "shard.csv"))
+    shard.record('tas_global', B, 1.0)
+    manifest.merge(shard)
+    assert Manifest(manifest.path).completed('tas_global') == {B}
+
+
+def test_plan_updates(tmp_path):
+    snapshots = str(tmp_path / "snapshots")
+    manifest = Manifest(str(tmp_path / "manifest.csv"))
+
+    # First run, nothing is done yet.
+    assert plan_updates([A, B], 'tas_global', manifest, snapshot_dir=snapshots) == [A, B]
+    manifest.record('tas_global', A, 1.0)
+    manifest.record('tas_global', B, 1.0)
+    assert plan_updates([A, B], 'tas_global', manifest, snapshot_dir=snapshots) == []
+
+    # ModelB is re-versioned, ModelC is added and ModelA is removed from the catalog.
+    assert plan_updates([B_NEW, C], 'tas_global', manifest, snapshot_dir=snapshots) == [B_NEW, C]
+    assert manifest.completed('tas_global') == set()
+
+    delta = pd.read_csv(os.path.join(snapshots, "tas_global_delta.csv"))
+    status = dict(zip(delta['source_id'], delta['status']))
+    assert status == {'ModelA': 'removed', 'ModelB': 'updated', 'ModelC': 'added'}
+    assert list(pd.read_csv(os.path.join(snapshots, "tas_global.csv"))['zstore']) == [B_NEW, C]
+
+
+def test_plan_updates_snapshot_name(tmp_path):
+    snapshots = str(tmp_path / "snapshots")
+    manifest = Manifest(str(tmp_path / "manifest.csv"))
+    plan_updates([A], 'heat_flux', manifest, name='hfls', snapshot_dir=snapshots)
+    assert os.path.exists(os.path.join(snapshots, "hfls.csv"))
+    assert not os.path.exists(os.path.join(snapshots, "heat_flux.csv"))
+
+
+def test_plan_updates_dry_run(tmp_path):
+    snapshots = str(tmp_path / "snapshots")
+    manifest = Manifest(str(tmp_path / "manifest.csv"))
+    plan_updates([A, B], 'tas_global', manifest, snapshot_dir=snapshots)
+    manifest.record('tas_global', A, 1.0)
+    manifest.record('tas_global', B, 1.0)
+    before = open(manifest.path).read()
+
+    # The re-versioned store is planned, but nothing is forgotten or written.
+    assert plan_updates([A, B_NEW], 'tas_global', manifest, snapshot_dir=snapshots, dry_run=True) == [B_NEW]
+    assert open(manifest.path).read() == before
+    assert manifest.completed('tas_global') == {A, B}
+    assert list(pd.read_csv(os.path.join(snapshots, "tas_global.csv"))['zstore']) == [A, B]
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from hector_cmip6.qc import FLAG_COLS, TOS_RULES, apply_flags, run_qc
+
+
+def tos(model, ensemble, hl, ll, glob, years=(1850, 1851)):
+    rows = []
+    for year in years:
+        for area, value in [('HL', hl), ('LL', ll), ('global', glob)]:
+            rows.append({'model': model, 'experiment': 'historical', 'ensemble': ensemble, 'variable': 'tos',
+                         'area': area, 'year': year, 'value': value})
+    return pd.DataFrame(rows)
+
+
+def test_tos_rules():
+    good = tos('ModelA', 'r1i1p1f1', 2.0, 20.0, 0.15 * 2.0 + 0.85 * 20.0)
+    cold = tos('ModelB', 'r1i1p1f1', 2.0, 15.0, 0.15 * 2.0 + 0.85 * 15.0)
+    off = tos('ModelC', 'r1i1p1f1', 2.0, 20.0, 20.0)
+    data = pd.concat([good, cold, off], ignore_index=True)
+
+    flags = run_qc(data, TOS_RULES)
+    assert list(flags.columns) == FLAG_COLS
+    assert set(flags.loc[flags['rule'] == 'tos_consistency', 'model']) == {'ModelC'}
+    assert (flags.loc[flags['rule'] == 'tos_consistency', 'scope'] == 'row').all()
+    run = flags[flags['rule'] == 'tos_global_1850']
+    assert list(run['model']) == ['ModelB']
+    assert np.isnan(run['year'].iloc[0])
+
+    # Every area of an inconsistent year is removed.
+    assert len(flags[flags['rule'] == 'tos_consistency']) == 6
+    out = apply_flags(data, flags)
+    pd.testing.assert_frame_equal(out, good)
+
+
+def test_missing_area_is_flagged():
+    data = tos('ModelA', 'r1i1p1f1', 2.0, 20.0, 17.3)
+    data = data[~((data['area'] == 'HL') & (data['year'] == 1851))]
+    flags = run_qc(data, TOS_RULES[:1])
+    assert set(flags['year']) == {1851}
+    assert flags['reason'].str.startswith("missing").all()
+
+
+def test_model_scope_and_no_flags():
+    years = np.arange(0, 150)
+    data = pd.DataFrame({'model': 'ModelA', 'experiment': 'abrupt-4xCO2', 'ensemble': 'r1i1p1f1',
+                         'variable': 'tas', 'year': years, 'value': 285.0})
+    rules = [{'name': 'tas_bounds', 'check': 'range', 'variable': 'tas', 'lower': 270, 'upper': 300,
+              'scope': 'model'}]
+    assert run_qc(data, rules).empty
+
+    data.loc[10:12, 'value'] = 310.0
+    flags = run_qc(data, rules)
+    assert len(flags) == 1
+    assert flags['reason'].iloc[0].startswith("3 failing value(s), first in 10")
+    assert apply_flags(data, flags).empty
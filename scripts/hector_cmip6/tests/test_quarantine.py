@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from hector_cmip6.catalog import MissingFxError
+from hector_cmip6.quarantine import PERMANENT, Quarantine, classify_failure, run_safely
+
+ZSTORE = "gs://cmip6/CMIP6/CMIP/NCAR/CESM2/historical/r1i1p1f1/Amon/tas/gn/v20190308/"
+
+
+def raised(func):
+    try:
+        func()
+    except Exception as e:
+        return e
+    raise AssertionError("no exception raised")
+
+
+def test_classify_by_type():
+    assert classify_failure(MissingFxError("no sftlf")) == 'missing_fx'
+    assert classify_failure(MemoryError()) == 'out_of_memory'
+    assert classify_failure(TimeoutError("read")) == 'timeout'
+    assert classify_failure(raised(lambda: b'\xff'.decode())) == 'decode_error'
+
+
+def test_classify_alignment_errors():
+    a = xr.DataArray(np.zeros(3), dims='x')
+    b = xr.DataArray(np.zeros(4), dims='x')
+    assert classify_failure(raised(lambda: a + b)) == 'shape_mismatch'
+    assert classify_failure(raised(lambda: np.zeros(3) + np.zeros(4))) == 'shape_mismatch'
+
+
+def test_unclassified_failures_are_retried():
+    for exc in [ValueError("wrong shape of the output"), KeyError('dimension'), TypeError("can't decode"),
+                RuntimeError("connection reset by peer")]:
+        reason = classify_failure(exc)
+        assert reason == 'other'
+        assert reason not in PERMANENT
+
+
+def test_exclude_only_skips_permanent_failures(tmp_path):
+    quarantine = Quarantine(str(tmp_path / "quarantine.csv"))
+    other = ZSTORE.replace("r1i1p1f1", "r2i1p1f1")
+    run_safely(lambda z: 1 / 0, ZSTORE, 'tas', quarantine)
+    quarantine.add('tas', other, 'missing_fx')
+
+    reread = Quarantine(str(tmp_path / "quarantine.csv"))
+    assert list(reread.table['reason']) == ['other', 'missing_fx']
+    assert reread.exclude([ZSTORE, other], 'tas') == [ZSTORE]
+    assert reread.exclude([ZSTORE, other], 'tas_land') == [ZSTORE, other]
+
+
+def test_whole_model(tmp_path):
+    quarantine = Quarantine(str(tmp_path / "quarantine.csv"))
+    quarantine.add('tas', ZSTORE, 'manual')
+    quarantine.table.loc[0, 'zstore'] = ""
+    assert quarantine.exclude([ZSTORE.replace("r1i1p1f1", "r3i1p1f1")], 'tas') == []
+
+
+@pytest.mark.parametrize('reason', ['timeout', 'out_of_memory'])
+def test_transient_failures_are_retried(tmp_path, reason):
+    quarantine = Quarantine(str(tmp_path / "quarantine.csv"))
+    quarantine.add('tas', ZSTORE, reason)
+    assert quarantine.exclude([ZSTORE], 'tas') == [ZSTORE]
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hector_cmip6 import schedule
+from hector_cmip6.manifest import Manifest
+from hector_cmip6.schedule import dataset_key, estimate_cost, fit_rates, largest_first, n_chunks
+
+
+def zstore(source, version='20190101'):
+    return "/".join(["gs://cmip6/CMIP6/CMIP/INST", source, "historical", "r1i1p1f1", "Amon", "tas", "gn",
+                     "v" + version]) + "/"
+
+
+def index(sources, nbytes, shape="120x10x10", chunks="12x10x10"):
+    return pd.DataFrame({'zstore': [zstore(s) for s in sources], 'nbytes': nbytes,
+                         'shape': shape, 'chunks': chunks})
+
+
+def test_n_chunks():
+    assert n_chunks("1980x180x288", "600x180x288") == 4
+    assert n_chunks("10x5", "3x5") == 4
+    assert n_chunks(np.nan, "600x180x288") == 1
+
+
+def test_dataset_key_drops_version():
+    assert dataset_key(zstore('ModelA')) == dataset_key(zstore('ModelA', '20200101'))
+    assert dataset_key(zstore('ModelA')) != dataset_key(zstore('ModelB'))
+
+
+def test_estimate_cost_from_index():
+    cost = estimate_cost([zstore('ModelA'), zstore('ModelB'), zstore('ModelC')],
+                         index(['ModelA', 'ModelB'], [50e6, 500e6]))
+    assert cost[zstore('ModelA')] == pytest.approx(1 + 10 * schedule.SECONDS_PER_CHUNK)
+    assert cost[zstore('ModelB')] == pytest.approx(10 + 10 * schedule.SECONDS_PER_CHUNK)
+    # Not in the index, the median of the others.
+    assert cost[zstore('ModelC')] == pytest.approx(cost[[zstore('ModelA'), zstore('ModelB')]].median())
+
+
+def test_estimate_cost_uses_timings(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.csv"))
+    manifest.record('tas_global', zstore('ModelA', '20180101'), 120.0)
+    # Served from the cache, not a timing.
+    manifest.record('tas_land', zstore('ModelB'), 0.1)
+    cost = estimate_cost([zstore('ModelA'), zstore('ModelB')], index(['ModelA', 'ModelB'], [50e6, 50e6]), manifest)
+    assert cost[zstore('ModelA')] == 120.0
+    assert cost[zstore('ModelB')] == pytest.approx(1 + 10 * schedule.SECONDS_PER_CHUNK)
+
+
+def test_fit_rates():
+    sources = ['Model' + str(i) for i in range(12)]
+    nbytes = np.arange(1, 13) * 1e8
+    chunks = np.array([3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5, 8])
+    idx = index(sources, nbytes, [str(12 * c) + "x10x10" for c in chunks], "12x10x10")
+    seconds = pd.Series(nbytes / 2e7 + chunks * 0.5, index=[dataset_key(z) for z in idx['zstore']])
+    bytes_per_second, seconds_per_chunk = fit_rates(idx, seconds)
+    assert bytes_per_second == pytest.approx(2e7)
+    assert seconds_per_chunk == pytest.approx(0.5)
+
+    # Too few timings to fit.
+    assert fit_rates(idx, seconds.iloc[:5]) == (schedule.BYTES_PER_SECOND, schedule.SECONDS_PER_CHUNK)
+
+
+def test_largest_first():
+    cost = pd.Series({'a': 1.0, 'b': 5.0, 'c': 5.0, 'd': 3.0})
+    tasks = [(z, ['tas_global']) for z in ['a', 'b', 'c', 'd']]
+    assert [z for z, _ in largest_first(tasks, cost)] == ['b', 'c', 'd', 'a']
+
+
+def test_duplicated_zstore():
+    # A store in two product groups, i.e. tos_global and tos_HL, is listed twice.
+    tasks = [(zstore('ModelA'), ['tos_global']), (zstore('ModelB'), ['tos_global']), (zstore('ModelA'), ['tos_HL'])]
+    cost = estimate_cost([z for z, _ in tasks], index(['ModelA', 'ModelB'], [50e6, 500e6]))
+    assert list(cost.index) == [zstore('ModelA'), zstore('ModelB')]
+    out = largest_first(tasks, cost)
+    assert [n for _, n in out] == [['tos_global'], ['tos_global'], ['tos_HL']]
+    assert [z for z, _ in out] == [zstore('ModelB'), zstore('ModelA'), zstore('ModelA')]
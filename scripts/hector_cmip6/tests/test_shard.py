@@ -0,0 +1,125 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from hector_cmip6 import shard
+from hector_cmip6.manifest import Manifest
+from hector_cmip6.shard import PLAN_COLS, assign_shards, claim, is_claimed, merge_shards, run_shard
+
+
+def test_assign_shards_balances_cost():
+    sizes = pd.Series({'a': 8.0, 'b': 7.0, 'c': 6.0, 'd': 5.0, 'e': 4.0, 'f': 2.0})
+    out = assign_shards(sizes, 2)
+    assert list(out.index) == list(sizes.index)
+    load = sizes.groupby(out).sum()
+    assert load.max() - load.min() <= 2.0
+    pd.testing.assert_series_equal(out, assign_shards(sizes, 2))
+    assert assign_shards(sizes, 1).eq(0).all()
+    with pytest.raises(ValueError):
+        assign_shards(sizes, 0)
+
+
+def test_claim(tmp_path):
+    work = str(tmp_path)
+    assert not is_claimed(work, 'a', 'tas_global')
+    assert claim(work, 'a', 0, 'tas_global')
+    assert is_claimed(work, 'a', 'tas_global')
+    # A resubmitted shard takes its own claim again, no other shard does.
+    assert claim(work, 'a', 0, 'tas_global')
+    assert not claim(work, 'a', 1, 'tas_global')
+    # The same store for other products is claimed on its own.
+    assert not is_claimed(work, 'a', 'tas_land')
+    assert claim(work, 'a', 1, 'tas_land')
+
+
+def setup_work(tmp_path, stores):
+    """ Write a plan of tas_global stores with their cost and shard, and fake the reduction. """
+    work = str(tmp_path / "work")
+    os.makedirs(work)
+    plan = pd.DataFrame(stores, columns=['zstore', 'cost', 'shard'])
+    plan['products'] = 'tas_global'
+    plan['nbytes'] = 1
+    plan = plan.sort_values(['shard', 'cost', 'zstore'], ascending=[True, False, True])
+    plan[PLAN_COLS].to_csv(os.path.join(work, "plan.csv"), index=False)
+    settings = {'products': ['tas_global'], 'shards': int(plan['shard'].max()) + 1,
+                'out': str(tmp_path / "out"), 'fmt': 'csv', 'frequencies': None,
+                'inputs_dir': str(tmp_path / "inputs"), 'stats_dir': str(tmp_path / "stats")}
+    with open(os.path.join(work, "settings.json"), "w") as js:
+        json.dump(settings, js)
+    os.makedirs(settings['inputs_dir'])
+    return work
+
+
+@pytest.fixture
+def reduce_stores(monkeypatch):
+    """ Replace run_tasks with one that records every store and writes one file per store. """
+    order = []
+
+    def run_tasks(tasks, manifest, quarantine, stats, workers, max_mem, out, fmt, frequencies, cache_dir):
+        for zstore, names in tasks:
+            order.append(zstore)
+            os.makedirs(out, exist_ok=True)
+            open(os.path.join(out, zstore + ".csv"), "w").close()
+            for name in names:
+                manifest.record(name, zstore, 1.0)
+
+    monkeypatch.setattr(shard, 'run_tasks', run_tasks)
+    return order
+
+
+STORES = [('a', 9.0, 0), ('b', 1.0, 0), ('c', 5.0, 1), ('d', 4.0, 1), ('e', 3.0, 1), ('f', 2.0, 2)]
+
+
+def test_run_shard_steals(tmp_path, reduce_stores):
+    work = setup_work(tmp_path, STORES)
+    # Shard 1 has the most work left, its cheapest store is taken first.
+    assert run_shard(work, 0) == ['a', 'b', 'e', 'd', 'c', 'f']
+    assert run_shard(work, 1) == []
+    assert run_shard(work, 2) == []
+
+
+def test_run_shard_skips_claimed(tmp_path, reduce_stores):
+    work = setup_work(tmp_path, STORES)
+    claim(work, 'd', 1, 'tas_global')
+    assert run_shard(work, 0, steal=False) == ['a', 'b']
+    assert run_shard(work, 2) == ['f', 'e', 'c']
+    with pytest.raises(ValueError):
+        run_shard(work, 3)
+
+
+def test_merge_shards(tmp_path, reduce_stores):
+    work = setup_work(tmp_path, STORES)
+    run_shard(work, 1, steal=False)
+    run_shard(work, 0)
+    summary = merge_shards(work)
+    assert list(summary['completed']) == [3, 3]
+    assert list(summary['planned']) == [2, 3]
+    assert sorted(os.listdir(tmp_path / "out")) == [z + ".csv" for z in "abcdef"]
+    manifest = Manifest(str(tmp_path / "inputs" / "manifest.csv"))
+    assert manifest.completed('tas_global') == set("abcdef")
+    assert not os.path.exists(os.path.join(work, "claims"))
+
+    # A rerun of a merged shard has nothing left to do.
+    assert run_shard(work, 2) == []
+
+
+
+def test_store_in_two_product_groups(tmp_path, reduce_stores):
+    work = setup_work(tmp_path, [('a', 9.0, 0), ('b', 1.0, 0), ('c', 5.0, 1)])
+    plan = pd.read_csv(os.path.join(work, "plan.csv"))
+    row = pd.DataFrame([{'zstore': 'a', 'products': 'tas_land', 'nbytes': 1, 'cost': 9.0, 'shard': 0}])
+    pd.concat([plan.iloc[:1], row, plan.iloc[1:]])[PLAN_COLS].to_csv(os.path.join(work, "plan.csv"), index=False)
+    with open(os.path.join(work, "settings.json")) as js:
+        settings = json.load(js)
+    settings['products'] = ['tas_global', 'tas_land']
+    with open(os.path.join(work, "settings.json"), "w") as js:
+        json.dump(settings, js)
+
+    # Shard 1 has taken the tas_global row of a, shard 0 still reduces a for tas_land.
+    assert claim(work, 'a', 1, 'tas_global')
+    assert run_shard(work, 0) == ['a', 'b', 'c']
+    manifest = Manifest(os.path.join(shard.shard_dir(work, 0), "manifest.csv"))
+    assert manifest.completed('tas_land') == {'a'}
+    assert manifest.completed('tas_global') == {'b', 'c'}
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from hector_cmip6.reduce import region_weights
+from hector_cmip6.stream import stream_means, stream_stats
+
+
+def field(nan=False):
+    rng = np.random.default_rng(0)
+    data = rng.normal(280, 10, (36, 6, 12))
+    if nan:
+        data[:, 0, :3] = np.nan
+    time = xr.cftime_range("1850-01-01", periods=36, freq="MS", calendar="noleap")
+    lat = np.linspace(-75, 75, 6)
+    lon = np.arange(0, 360, 30.0)
+    da = xr.DataArray(data, dims=('time', 'lat', 'lon'), coords={'time': time, 'lat': lat, 'lon': lon})
+    return da.chunk({'time': 12, 'lat': 3, 'lon': 6})
+
+
+def weights(da):
+    area = np.cos(np.deg2rad(da['lat'])).broadcast_like(da.isel(time=0, drop=True))
+    land = xr.zeros_like(area)
+    land[1:3, 2:8] = 100
+    return region_weights(area, land, hemispheres=True)
+
+
+def test_stream_means_match_xarray():
+    da = field(nan=True)
+    w = weights(da)
+    out = stream_means(da, w, skipna=True)
+    for region in w['region'].values:
+        wr = w.sel(region=region)
+        expected = (da * wr).sum(['lat', 'lon']) / (wr * da.notnull()).sum(['lat', 'lon'])
+        np.testing.assert_allclose(out.sel(region=region), expected, rtol=1e-6)
+
+
+def test_skipna_false_divides_by_the_total_weight():
+    da = field(nan=True)
+    w = weights(da).sel(region='land')
+    out = stream_means(da, w, skipna=False)
+    expected = (da.fillna(0) * w).sum(['lat', 'lon']) / w.sum()
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+
+
+def test_thresholds():
+    da = field()
+    w = weights(da).sel(region='global')
+    out = stream_stats(da, w, thresholds=[280.0])
+    expected = ((da > 280) * w).sum(['lat', 'lon']) / w.sum()
+    np.testing.assert_allclose(out['over'].sel(threshold=280.0), expected, rtol=1e-6)
+    assert list(pd.Index(out['mean'].dims)) == ['time']
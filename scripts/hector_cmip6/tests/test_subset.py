@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from hector_cmip6.helpers import global_mean
+from hector_cmip6.subset import select_level, select_years, year_window
+
+
+def co2(chunks=None):
+    """ Monthly co2 on three levels, 1000 hPa is below the surface in the first latitude row. """
+    time = xr.cftime_range("1850-01-01", periods=24, freq="MS", calendar="noleap")
+    plev = np.array([100000.0, 85000.0, 50000.0])
+    lat = np.array([-45.0, 0.0, 45.0])
+    lon = np.arange(0, 360, 90.0)
+    data = np.zeros((24, 3, 3, 4)) + np.array([400.0, 390.0, 380.0])[None, :, None, None]
+    data[:, 0, 0, :] = np.nan
+    ds = xr.Dataset({'co2': (('time', 'plev', 'lat', 'lon'), data, {'units': 'ppm'})},
+                    coords={'time': time, 'plev': plev, 'lat': lat, 'lon': lon})
+    return ds if chunks is None else ds.chunk(chunks)
+
+
+def test_surface_is_the_lowest_level_with_data():
+    out = select_level(co2({'time': 12, 'plev': 1}), 'surface')
+    assert 'plev' not in out.dims
+    surface = out['co2'].isel(time=0).values
+    np.testing.assert_allclose(surface[0], 390.0)
+    np.testing.assert_allclose(surface[1:], 400.0)
+    assert out['co2'].attrs['units'] == 'ppm'
+
+
+def test_single_level():
+    out = select_level(co2(), 50000)
+    np.testing.assert_allclose(out['co2'], 380.0)
+    with pytest.raises(ValueError):
+        select_level(co2(), 70000)
+
+
+def test_global_mean_leaves_missing_cells_out():
+    out = global_mean(co2().isel(plev=0))
+    np.testing.assert_allclose(out['co2'], 400.0)
+
+
+def test_select_years():
+    ds = co2()
+    assert year_window({(None, 'historical'): (1851, 1851)}, 'co2', 'historical') == (1851, 1851)
+    out = select_years(ds, (1851, 1851))
+    assert list(np.unique(out['time'].dt.year)) == [1851]
+    with pytest.raises(ValueError):
+        select_years(ds, (1900, 1910))
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from hector_cmip6.warming_ratio import sample_ratio, warming_ratio, write_parameter_sets
+
+
+def temperatures():
+    """ Two runs of 90 years, listed CanESM5 before CESM2 as in the cleaned 1pctCO2 file. """
+    rows = []
+    for model, ratio in [('CanESM5', 1.5), ('CESM2', 2.0)]:
+        for area, slope in [('Land', ratio * 0.02), ('Ocean', 0.02)]:
+            for year in range(90):
+                rows.append({'model': model, 'experiment': '1pctCO2', 'ensemble': 'r1i1p1f1', 'area': area,
+                             'year': year, 'value': 280 + slope * year + 0.01 * np.sin(year)})
+    return pd.DataFrame(rows)
+
+
+def test_ratio_in_input_order():
+    out = warming_ratio(temperatures(), window=30)
+    assert list(out['model']) == ['CanESM5', 'CanESM5', 'CESM2', 'CESM2']
+    assert list(out['year']) == [45, 75, 45, 75]
+    np.testing.assert_allclose(out['ratio'], [1.5, 1.5, 2.0, 2.0], rtol=1e-2)
+
+
+def test_parameter_sets_are_reproducible(tmp_path):
+    ratios = warming_ratio(temperatures(), window=30)
+    a = write_parameter_sets(str(tmp_path / "a.csv"), ratios, 2500, seed=1, chunk=1000)
+    b = write_parameter_sets(str(tmp_path / "b.csv"), ratios, 2500, seed=1, chunk=1000)
+    assert open(a).read() == open(b).read()
+    assert list(pd.read_csv(a)['run_id']) == list(range(1, 2501))
+    assert set(np.round(sample_ratio(ratios, 100, method='bootstrap', seed=0, jitter=False), 1)) <= {1.5, 2.0}
@@ -0,0 +1,111 @@
+""" Land-ocean warming ratio and samples of it for Hector.
+
+The ratio of every model, experiment and ensemble member is computed at once
+from the long land/ocean temperature data: the years are cut into windows
+(30 years by default), the first window is the base, and for every later window
+the ratio is the mean land anomaly over the mean ocean anomaly, with the
+standard error propagated from the window and base means. sample_ratio draws
+any number of values, seeded and vectorized, either from a normal distribution
+fitted to the model ratios or from a bootstrap over the models, and
+write_parameter_sets writes them as Hector parameter sets.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+RUN_COLS = ['model', 'experiment', 'ensemble']
+
+# Name of the land-ocean warming ratio parameter in Hector.
+PARAMETER = 'lo_warming_ratio'
+
+
+def warming_ratio(data, window=30, land='Land', ocean='Ocean'):
+    """ Land-ocean warming ratio of every run.
+    :param data:    pd data frame with model, experiment, ensemble, area, year and value columns,
+                    years counted from the start of each run (see D0.qc.py).
+    :param window:  int number of years per window, the first window is the base.
+    :param land:    str area of the land temperature.
+    :param ocean:   str area of the ocean temperature.
+    :return:        pd data frame with model, experiment, ensemble, year (middle of the window),
+                    ratio and error, only complete windows are used. The runs are in the order
+                    they first appear in data, the windows in time order.
+    """
+    data = data[data['area'].isin([land, ocean])]
+    data = data.assign(window=data['year'] // window)
+
+    # Mean, variance and length of every run/area/window in one pass.
+    stats = data.groupby(RUN_COLS + ['area', 'window'])['value'].agg(['mean', 'var', 'count'])
+    stats = stats[stats['count'] == window].unstack('area').dropna()
+    base = stats.xs(0, level='window')
+    stats = stats.drop(index=0, level='window')
+    base = base.reindex(stats.index.droplevel('window'))
+    base.index = stats.index
+
+    # Anomalies relative to the base window and the standard error of their means.
+    dl = stats[('mean', land)] - base[('mean', land)]
+    do = stats[('mean', ocean)] - base[('mean', ocean)]
+    se_l = np.sqrt((stats[('var', land)] + base[('var', land)]) / window)
+    se_o = np.sqrt((stats[('var', ocean)] + base[('var', ocean)]) / window)
+    ratio = dl / do
+
+    out = pd.DataFrame({'ratio': ratio, 'error': ratio.abs() * np.sqrt((se_l / dl) ** 2 + (se_o / do) ** 2)})
+    out = out.reset_index()
+    out['year'] = out['window'] * window + window // 2
+
+    # groupby sorts the runs, put them back in the order of the input.
+    order = data[RUN_COLS].drop_duplicates().reset_index(drop=True)
+    order['run'] = order.index
+    out = out.merge(order, on=RUN_COLS).sort_values(['run', 'year'], kind='stable')
+    return out[RUN_COLS + ['year', 'ratio', 'error']].reset_index(drop=True)
+
+
+def sample_ratio(ratios, n, method='normal', seed=None, jitter=True):
+    """ Draw samples of the land-ocean warming ratio.
+    :param ratios:  pd data frame returned by warming_ratio, filter it first to use i.e. a single
+                    window year.
+    :param n:       int number of samples.
+    :param method:  str 'normal' draws from a normal distribution with the mean and sd of the
+                    ratios (what distributionInHector.R did), 'bootstrap' resamples the models.
+    :param seed:    optional int seed of the random number generator.
+    :param jitter:  bool, for the bootstrap add normal noise with the error of the drawn ratio.
+    :return:        np array of n samples.
+    """
+    rng = np.random.default_rng(seed)
+    if method == 'normal':
+        return rng.normal(ratios['ratio'].mean(), ratios['ratio'].std(), size=n)
+
+    if method != 'bootstrap':
+        raise RuntimeError("unknown sampling method " + str(method))
+
+    # Every model counts once, whatever its number of ensemble members and windows.
+    models = ratios.groupby('model')[['ratio', 'error']].mean()
+    pick = rng.integers(0, len(models), size=n)
+    out = models['ratio'].values[pick]
+    if jitter:
+        out = out + rng.standard_normal(n) * models['error'].values[pick]
+    return out
+
+
+def write_parameter_sets(path, ratios, n, method='normal', seed=None, chunk=1000000, **kwargs):
+    """ Write samples of the warming ratio as Hector parameter sets, one run per row. Samples are
+    drawn and written in chunks so n is not limited by memory.
+    :param path:    str csv file to write, with run_id and lo_warming_ratio columns.
+    :param ratios:  pd data frame returned by warming_ratio.
+    :param n:       int number of parameter sets.
+    :param method:  str sampling method, see sample_ratio.
+    :param seed:    optional int seed, the same seed and chunk size give the same file.
+    :param chunk:   int number of samples per chunk.
+    :param kwargs:  passed on to sample_ratio.
+    :return:        str path
+    """
+    seeds = np.random.SeedSequence(seed).spawn(int(np.ceil(n / chunk)))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        for i, s in enumerate(seeds):
+            size = min(chunk, n - i * chunk)
+            values = sample_ratio(ratios, size, method=method, seed=s, **kwargs)
+            df = pd.DataFrame({'run_id': np.arange(i * chunk, i * chunk + size) + 1, PARAMETER: values})
+            df.to_csv(f, header=(i == 0), index=False)
+    return path